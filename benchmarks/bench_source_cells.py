@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from photo_mosaic.config import MosaicConfig, TileShape
+from photo_mosaic.core.image_utils import average_rgb, average_rgb_masked, hex_mask
+from photo_mosaic.core.mosaic import _compute_layout, _source_cell_rgbs
+
+
+def _legacy_cell_rgbs(image: Image.Image, positions, tile_size, mask) -> np.ndarray:
+    # Per-cell crop + pure-Python average, as _source_cell_rgbs used to do.
+    tile_w, tile_h = tile_size
+    max_x = max(0, image.size[0] - tile_w)
+    max_y = max(0, image.size[1] - tile_h)
+    rgbs = []
+    for x, y in positions:
+        left, top = min(x, max_x), min(y, max_y)
+        patch = image.crop((left, top, left + tile_w, top + tile_h))
+        rgbs.append(average_rgb(patch) if mask is None else average_rgb_masked(patch, mask))
+    return np.array(rgbs, dtype=np.float32)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark source cell feature extraction")
+    parser.add_argument("--size", type=int, default=2048, help="Square output size in pixels")
+    parser.add_argument("--tile", type=int, default=16)
+    parser.add_argument("--shape", choices=[s.value for s in TileShape], default=TileShape.RECT.value)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    shape = TileShape(args.shape)
+    config = MosaicConfig(
+        source_image=Path("source.png"),
+        tile_dirs=[Path(".")],
+        output_path=Path("out.png"),
+        tile_width=args.tile,
+        tile_height=args.tile,
+        output_width=args.size,
+        output_height=args.size,
+        tile_shape=shape,
+    )
+    layout = _compute_layout((args.size, args.size), config)
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, size=(layout.canvas_size[1], layout.canvas_size[0], 3), dtype=np.uint8), "RGB")
+    mask = hex_mask(config.tile_size, config.hex_edge_softness) if shape == TileShape.HEX else None
+
+    start = time.perf_counter()
+    fast = _source_cell_rgbs(image, layout, config.tile_size, shape, config.hex_edge_softness)
+    fast_s = time.perf_counter() - start
+    print(f"cells={len(layout.positions)} shape={shape.value} vectorized={fast_s:.3f}s")
+
+    if args.skip_legacy:
+        return
+    start = time.perf_counter()
+    legacy = _legacy_cell_rgbs(image, layout.positions, config.tile_size, mask)
+    legacy_s = time.perf_counter() - start
+    max_err = float(np.max(np.abs(fast - legacy)))
+    print(f"legacy={legacy_s:.3f}s speedup={legacy_s / fast_s:.1f}x max_abs_diff={max_err:.2e}")
+
+
+if __name__ == "__main__":
+    main()
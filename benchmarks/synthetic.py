@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# (extension, Pillow format, share of the library); webp also exercises the lossy path.
+FORMATS = (("jpg", "JPEG", 0.5), ("png", "PNG", 0.3), ("webp", "WEBP", 0.15), ("bmp", "BMP", 0.05))
+# Tiles per subdirectory, so million-tile libraries stay friendly to the filesystem.
+_DIR_TILES = 1000
+_CHUNK_TILES = 2000
+_MARKER = "library.json"
+
+
+def _tile(seed: int, index: int, sizes: tuple[int, int]) -> tuple[Image.Image, str, str]:
+    # Tile ``index`` only depends on (seed, index): a coloured gradient with noise, in a
+    # random size, format and (for a few) mode, so libraries are reproducible.
+    rng = np.random.default_rng([seed, index])
+    width, height = (int(v) for v in rng.integers(sizes[0], sizes[1] + 1, size=2))
+    base = rng.uniform(0, 255, size=3)
+    slope = rng.normal(0, 40, size=(2, 3))
+    ys, xs = np.mgrid[0:height, 0:width]
+    pixels = base + xs[..., None] / width * slope[0] + ys[..., None] / height * slope[1]
+    pixels += rng.normal(0, 12, size=pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+
+    shares = np.array([share for _, _, share in FORMATS])
+    extension, image_format, _ = FORMATS[int(rng.choice(len(FORMATS), p=shares / shares.sum()))]
+    mode = rng.random()
+    if mode < 0.05:
+        image = image.convert("L")
+    elif mode < 0.1 and image_format in ("PNG", "WEBP"):
+        image.putalpha(255)
+    return image, extension, image_format
+
+
+def _write_chunk(directory: Path, seed: int, start: int, stop: int, sizes: tuple[int, int]) -> None:
+    for index in range(start, stop):
+        image, extension, image_format = _tile(seed, index, sizes)
+        folder = directory / f"{index // _DIR_TILES:04d}"
+        folder.mkdir(exist_ok=True)
+        image.save(folder / f"tile-{index:07d}.{extension}", image_format)
+
+
+def generate_tile_library(
+    root: Path,
+    count: int,
+    seed: int = 0,
+    sizes: tuple[int, int] = (24, 96),
+    workers: int = 1,
+) -> Path:
+    # Libraries live in ``root/tiles-{count}-{seed}-{min}x{max}`` and are reused once complete.
+    directory = root / f"tiles-{count}-{seed}-{sizes[0]}x{sizes[1]}"
+    marker = directory / _MARKER
+    if marker.exists():
+        return directory
+    directory.mkdir(parents=True, exist_ok=True)
+    chunks = [(start, min(start + _CHUNK_TILES, count)) for start in range(0, count, _CHUNK_TILES)]
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_write_chunk, directory, seed, start, stop, sizes) for start, stop in chunks]
+            for future in futures:
+                future.result()
+    else:
+        for start, stop in chunks:
+            _write_chunk(directory, seed, start, stop, sizes)
+    marker.write_text(json.dumps({"count": count, "seed": seed, "sizes": list(sizes)}) + "\n", encoding="utf-8")
+    return directory
+
+
+def generate_source(root: Path, size: int, seed: int = 0) -> Path:
+    # A smooth, photo-like 4:3 image ``size`` pixels wide: gradients plus soft blobs and grain.
+    path = root / f"source-{size}-{seed}.png"
+    if path.exists():
+        return path
+    root.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng([seed, size])
+    small_w, small_h = 160, 120
+    ys, xs = np.mgrid[0:small_h, 0:small_w] / np.array([small_h, small_w])[:, None, None]
+    pixels = rng.uniform(40, 215, size=3) + xs[..., None] * rng.normal(0, 60, size=3) + ys[..., None] * rng.normal(0, 60, size=3)
+    for _ in range(12):
+        cx, cy, radius = rng.uniform(0, 1), rng.uniform(0, 1), rng.uniform(0.05, 0.3)
+        blob = np.exp(-((xs - cx) ** 2 + (ys - cy) ** 2) / (2 * radius**2))
+        pixels += blob[..., None] * rng.normal(0, 80, size=3)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+    image = image.resize((size, size * 3 // 4), Image.Resampling.BICUBIC)
+    grain = rng.normal(0, 6, size=(image.height, image.width, 3))
+    image = Image.fromarray(np.clip(np.asarray(image) + grain, 0, 255).astype(np.uint8), "RGB")
+    image.save(path)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a reproducible synthetic tile library and source images")
+    parser.add_argument("--root", type=Path, default=Path(".bench"), help="Directory for generated data")
+    parser.add_argument("--tiles", type=int, default=1000)
+    parser.add_argument("--sources", type=int, nargs="*", default=[1024], help="Source widths in pixels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-size", type=int, default=24)
+    parser.add_argument("--max-size", type=int, default=96)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    library = generate_tile_library(args.root, args.tiles, args.seed, (args.min_size, args.max_size), args.workers)
+    print(f"tiles: {library}")
+    for size in args.sources:
+        print(f"source: {generate_source(args.root, size, args.seed)}")
+
+
+if __name__ == "__main__":
+    main()
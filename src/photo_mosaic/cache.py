@@ -1,9 +1,13 @@
 from __future__ import annotations
 
 import json
+import os
+from collections.abc import Iterator
 from pathlib import Path
 from typing import Any
 
+import numpy as np
+
 
 def load_json(path: Path) -> dict[str, Any] | None:
     if not path.exists():
@@ -14,5 +18,101 @@ def load_json(path: Path) -> dict[str, Any] | None:
 
 def write_json(path: Path, value: dict[str, Any]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
+    # Manifests are written last and renamed into place, so a torn write is never read.
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
         json.dump(value, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def sidecar_path(path: Path, name: str) -> Path:
+    # Binary arrays live next to the JSON manifest: tile_index.json -> tile_index.<name>.npy
+    return path.with_name(f"{path.stem}.{name}.npy")
+
+
+def load_array(path: Path, mmap: bool = True) -> np.ndarray | None:
+    if not path.exists():
+        return None
+    return np.load(path, mmap_mode="r" if mmap else None, allow_pickle=False)
+
+
+def create_array(path: Path, shape: tuple[int, ...], dtype: np.dtype | type) -> np.ndarray:
+    # A writable array mapped from the temporary file write_array(path, ...) renames into
+    # place, so large arrays are filled on disk instead of being copied out of memory.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return np.lib.format.open_memmap(path.with_name(path.name + ".tmp"), mode="w+", dtype=dtype, shape=shape)
+
+
+def write_array(path: Path, value: np.ndarray) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename so readers never map a half-written file.
+    tmp_path = path.with_name(path.name + ".tmp")
+    if isinstance(value, np.memmap) and value.filename is not None and os.path.abspath(value.filename) == os.path.abspath(tmp_path):
+        # Filled in place by create_array; only the rename is left.
+        value.flush()
+    else:
+        with tmp_path.open("wb") as f:
+            np.save(f, np.ascontiguousarray(value), allow_pickle=False)
+    os.replace(tmp_path, path)
+
+
+class StringTable:
+    # NUL-joined UTF-8 strings plus an offsets array; rows are decoded on access.
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray) -> None:
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, values: list[str]) -> StringTable:
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) + 1 for value in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(value + b"\0" for value in encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        start, stop = int(self.offsets[index]), int(self.offsets[index + 1]) - 1
+        return self.blob[start:stop].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.tolist())
+
+    def take(self, rows: np.ndarray | slice) -> StringTable:
+        # Rows as a slice (a view for contiguous ones), integer indices or a boolean mask.
+        if isinstance(rows, slice) and rows.step in (None, 1):
+            start, stop, _ = rows.indices(len(self))
+            stop = max(start, stop)
+            return StringTable(self.blob[self.offsets[start] : self.offsets[stop]], self.offsets[start : stop + 1] - self.offsets[start])
+        rows = np.arange(len(self))[rows]
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(int(offsets[-1]))
+        return StringTable(self.blob[positions], offsets)
+
+    def tolist(self) -> list[str]:
+        if len(self) == 0:
+            return []
+        # One decode + split is far cheaper than decoding row by row.
+        return self.blob[:-1].tobytes().decode("utf-8").split("\0")
+
+
+def load_string_table(path: Path) -> StringTable | None:
+    blob = load_array(sidecar_path(path, "paths"))
+    offsets = load_array(sidecar_path(path, "path_offsets"))
+    if blob is None or offsets is None:
+        return None
+    return StringTable(blob, offsets)
+
+
+def write_string_table(path: Path, table: StringTable) -> None:
+    write_array(sidecar_path(path, "paths"), table.blob)
+    write_array(sidecar_path(path, "path_offsets"), table.offsets)
@@ -1,72 +1,275 @@
 from __future__ import annotations
 
+import dataclasses
+import functools
+import inspect
+import time
+from collections.abc import Callable
 from pathlib import Path
+from typing import Any
 
 import typer
 from rich.console import Console
 
-from photo_mosaic.config import FitMode, HexBackground, MosaicConfig, Strategy, TileShape
+from photo_mosaic.config import BuildStage, ColorSpace, FitMode, HexBackground, MosaicConfig, NeighborSearch, Strategy, TileShape
+from photo_mosaic.core.batch import BatchResult, batch_outputs, build_batch, collect_sources
+from photo_mosaic.core.budget import BuildBudget
+from photo_mosaic.core.metrics import BuildMetrics
 from photo_mosaic.core.mosaic import build_mosaic
+from photo_mosaic.core.tile_index import TileVariant, build_tile_indexes
 
 app = typer.Typer(help="Photo Mosaic - Free [FaigleLabs]")
 console = Console()
 
 
+# Options of the commands that render mosaics, by the MosaicConfig field they set.
+# Commands take them with @_config_options and receive their values as one dict.
+_CONFIG_OPTIONS: dict[str, tuple[Any, Any]] = {
+    "tile_dirs": (list[Path], typer.Option(..., "--tile-dir", exists=True, file_okay=False, dir_okay=True, help="Tile directory, can be repeated")),
+    "tile_width": (int, typer.Option(16, "--tile-width", min=2, max=512)),
+    "tile_height": (int, typer.Option(16, "--tile-height", min=2, max=512)),
+    "output_width": (int | None, typer.Option(None, "--output-width", min=32, max=20000)),
+    "output_height": (int | None, typer.Option(None, "--output-height", min=32, max=20000)),
+    "tile_shape": (TileShape, typer.Option(TileShape.RECT, "--tile-shape", case_sensitive=False)),
+    "hex_overlap": (float, typer.Option(0.25, "--hex-overlap", min=0.0, max=0.94)),
+    "hex_edge_softness": (float, typer.Option(0.2, "--hex-edge-softness", min=0.0, max=1.0)),
+    "hex_background": (HexBackground, typer.Option(HexBackground.SOURCE, "--hex-background", case_sensitive=False)),
+    "fit_mode": (FitMode, typer.Option(FitMode.CROP, "--fit-mode", case_sensitive=False)),
+    "strategy": (Strategy, typer.Option(Strategy.GREEDY, "--strategy", case_sensitive=False)),
+    "max_repeats": (int | None, typer.Option(None, "--max-repeats", min=1)),
+    "max_usage_percent": (float | None, typer.Option(None, "--max-usage-percent", min=0.01, max=100.0)),
+    "lazy_randomness": (float, typer.Option(0.15, "--lazy-randomness", min=0.0, max=1.0)),
+    "lazy_top_k": (int, typer.Option(5, "--lazy-top-k", min=1, max=200)),
+    "random_steps": (int, typer.Option(0, "--random-steps", min=0, max=500000)),
+    "full_steps": (int, typer.Option(2000, "--full-steps", min=0, max=1000000)),
+    "optimal_gap": (float, typer.Option(1.0, "--optimal-gap", min=0.001, max=1000.0, help="Allowed mean squared colour error above the optimum")),
+    "optimal_time_limit": (float, typer.Option(60.0, "--optimal-time-limit", min=0.1, max=86400.0, help="Seconds the optimal strategy may search")),
+    "feature_grid": (int, typer.Option(1, "--feature-grid", min=1, max=8, help="Match on an N x N grid of sub-cell colours")),
+    "color_space": (ColorSpace, typer.Option(ColorSpace.RGB, "--color-space", case_sensitive=False, help="Colour space tiles and cells are matched in")),
+    "neighbor_search": (NeighborSearch, typer.Option(NeighborSearch.AUTO, "--neighbor-search", case_sensitive=False)),
+    "cache_path": (Path | None, typer.Option(None, "--cache-path", help="Path to tile index cache manifest (arrays are stored beside it)")),
+    "refresh_cache": (bool, typer.Option(False, "--refresh-cache", help="Force recomputing cache")),
+    "cache_content_hash": (bool, typer.Option(False, "--cache-hash", help="Fingerprint cached tiles by content hash, not size+mtime")),
+    "cache_rescan": (bool, typer.Option(True, "--cache-rescan/--no-cache-rescan", help="Rescan tile dirs for changes before trusting the cache")),
+    "cache_atlas": (bool, typer.Option(True, "--cache-atlas/--no-cache-atlas", help="Store fitted tile pixels with the cache so builds skip decoding")),
+    "index_workers": (int, typer.Option(1, "--index-workers", min=1, max=256, help="Processes used to index tile images")),
+    "stream_output": (bool, typer.Option(False, "--stream", help="Compose and encode the output in strips to bound memory (PNG only)")),
+    "compose_workers": (int, typer.Option(1, "--compose-workers", min=1, max=256, help="Threads used to render output strips")),
+    "stage_cache_dir": (Path | None, typer.Option(None, "--stage-cache", file_okay=False, help="Directory keeping features and assignments between runs")),
+    # Parsed into time_budget and stage_time_budgets.
+    "time_budget": (list[str], typer.Option([], "--time-budget", help="SECONDS for the whole build or STAGE=SECONDS, can be repeated")),
+}
+# What the server is started with: the tile library; jobs choose the rest.
+_LIBRARY_OPTIONS = (
+    "tile_dirs",
+    "tile_width",
+    "tile_height",
+    "tile_shape",
+    "hex_edge_softness",
+    "fit_mode",
+    "feature_grid",
+    "color_space",
+    "neighbor_search",
+    "cache_path",
+    "cache_content_hash",
+    "cache_atlas",
+    "index_workers",
+)
+
+
+def _config_options(*fields: str) -> Callable[[Callable[..., None]], Callable[..., None]]:
+    # Appends the _CONFIG_OPTIONS for ``fields`` to a command's own parameters. The
+    # command gets their values as ``options``, MosaicConfig keyword arguments.
+    def decorate(command: Callable[..., None]) -> Callable[..., None]:
+        signature = inspect.signature(command)
+        parameters = [parameter for parameter in signature.parameters.values() if parameter.name != "options"]
+        for name in fields:
+            annotation, option = _CONFIG_OPTIONS[name]
+            parameters.append(inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY, default=option, annotation=annotation))
+
+        @functools.wraps(command)
+        def wrapper(**values: Any) -> None:
+            options = {name: values.pop(name) for name in fields}
+            if "time_budget" in options:
+                options.update(_parse_time_budget(options.pop("time_budget")))
+            command(options=options, **values)
+
+        wrapper.__signature__ = signature.replace(parameters=parameters)
+        return wrapper
+
+    return decorate
+
+
 @app.command("build")
+@_config_options(*_CONFIG_OPTIONS)
 def build_command(
+    options: dict[str, Any],
     source_image: Path = typer.Option(..., "--source", exists=True, readable=True, help="Path to source image"),
-    tile_dir: list[Path] = typer.Option(..., "--tile-dir", exists=True, file_okay=False, dir_okay=True, help="Tile directory, can be repeated"),
     output_path: Path = typer.Option(..., "--output", help="Output image path"),
-    tile_width: int = typer.Option(16, "--tile-width", min=2, max=512),
-    tile_height: int = typer.Option(16, "--tile-height", min=2, max=512),
-    output_width: int | None = typer.Option(None, "--output-width", min=32, max=20000),
-    output_height: int | None = typer.Option(None, "--output-height", min=32, max=20000),
-    tile_shape: TileShape = typer.Option(TileShape.RECT, "--tile-shape", case_sensitive=False),
-    hex_overlap: float = typer.Option(0.25, "--hex-overlap", min=0.0, max=0.94),
-    hex_edge_softness: float = typer.Option(0.2, "--hex-edge-softness", min=0.0, max=1.0),
-    hex_background: HexBackground = typer.Option(HexBackground.SOURCE, "--hex-background", case_sensitive=False),
-    fit_mode: FitMode = typer.Option(FitMode.CROP, "--fit-mode", case_sensitive=False),
-    strategy: Strategy = typer.Option(Strategy.GREEDY, "--strategy", case_sensitive=False),
-    max_repeats: int | None = typer.Option(None, "--max-repeats", min=1),
-    max_usage_percent: float | None = typer.Option(None, "--max-usage-percent", min=0.01, max=100.0),
-    lazy_randomness: float = typer.Option(0.15, "--lazy-randomness", min=0.0, max=1.0),
-    lazy_top_k: int = typer.Option(5, "--lazy-top-k", min=1, max=200),
-    random_steps: int = typer.Option(0, "--random-steps", min=0, max=500000),
-    full_steps: int = typer.Option(2000, "--full-steps", min=0, max=1000000),
-    cache_path: Path | None = typer.Option(None, "--cache-path", help="Path to tile index cache JSON"),
-    refresh_cache: bool = typer.Option(False, "--refresh-cache", help="Force recomputing cache"),
+    metrics_json: Path | None = typer.Option(None, "--metrics-json", dir_okay=False, help="Write stage timers, counters and peak memory as JSON"),
+    profile_path: Path | None = typer.Option(None, "--profile", dir_okay=False, help="Write a cProfile (pstats) profile of the build"),
+    trace_memory: bool = typer.Option(False, "--trace-memory", help="Record peak Python heap with tracemalloc (slows the build)"),
 ) -> None:
-    config = MosaicConfig(
-        source_image=source_image,
-        tile_dirs=tile_dir,
-        output_path=output_path,
-        tile_width=tile_width,
-        tile_height=tile_height,
-        output_width=output_width,
-        output_height=output_height,
-        tile_shape=tile_shape,
-        hex_overlap=hex_overlap,
-        hex_edge_softness=hex_edge_softness,
-        hex_background=hex_background,
-        fit_mode=fit_mode,
-        strategy=strategy,
-        max_repeats=max_repeats,
-        max_usage_percent=max_usage_percent,
-        lazy_randomness=lazy_randomness,
-        lazy_top_k=lazy_top_k,
-        random_steps=random_steps,
-        full_steps=full_steps,
-        cache_path=cache_path,
-        refresh_cache=refresh_cache,
-    )
+    config = MosaicConfig(source_image=source_image, output_path=output_path, **options)
 
+    budget = BuildBudget.from_config(config)
+    metrics = BuildMetrics(profile=profile_path is not None, trace_memory=trace_memory)
     try:
-        result = build_mosaic(config)
+        result = build_mosaic(config, budget, metrics)
     except Exception as exc:
         console.print(f"[red]Build failed:[/red] {exc}")
         raise typer.Exit(1) from exc
+    finally:
+        _write_metrics(metrics, metrics_json, profile_path)
 
     console.print(f"[green]Mosaic created:[/green] {result}")
+    if budget.limited:
+        for usage in budget.usage:
+            allowed = "" if usage.budget is None else f" of {usage.budget:.2f}s ({usage.fraction:.0%})"
+            console.print(f"  {usage.stage}: {usage.seconds:.2f}s{allowed}")
+
+
+@app.command("batch")
+@_config_options(*_CONFIG_OPTIONS)
+def batch_command(
+    options: dict[str, Any],
+    sources: list[str] = typer.Option([], "--sources", help="Glob of source images, can be repeated"),
+    manifest: Path | None = typer.Option(None, "--manifest", exists=True, dir_okay=False, help="File listing one source image per line"),
+    output_dir: Path = typer.Option(..., "--output-dir", file_okay=False, help="Directory for the rendered mosaics"),
+    output_suffix: str = typer.Option(".png", "--output-suffix", help="Output file extension"),
+    batch_workers: int = typer.Option(1, "--batch-workers", min=1, max=256, help="Sources rendered at the same time"),
+    metrics_json: Path | None = typer.Option(None, "--metrics-json", dir_okay=False, help="Write timers and counters summed over the batch as JSON"),
+) -> None:
+    source_paths = collect_sources(sources, manifest)
+    if not source_paths:
+        console.print("[red]Batch failed:[/red] no source images matched")
+        raise typer.Exit(1)
+
+    started = time.perf_counter()
+    completed = 0
+    metrics = BuildMetrics()
+
+    def report(result: BatchResult) -> None:
+        nonlocal completed
+        completed += 1
+        prefix = f"[{completed}/{len(source_paths)}]"
+        if result.ok:
+            console.print(f"{prefix} [green]{result.source.name}[/green] -> {result.output} in {result.seconds:.2f}s")
+        else:
+            console.print(f"{prefix} [red]{result.source.name} failed:[/red] {result.error}")
+
+    try:
+        outputs = batch_outputs(source_paths, output_dir, output_suffix)
+        configs = [MosaicConfig(source_image=src, output_path=out, **options) for src, out in zip(source_paths, outputs)]
+        results = build_batch(configs, workers=batch_workers, on_result=report, metrics=metrics)
+    except Exception as exc:
+        console.print(f"[red]Batch failed:[/red] {exc}")
+        raise typer.Exit(1) from exc
+    finally:
+        _write_metrics(metrics, metrics_json)
+
+    elapsed = time.perf_counter() - started
+    done = sum(result.ok for result in results)
+    console.print(f"Rendered {done}/{len(results)} mosaics in {elapsed:.2f}s ({done / max(elapsed, 1e-9):.2f}/s)")
+    if done < len(results):
+        raise typer.Exit(1)
+
+
+def _write_metrics(metrics: BuildMetrics, json_path: Path | None, profile_path: Path | None = None) -> None:
+    # Also runs for failed builds, whose metrics show how far they got.
+    if json_path is not None:
+        metrics.write_json(json_path)
+        console.print(f"Metrics written to {json_path}")
+    if profile_path is not None:
+        metrics.write_profile(profile_path)
+        console.print(f"Profile written to {profile_path}")
+
+
+def _parse_time_budget(specs: list[str]) -> dict:
+    # SECONDS bounds the whole build, STAGE=SECONDS one stage (library, features, assign, compose).
+    total: float | None = None
+    stages: dict[BuildStage, float] = {}
+    for spec in specs:
+        name, _, seconds = spec.rpartition("=")
+        try:
+            value = float(seconds)
+            if name:
+                stages[BuildStage(name.strip().lower())] = value
+            else:
+                total = value
+        except ValueError as exc:
+            raise typer.BadParameter(f"Invalid time budget {spec!r}; expected SECONDS or STAGE=SECONDS") from exc
+    return {"time_budget": total, "stage_time_budgets": stages}
+
+
+def _parse_variant(spec: str) -> TileVariant:
+    # WIDTHxHEIGHT[:fit_mode[:shape[:hex_edge_softness]]], e.g. 24x24:crop:hex:0.3
+    parts = spec.split(":")
+    try:
+        width, height = (int(v) for v in parts[0].lower().split("x"))
+        fit_mode = FitMode(parts[1]) if len(parts) > 1 else FitMode.CROP
+        tile_shape = TileShape(parts[2]) if len(parts) > 2 else TileShape.RECT
+        softness = float(parts[3]) if len(parts) > 3 else 0.2
+    except ValueError as exc:
+        raise typer.BadParameter(f"Invalid variant {spec!r}; expected WxH[:fit[:shape[:softness]]]") from exc
+    return TileVariant(tile_size=(width, height), fit_mode=fit_mode, tile_shape=tile_shape, hex_edge_softness=softness)
+
+
+@app.command("index")
+def index_command(
+    tile_dir: list[Path] = typer.Option(..., "--tile-dir", exists=True, file_okay=False, dir_okay=True, help="Tile directory, can be repeated"),
+    cache_path: Path = typer.Option(..., "--cache-path", help="Path to tile index cache manifest"),
+    variant: list[str] = typer.Option(["16x16"], "--variant", help="WxH[:fit[:shape[:softness]]], can be repeated"),
+    refresh_cache: bool = typer.Option(False, "--refresh-cache", help="Force recomputing cache"),
+    cache_content_hash: bool = typer.Option(False, "--cache-hash", help="Fingerprint cached tiles by content hash, not size+mtime"),
+    cache_atlas: bool = typer.Option(True, "--cache-atlas/--no-cache-atlas", help="Store fitted tile pixels with the cache so builds skip decoding"),
+    index_workers: int = typer.Option(1, "--index-workers", min=1, max=256, help="Processes used to index tile images"),
+    feature_grid: int = typer.Option(1, "--feature-grid", min=1, max=8, help="Index N x N sub-cell colour descriptors"),
+    color_space: ColorSpace = typer.Option(ColorSpace.RGB, "--color-space", case_sensitive=False, help="Colour space the features are stored in"),
+) -> None:
+    variants = [dataclasses.replace(_parse_variant(spec), grid=feature_grid, color_space=color_space) for spec in variant]
+    try:
+        indexes = build_tile_indexes(
+            tile_dirs=tile_dir,
+            variants=variants,
+            cache_path=cache_path,
+            refresh_cache=refresh_cache,
+            workers=index_workers,
+            content_hash=cache_content_hash,
+            atlas=cache_atlas,
+        )
+    except Exception as exc:
+        console.print(f"[red]Indexing failed:[/red] {exc}")
+        raise typer.Exit(1) from exc
+
+    for tile_variant, index in indexes.items():
+        console.print(f"[green]Indexed {len(index)} tiles:[/green] {tile_variant.key}")
+
+
+@app.command("serve")
+@_config_options(*_LIBRARY_OPTIONS)
+def serve_command(
+    options: dict[str, Any],
+    output_dir: Path = typer.Option(..., "--output-dir", file_okay=False, help="Directory for uploads and rendered mosaics"),
+    host: str = typer.Option("127.0.0.1", "--host"),
+    port: int = typer.Option(8765, "--port", min=0, max=65535),
+    render_workers: int = typer.Option(1, "--render-workers", min=1, max=64, help="Jobs rendered at the same time"),
+    queue_size: int = typer.Option(16, "--queue-size", min=1, max=10000, help="Waiting jobs before submissions are refused"),
+    max_library_mb: int = typer.Option(2048, "--max-library-mb", min=1, help="Memory for warm tile libraries before eviction"),
+) -> None:
+    from photo_mosaic.core.engine import MosaicEngine
+    from photo_mosaic.server import RenderService, run_server
+
+    # Jobs replace the source and output; these two only make the base config valid.
+    base = MosaicConfig(source_image=output_dir / "uploads" / "base", output_path=output_dir / "base.png", **options)
+    engine = MosaicEngine(base, max_bytes=max_library_mb << 20)
+    service = RenderService(base, output_dir, workers=render_workers, queue_size=queue_size, engine=engine)
+    console.print("Loading tile library...")
+    try:
+        run_server(service, host, port, on_ready=lambda bound: console.print(f"[green]Serving on http://{host}:{bound}[/green]"))
+    except Exception as exc:
+        console.print(f"[red]Server failed:[/red] {exc}")
+        raise typer.Exit(1) from exc
 
 
 @app.command("gui")
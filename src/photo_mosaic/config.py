@@ -3,7 +3,7 @@ from __future__ import annotations
 from enum import StrEnum
 from pathlib import Path
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 
 
 class Strategy(StrEnum):
@@ -11,6 +11,7 @@ class Strategy(StrEnum):
     LAZY = "lazy"
     RANDOM = "random"
     FULL = "full"
+    OPTIMAL = "optimal"
 
 
 class FitMode(StrEnum):
@@ -29,6 +30,27 @@ class HexBackground(StrEnum):
     SOLID = "solid"
 
 
+class NeighborSearch(StrEnum):
+    AUTO = "auto"
+    KDTREE = "kdtree"
+    BRUTE = "brute"
+
+
+class ColorSpace(StrEnum):
+    # Space tiles and cells are compared in; distances are squared Euclidean in all of them.
+    RGB = "rgb"
+    LAB = "lab"
+    OKLAB = "oklab"
+
+
+class BuildStage(StrEnum):
+    # In build order; time budgets and progress reports are per stage.
+    LIBRARY = "library"
+    FEATURES = "features"
+    ASSIGN = "assign"
+    COMPOSE = "compose"
+
+
 class MosaicConfig(BaseModel):
     source_image: Path
     tile_dirs: list[Path]
@@ -49,8 +71,23 @@ class MosaicConfig(BaseModel):
     lazy_top_k: int = Field(default=5, ge=1, le=200)
     random_steps: int = Field(default=0, ge=0, le=500000)
     full_steps: int = Field(default=2000, ge=0, le=1000000)
+    optimal_gap: float = Field(default=1.0, gt=0, le=1000)
+    optimal_time_limit: float = Field(default=60.0, gt=0, le=86400)
+    # Tiles and cells are matched on an N x N grid of sub-cell colours; 1 matches mean colours.
+    feature_grid: int = Field(default=1, ge=1, le=8)
+    color_space: ColorSpace = ColorSpace.RGB
+    neighbor_search: NeighborSearch = NeighborSearch.AUTO
     cache_path: Path | None = None
     refresh_cache: bool = False
+    cache_content_hash: bool = False
+    cache_rescan: bool = True
+    cache_atlas: bool = True
+    index_workers: int = Field(default=1, ge=1, le=256)
+    stream_output: bool = False
+    compose_workers: int = Field(default=1, ge=1, le=256)
+    stage_cache_dir: Path | None = None
+    time_budget: float | None = Field(default=None, gt=0, le=86400)
+    stage_time_budgets: dict[BuildStage, float] = Field(default_factory=dict)
 
     @field_validator("tile_dirs")
     @classmethod
@@ -59,6 +96,20 @@ class MosaicConfig(BaseModel):
             raise ValueError("At least one tile directory is required")
         return value
 
+    @field_validator("stage_time_budgets")
+    @classmethod
+    def _check_stage_budgets(cls, value: dict[BuildStage, float]) -> dict[BuildStage, float]:
+        if any(seconds <= 0 for seconds in value.values()):
+            raise ValueError("Stage time budgets must be positive")
+        return value
+
+    @model_validator(mode="after")
+    def _check_stream_format(self) -> MosaicConfig:
+        # The strip encoder only writes PNG.
+        if self.stream_output and self.output_path.suffix.lower() != ".png":
+            raise ValueError("Streaming output must be a .png file")
+        return self
+
     @property
     def tile_size(self) -> tuple[int, int]:
         return (self.tile_width, self.tile_height)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import glob
+import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+
+from photo_mosaic.config import MosaicConfig
+from photo_mosaic.core.engine import MosaicEngine, library_key
+from photo_mosaic.core.metrics import BuildMetrics
+from photo_mosaic.core.scanner import IMAGE_EXTENSIONS
+
+
+@dataclass(slots=True)
+class BatchResult:
+    source: Path
+    output: Path
+    seconds: float
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def collect_sources(patterns: Sequence[str] = (), manifest: Path | None = None) -> list[Path]:
+    # Manifest lines are source paths (relative to the manifest), '#' starts a comment.
+    sources: list[Path] = []
+    if manifest is not None:
+        for line in manifest.read_text(encoding="utf-8").splitlines():
+            line = line.split("#", 1)[0].strip()
+            if line:
+                path = Path(line).expanduser()
+                sources.append(path if path.is_absolute() else manifest.parent / path)
+    for pattern in patterns:
+        matches = sorted(Path(match) for match in glob.glob(str(Path(pattern).expanduser()), recursive=True))
+        sources.extend(path for path in matches if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file())
+    # Keep the first occurrence of each source.
+    return list(dict.fromkeys(sources))
+
+
+def batch_outputs(sources: Sequence[Path], output_dir: Path, suffix: str = ".png") -> list[Path]:
+    # One output per source named after its stem; repeated stems get a numeric tag.
+    outputs: list[Path] = []
+    seen: dict[str, int] = {}
+    for source in sources:
+        count = seen.get(source.stem, 0)
+        seen[source.stem] = count + 1
+        name = source.stem if count == 0 else f"{source.stem}-{count}"
+        outputs.append(output_dir / f"{name}{suffix}")
+    return outputs
+
+
+def build_batch(
+    configs: Sequence[MosaicConfig],
+    workers: int = 1,
+    on_result: Callable[[BatchResult], None] | None = None,
+    engine: MosaicEngine | None = None,
+    metrics: BuildMetrics | None = None,
+) -> list[BatchResult]:
+    # Each distinct tile library is loaded once up front, with its fitted pixels held
+    # in memory, then the sources render concurrently against it. A failing source is
+    # reported in its result and does not stop the batch. ``metrics`` adds up every render.
+    if engine is None:
+        engine = MosaicEngine(max_bytes=None)
+    for config in {library_key(config): config for config in configs}.values():
+        if metrics is None:
+            engine.library(config)
+        else:
+            with metrics.record():
+                engine.library(config)
+    # A requested refresh applies to that initial load only.
+    configs = [config.model_copy(update={"refresh_cache": False}) for config in configs]
+
+    def run(config: MosaicConfig) -> BatchResult:
+        started = time.perf_counter()
+        try:
+            output = engine.render(config, metrics=metrics)
+        except Exception as exc:  # noqa: BLE001
+            return BatchResult(config.source_image, config.output_path, time.perf_counter() - started, str(exc))
+        return BatchResult(config.source_image, output, time.perf_counter() - started)
+
+    results: list[BatchResult | None] = [None] * len(configs)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, config): i for i, config in enumerate(configs)}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if on_result is not None:
+                on_result(result)
+    return [result for result in results if result is not None]
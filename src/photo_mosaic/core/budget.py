@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from photo_mosaic.config import BuildStage, MosaicConfig
+from photo_mosaic.core.metrics import timer
+
+_STAGE_ORDER = list(BuildStage)
+
+
+class BuildCancelled(Exception):
+    pass
+
+
+@dataclass(slots=True)
+class StageUsage:
+    stage: BuildStage
+    seconds: float
+    # Seconds the stage was allowed when it started; None when unbounded.
+    budget: float | None = None
+
+    @property
+    def fraction(self) -> float | None:
+        if self.budget is None:
+            return None
+        return self.seconds / self.budget if self.budget > 0 else float("inf")
+
+
+class BuildBudget:
+    # Wall-clock limits and the cancel flag of one build. ``total`` runs from start()
+    # (the engine starts it before loading the library); ``stages`` caps single stages,
+    # and time promised to later stages is held back from the total. Only the assign
+    # stage can stop early: the optimising strategies return their best assignment so
+    # far at the deadline. Other stages run to completion and report any overrun.
+    # cancel() may be called from any thread; the build raises BuildCancelled at its
+    # next check.
+    def __init__(self, total: float | None = None, stages: Mapping[BuildStage, float] | None = None) -> None:
+        self.total = total
+        self.stages = dict(stages or {})
+        self.usage: list[StageUsage] = []
+        self.cancelled = threading.Event()
+        self._started: float | None = None
+
+    @classmethod
+    def from_config(cls, config: MosaicConfig) -> BuildBudget:
+        return cls(config.time_budget, config.stage_time_budgets)
+
+    @property
+    def limited(self) -> bool:
+        return self.total is not None or bool(self.stages)
+
+    def start(self) -> None:
+        if self._started is None:
+            self._started = time.perf_counter()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    def check(self) -> None:
+        if self.cancelled.is_set():
+            raise BuildCancelled("Build cancelled")
+
+    def deadline(self, stage: BuildStage, now: float) -> float | None:
+        limits: list[float] = []
+        if stage in self.stages:
+            limits.append(now + self.stages[stage])
+        if self.total is not None:
+            self.start()
+            later = _STAGE_ORDER[_STAGE_ORDER.index(stage) + 1 :]
+            reserved = sum(self.stages.get(name, 0.0) for name in later)
+            limits.append(self._started + self.total - reserved)
+        return min(limits) if limits else None
+
+    @contextmanager
+    def stage(self, stage: BuildStage) -> Iterator[float | None]:
+        # Yields the stage's deadline (a time.perf_counter() value) and records its usage.
+        self.start()
+        self.check()
+        started = time.perf_counter()
+        deadline = self.deadline(stage, started)
+        try:
+            with timer(stage.value):
+                yield deadline
+        finally:
+            allowed = None if deadline is None else max(0.0, deadline - started)
+            self.usage.append(StageUsage(stage, time.perf_counter() - started, allowed))
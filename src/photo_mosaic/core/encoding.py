@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import struct
+import zlib
+from pathlib import Path
+from types import TracebackType
+
+import numpy as np
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Compressed bytes buffered before an IDAT chunk is flushed to disk.
+_IDAT_CHUNK = 1 << 20
+
+
+class PngStreamWriter:
+    # Writes an 8-bit RGB PNG band by band; only the compressor state and the
+    # previous row are kept between bands. Rows use the Up filter.
+    def __init__(self, path: Path, size: tuple[int, int], compress_level: int = 6) -> None:
+        self.path = path
+        self.width, self.height = size
+        self.rows = 0
+        self._previous = np.zeros((self.width * 3,), dtype=np.uint8)
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = bytearray()
+        self._file = path.open("wb")
+        self._file.write(_PNG_SIGNATURE)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0))
+
+    def __enter__(self) -> PngStreamWriter:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def write(self, band: np.ndarray) -> None:
+        band = np.asarray(band, dtype=np.uint8).reshape(-1, self.width * 3)
+        if self.rows + len(band) > self.height:
+            raise ValueError("PNG stream received more rows than its height")
+        filtered = np.empty((len(band), self.width * 3 + 1), dtype=np.uint8)
+        filtered[:, 0] = 2
+        # Up filter: each byte minus the byte above it, modulo 256.
+        np.subtract(band[:1], self._previous, out=filtered[:1, 1:])
+        np.subtract(band[1:], band[:-1], out=filtered[1:, 1:])
+        if len(band):
+            self._previous = band[-1].copy()
+        self.rows += len(band)
+        self._pending += self._compressor.compress(filtered.tobytes())
+        if len(self._pending) >= _IDAT_CHUNK:
+            self._flush()
+
+    def close(self) -> None:
+        if self.rows != self.height:
+            self._file.close()
+            raise ValueError(f"PNG stream closed after {self.rows} of {self.height} rows")
+        self._pending += self._compressor.flush()
+        self._flush()
+        self._chunk(b"IEND", b"")
+        self._file.close()
+
+    def _flush(self) -> None:
+        if self._pending:
+            self._chunk(b"IDAT", bytes(self._pending))
+            self._pending.clear()
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(kind + data)
+        self._file.write(struct.pack(">I", zlib.crc32(kind + data)))
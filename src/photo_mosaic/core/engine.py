@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Mapping
+from concurrent.futures import Future, wait
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any
+
+from photo_mosaic.config import BuildStage, MosaicConfig
+from photo_mosaic.core.budget import BuildBudget
+from photo_mosaic.core.metrics import BuildMetrics, count
+from photo_mosaic.core.mosaic import LoadedTiles, load_tiles, render_mosaic
+from photo_mosaic.core.pipeline import DEFAULT_STAGE_BYTES, StageCache
+from photo_mosaic.core.scanner import scan_digest
+
+# MosaicConfig fields that decide which tile library a build loads.
+LIBRARY_FIELDS = (
+    "tile_dirs",
+    "tile_width",
+    "tile_height",
+    "fit_mode",
+    "tile_shape",
+    "hex_edge_softness",
+    "feature_grid",
+    "color_space",
+    "neighbor_search",
+    "cache_path",
+    "cache_content_hash",
+    "cache_rescan",
+    "cache_atlas",
+    "index_workers",
+)
+DEFAULT_MAX_BYTES = 2 << 30
+
+
+def library_key(config: MosaicConfig) -> tuple[str, ...]:
+    return tuple(str(getattr(config, field)) for field in LIBRARY_FIELDS)
+
+
+class MosaicEngine:
+    # Keeps loaded tile libraries (index, neighbour structure and fitted pixels)
+    # warm across builds. Libraries are evicted least recently used first once
+    # their heap arrays exceed ``max_bytes``; the one in use is always kept.
+    # Loaded libraries are read-only, so builds may run from several threads.
+    def __init__(
+        self,
+        config: MosaicConfig | None = None,
+        max_bytes: int | None = DEFAULT_MAX_BYTES,
+        keep_pixels: bool = True,
+        stage_bytes: int = DEFAULT_STAGE_BYTES,
+        revalidate: bool = False,
+    ) -> None:
+        self.config = config
+        self.max_bytes = max_bytes
+        # Without kept pixels, fitted tiles are only stored next to a cache file.
+        self.keep_pixels = keep_pixels
+        # With ``revalidate`` every build rescans the tile directories (listing and stat
+        # only) and reloads a warm library whose files were added, removed or changed.
+        self.revalidate = revalidate
+        # Memoised per-source stages (layout, features, assignments) for repeat builds.
+        self.stages = StageCache(stage_bytes)
+        self._libraries: OrderedDict[tuple[str, ...], LoadedTiles] = OrderedDict()
+        self._loading: dict[tuple[str, ...], Future[LoadedTiles]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._libraries)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(library.nbytes for library in self._libraries.values())
+
+    def resolve(self, source: Path | str | None = None, overrides: Mapping[str, Any] | None = None) -> MosaicConfig:
+        # The engine's config with ``overrides`` applied, validated like a fresh config.
+        if self.config is None:
+            raise ValueError("MosaicEngine has no base config; pass a full MosaicConfig to render()")
+        values = self.config.model_dump()
+        values.update(overrides or {})
+        if source is not None:
+            values["source_image"] = Path(source)
+        return MosaicConfig.model_validate(values)
+
+    def build(self, source: Path | str | None = None, overrides: Mapping[str, Any] | None = None) -> Path:
+        return self.render(self.resolve(source, overrides))
+
+    def render(
+        self,
+        config: MosaicConfig,
+        on_stage: Callable[[str], None] | None = None,
+        budget: BuildBudget | None = None,
+        metrics: BuildMetrics | None = None,
+    ) -> Path:
+        # ``budget`` defaults to the config's time budget; pass one to cancel the build
+        # from another thread or to read how long each stage took afterwards. ``metrics``
+        # collects timers and counters of the build (and may be shared by several).
+        budget = BuildBudget.from_config(config) if budget is None else budget
+        with metrics.record() if metrics is not None else nullcontext():
+            count("builds")
+            budget.start()
+            with budget.stage(BuildStage.LIBRARY):
+                if on_stage is not None:
+                    on_stage("library")
+                library = self.library(config)
+            return render_mosaic(config, library, on_stage=on_stage, stages=self.stages, budget=budget)
+
+    def library(self, config: MosaicConfig) -> LoadedTiles:
+        key = library_key(config)
+        scan = scan_digest(config.tile_dirs) if self.revalidate else ""
+        # A library is loaded once, outside the engine lock, so renders of other (warm)
+        # libraries go on meanwhile. Concurrent builds of the same library wait for that
+        # load; a refresh waits for it to end and then loads again.
+        while True:
+            with self._lock:
+                library = None if config.refresh_cache else self._libraries.get(key)
+                if library is not None and library.scan != scan:
+                    count("engine.library_stale")
+                    library = None
+                if library is not None:
+                    count("engine.library_hits")
+                    self._libraries.move_to_end(key)
+                    return library
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = Future()
+                    break
+            if config.refresh_cache:
+                wait([loading])
+                continue
+            count("engine.library_hits")
+            return loading.result()
+
+        count("engine.library_loads")
+        try:
+            atlas = config.cache_atlas and (self.keep_pixels or config.cache_path is not None)
+            library = load_tiles(config, atlas=atlas, scan=scan)
+        except BaseException as exc:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(exc)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._libraries[key] = library
+            self._libraries.move_to_end(key)
+            self._evict(keep=key)
+        loading.set_result(library)
+        return library
+
+    def clear(self) -> None:
+        with self._lock:
+            self._libraries.clear()
+        self.stages.clear()
+
+    def _evict(self, keep: tuple[str, ...]) -> None:
+        # Least recently used first, never ``keep``: the library just loaded for a build.
+        if self.max_bytes is None:
+            return
+        total = sum(library.nbytes for library in self._libraries.values())
+        for key in [key for key in self._libraries if key != keep]:
+            if total <= self.max_bytes:
+                break
+            total -= self._libraries.pop(key).nbytes
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from photo_mosaic.config import ColorSpace
+
+# Cells gathered per chunk on the generic path; bounds the temporary window copy.
+_CHUNK_CELLS = 4096
+# Linear sRGB to CIE XYZ, and the XYZ of the D65 white point sRGB is defined against.
+_RGB_TO_XYZ = np.array(
+    [[0.4124564, 0.3575761, 0.1804375], [0.2126729, 0.7151522, 0.0721750], [0.0193339, 0.1191920, 0.9503041]]
+)
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+# Linear sRGB to OKLab's cone responses, and their cube roots to OKLab.
+_RGB_TO_LMS = np.array(
+    [[0.4122214708, 0.5363325363, 0.0514459929], [0.2119034982, 0.6806995451, 0.1073969566], [0.0883024619, 0.2817188376, 0.6299787005]]
+)
+_LMS_TO_OKLAB = np.array(
+    [[0.2104542553, 0.7936177850, -0.0040720468], [1.9779984951, -2.4285922050, 0.4505937099], [0.0259040371, 0.7827717662, -0.8086757660]]
+)
+# OKLab lightness runs 0-1; scaled to CIELAB's 0-100 so costs (and optimal_gap) compare across spaces.
+_OKLAB_SCALE = 100.0
+_LAB_DELTA = 6 / 29
+
+
+def _is_regular_grid(positions: np.ndarray, tile_size: tuple[int, int], canvas_shape: tuple[int, int]) -> bool:
+    tile_w, tile_h = tile_size
+    height, width = canvas_shape
+    if width % tile_w or height % tile_h:
+        return False
+    cols = width // tile_w
+    rows = height // tile_h
+    if len(positions) != rows * cols:
+        return False
+    xs = np.tile(np.arange(cols) * tile_w, rows)
+    ys = np.repeat(np.arange(rows) * tile_h, cols)
+    return bool(np.array_equal(positions[:, 0], xs) and np.array_equal(positions[:, 1], ys))
+
+
+def _grid_weights(weights: np.ndarray, grid: int) -> np.ndarray:
+    # (grid * grid, h, w) stack averaging each sub-cell of a grid x grid split, row-major.
+    height, width = weights.shape
+    sub_rows = np.minimum(np.arange(height) * grid // height, grid - 1)
+    sub_cols = np.minimum(np.arange(width) * grid // width, grid - 1)
+    stack = np.zeros((grid * grid, height, width), dtype=np.float64)
+    stack[sub_rows[:, None] * grid + sub_cols[None, :], np.arange(height)[:, None], np.arange(width)[None, :]] = weights
+    sums = stack.sum(axis=(1, 2))
+    # Sub-cells a mask (or a cell narrower than the grid) leaves empty use the whole cell.
+    empty = sums <= 0
+    stack[empty] = weights
+    sums[empty] = weights.sum()
+    return stack / sums[:, None, None]
+
+
+def cell_means(
+    canvas: np.ndarray,
+    positions: list[tuple[int, int]] | np.ndarray,
+    tile_size: tuple[int, int],
+    weights: np.ndarray | None = None,
+    grid: int = 1,
+) -> np.ndarray:
+    # Mean RGB per cell of an (H, W, 3) uint8 canvas; optional (h, w) weights give a masked mean.
+    # With ``grid`` > 1, the (cells, grid * grid * 3) means of each cell's sub-cells, row-major.
+    tile_w, tile_h = tile_size
+    height, width = canvas.shape[:2]
+    if len(positions) == 0:
+        return np.zeros((0, 3 * grid * grid), dtype=np.float32)
+
+    coords = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+    lefts = np.minimum(coords[:, 0], max(0, width - tile_w))
+    tops = np.minimum(coords[:, 1], max(0, height - tile_h))
+    # Layouts never produce cells larger than the canvas; clamp defensively.
+    cell_w = min(tile_w, width)
+    cell_h = min(tile_h, height)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)[:cell_h, :cell_w]
+        if weights.sum() <= 0:
+            weights = None
+
+    regular = weights is None and _is_regular_grid(np.stack([lefts, tops], axis=1), (cell_w, cell_h), (height, width))
+    if regular and grid > 1 and cell_w % grid == 0 and cell_h % grid == 0:
+        # Sub-cells tile the canvas too: take their means on the fast path and regroup them per cell.
+        sub_w, sub_h = cell_w // grid, cell_h // grid
+        rows, cols = height // cell_h, width // cell_w
+        sub_positions = [(x, y) for y in range(0, height, sub_h) for x in range(0, width, sub_w)]
+        sub = cell_means(canvas, sub_positions, (sub_w, sub_h)).reshape(rows, grid, cols, grid, 3)
+        return np.ascontiguousarray(sub.transpose(0, 2, 1, 3, 4)).reshape(rows * cols, grid * grid * 3)
+
+    if regular and grid == 1:
+        rows = height // cell_h
+        cols = width // cell_w
+        # Reduce the contiguous row axis first; a single 5-D reduction is several times slower.
+        row_sums = canvas.reshape(rows, cell_h, width * 3).sum(axis=1, dtype=np.uint32)
+        sums = row_sums.reshape(rows, cols, cell_w, 3).sum(axis=2, dtype=np.uint64)
+        return (sums.reshape(-1, 3) / float(cell_w * cell_h)).astype(np.float32)
+
+    if weights is None:
+        weights = np.ones((cell_h, cell_w), dtype=np.float64)
+    total = float(weights.sum())
+    stack = _grid_weights(weights, grid) if grid > 1 else None
+
+    # Strided (H', W', 3, h, w) view of every window; only the gathered chunk is copied.
+    windows = sliding_window_view(canvas, (cell_h, cell_w), axis=(0, 1))
+    out = np.empty((len(coords), 3 * grid * grid), dtype=np.float32)
+    for start in range(0, len(coords), _CHUNK_CELLS):
+        stop = start + _CHUNK_CELLS
+        patches = windows[tops[start:stop], lefts[start:stop]]
+        if stack is None:
+            out[start:stop] = np.einsum("ncij,ij->nc", patches, weights, dtype=np.float64) / total
+        else:
+            out[start:stop] = np.einsum("ncij,kij->nkc", patches, stack, dtype=np.float64).reshape(len(patches), -1)
+    return out
+
+
+def cell_features(
+    canvas: np.ndarray,
+    positions: list[tuple[int, int]] | np.ndarray,
+    tile_size: tuple[int, int],
+    weights: np.ndarray | None = None,
+    grid: int = 1,
+) -> np.ndarray:
+    # Matching descriptors of cells (and of fitted tiles, as one-cell canvases): the
+    # mean colour, or the sub-cell means of a grid x grid split scaled by 1 / grid, so
+    # squared distances are averaged over sub-cells and stay on the mean-colour scale.
+    means = cell_means(canvas, positions, tile_size, weights=weights, grid=grid)
+    if grid > 1:
+        means *= np.float32(1.0 / grid)
+    return means
+
+
+def feature_rgb(features: np.ndarray, space: ColorSpace = ColorSpace.RGB) -> np.ndarray:
+    # Mean sRGB colour of (..., 3 * grid * grid) descriptors from cell_features (and convert_features).
+    grid = math.isqrt(features.shape[-1] // 3)
+    if grid == 1 and space == ColorSpace.RGB:
+        return features
+    colors = space_to_rgb(features.reshape(*features.shape[:-1], grid * grid, 3) * grid, space)
+    return colors.mean(axis=-2)
+
+
+def _srgb_to_linear(rgb: np.ndarray) -> np.ndarray:
+    c = rgb / 255.0
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb(linear: np.ndarray) -> np.ndarray:
+    c = np.clip(linear, 0.0, 1.0)
+    return 255.0 * np.where(c <= 0.0031308, c * 12.92, 1.055 * c ** (1 / 2.4) - 0.055)
+
+
+def rgb_to_space(rgb: np.ndarray, space: ColorSpace) -> np.ndarray:
+    # (..., 3) sRGB values in 0-255 to ``space``, vectorised in float64.
+    if space == ColorSpace.RGB:
+        return np.asarray(rgb)
+    linear = _srgb_to_linear(np.asarray(rgb, dtype=np.float64))
+    if space == ColorSpace.LAB:
+        t = linear @ _RGB_TO_XYZ.T / _D65_WHITE
+        f = np.where(t > _LAB_DELTA**3, np.cbrt(t), t / (3 * _LAB_DELTA**2) + 4 / 29)
+        return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+    return np.cbrt(linear @ _RGB_TO_LMS.T) @ _LMS_TO_OKLAB.T * _OKLAB_SCALE
+
+
+def space_to_rgb(values: np.ndarray, space: ColorSpace) -> np.ndarray:
+    # Inverse of rgb_to_space, clipped to the sRGB gamut.
+    if space == ColorSpace.RGB:
+        return np.asarray(values)
+    values = np.asarray(values, dtype=np.float64)
+    if space == ColorSpace.LAB:
+        fy = (values[..., 0] + 16) / 116
+        f = np.stack([fy + values[..., 1] / 500, fy, fy - values[..., 2] / 200], axis=-1)
+        xyz = np.where(f > _LAB_DELTA, f**3, 3 * _LAB_DELTA**2 * (f - 4 / 29)) * _D65_WHITE
+        return _linear_to_srgb(xyz @ np.linalg.inv(_RGB_TO_XYZ).T)
+    lms = (values / _OKLAB_SCALE) @ np.linalg.inv(_LMS_TO_OKLAB).T
+    return _linear_to_srgb(lms**3 @ np.linalg.inv(_RGB_TO_LMS).T)
+
+
+def convert_features(features: np.ndarray, space: ColorSpace) -> np.ndarray:
+    # cell_features descriptors (mean colours, or 1/N-scaled sub-cell means) in ``space``,
+    # each colour converted on its own and the 1/N scale kept.
+    if space == ColorSpace.RGB:
+        return features
+    grid = math.isqrt(features.shape[-1] // 3)
+    colors = np.asarray(features, dtype=np.float64).reshape(*features.shape[:-1], grid * grid, 3) * grid
+    return (rgb_to_space(colors, space) / grid).reshape(features.shape).astype(np.float32)
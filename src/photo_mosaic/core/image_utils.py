@@ -1,12 +1,18 @@
 from __future__ import annotations
 
+import math
 from functools import lru_cache
+from pathlib import Path
 
 import numpy as np
 from PIL import Image, ImageDraw, ImageOps
 
 from photo_mosaic.config import FitMode
 
+# Reduced decodes keep at least this multiple of the fitted size so the final
+# bicubic resample still averages over real pixels (quality guard).
+DECODE_OVERSAMPLE = 4
+
 
 def fit_image(image: Image.Image, target_size: tuple[int, int], fit_mode: FitMode) -> Image.Image:
     if fit_mode == FitMode.STRETCH:
@@ -17,6 +23,42 @@ def fit_image(image: Image.Image, target_size: tuple[int, int], fit_mode: FitMod
     return ImageOps.pad(image, target_size, method=Image.Resampling.BICUBIC, color=(0, 0, 0))
 
 
+def _min_decode_size(source_size: tuple[int, int], target_size: tuple[int, int], fit_mode: FitMode) -> tuple[int, int]:
+    src_w, src_h = source_size
+    target_w, target_h = target_size
+    if fit_mode == FitMode.STRETCH:
+        need_w, need_h = target_w, target_h
+    else:
+        # CROP scales to cover the target, PAD scales to fit inside it.
+        pick = max if fit_mode == FitMode.CROP else min
+        scale = pick(target_w / src_w, target_h / src_h)
+        need_w, need_h = src_w * scale, src_h * scale
+    return (
+        min(src_w, math.ceil(need_w * DECODE_OVERSAMPLE)),
+        min(src_h, math.ceil(need_h * DECODE_OVERSAMPLE)),
+    )
+
+
+def load_reduced(path: Path, targets: list[tuple[tuple[int, int], FitMode]]) -> Image.Image:
+    # Decode just large enough for every (size, fit mode) the caller will fit to.
+    with Image.open(path) as img:
+        needs = [_min_decode_size(img.size, size, fit_mode) for size, fit_mode in targets]
+        need_w = max(w for w, _ in needs)
+        need_h = max(h for _, h in needs)
+        # JPEG can decode at 1/2, 1/4 or 1/8 scale directly; a no-op for other formats.
+        img.draft("RGB", (need_w, need_h))
+        image = img.convert("RGB")
+
+    factor = min(image.width // need_w, image.height // need_h)
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image
+
+
+def load_fitted(path: Path, target_size: tuple[int, int], fit_mode: FitMode) -> Image.Image:
+    return fit_image(load_reduced(path, [(target_size, fit_mode)]), target_size, fit_mode=fit_mode)
+
+
 def average_rgb(image: Image.Image) -> tuple[float, float, float]:
     pixels = image.convert("RGB").getdata()
     count = len(pixels)
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import cProfile
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_current: ContextVar[BuildMetrics | None] = ContextVar("photo_mosaic_metrics", default=None)
+
+
+def peak_rss_bytes() -> int | None:
+    # Peak resident set size of the whole process so far.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class BuildMetrics:
+    # Timers (seconds, summed when a name repeats) and counters for one or more builds.
+    # Instrumented code reports through count() and timer() to the metrics recording in
+    # its context, so builds without metrics pay one context-variable lookup per call.
+    # Several threads may record into one instance, e.g. a whole batch.
+    def __init__(self, profile: bool = False, trace_memory: bool = False) -> None:
+        self.timers: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+        self.peak_rss: int | None = None
+        self.traced_peak: int | None = None
+        # cProfile only sees the thread that records, not compose or index workers.
+        self.profiler = cProfile.Profile() if profile else None
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def record(self) -> Iterator[BuildMetrics]:
+        token = _current.set(self)
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+        try:
+            yield self
+        finally:
+            if self.profiler is not None:
+                self.profiler.disable()
+            if self.trace_memory and tracemalloc.is_tracing():
+                self.traced_peak = max(self.traced_peak or 0, tracemalloc.get_traced_memory()[1])
+                if tracing:
+                    tracemalloc.stop()
+            self.peak_rss = peak_rss_bytes()
+            _current.reset(token)
+
+    def as_dict(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "timers": {name: round(seconds, 6) for name, seconds in sorted(self.timers.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "peak_rss_bytes": self.peak_rss,
+                "traced_peak_bytes": self.traced_peak,
+            }
+
+    def write_json(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.as_dict(), indent=2) + "\n", encoding="utf-8")
+
+    def write_profile(self, path: Path) -> None:
+        # pstats format, e.g. ``python -m pstats PATH`` or snakeviz.
+        if self.profiler is None:
+            raise ValueError("Metrics were not recorded with profile=True")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.profiler.dump_stats(str(path))
+
+
+def current_metrics() -> BuildMetrics | None:
+    return _current.get()
+
+
+def count(name: str, amount: int = 1) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.count(name, amount)
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(name, time.perf_counter() - started)
@@ -1,21 +1,54 @@
 from __future__ import annotations
 
+import contextvars
+import math
+import threading
+from collections import deque
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 from dataclasses import dataclass
+from functools import cache
 from pathlib import Path
 
 import numpy as np
 from PIL import Image
 
-from photo_mosaic.config import HexBackground, MosaicConfig, Strategy, TileShape
-from photo_mosaic.core.image_utils import average_rgb, average_rgb_masked, fit_image, hex_mask
+from photo_mosaic.config import BuildStage, ColorSpace, FitMode, HexBackground, MosaicConfig, Strategy, TileShape
+from photo_mosaic.core.budget import BuildBudget, BuildCancelled
+from photo_mosaic.core.encoding import PngStreamWriter
+from photo_mosaic.core.features import cell_features, convert_features
+from photo_mosaic.core.image_utils import hex_mask, load_fitted
+from photo_mosaic.core.metrics import BuildMetrics, count, timer
+from photo_mosaic.core.pipeline import StageCache, array_digest, config_fields, file_digest, stage_key
 from photo_mosaic.core.strategies import (
+    NeighborIndex,
     SelectionContext,
+    build_neighbor_index,
     full_optimize_assign,
     greedy_assign,
     lazy_assign,
+    optimal_assign,
     random_improve_assign,
+    tile_color_matrix,
 )
-from photo_mosaic.core.tile_index import TileDescriptor, build_tile_index
+from photo_mosaic.core.tile_index import TileLibrary, build_tile_index
+
+# Pixels per strip when composing in streaming mode (about 12 MB of RGB).
+_BAND_PIXELS = 1 << 22
+# Strips per compose worker on the in-memory path.
+_STRIPS_PER_WORKER = 4
+# Tiles pasted between checks for a cancelled build.
+_CANCEL_CHECK_TILES = 4096
+# Config fields read by each memoised build stage.
+_LAYOUT_FIELDS = ("tile_width", "tile_height", "output_width", "output_height", "tile_shape")
+_LIMIT_FIELDS = ("max_repeats", "max_usage_percent")
+_STRATEGY_FIELDS = {
+    Strategy.GREEDY: (),
+    Strategy.LAZY: ("lazy_top_k", "lazy_randomness"),
+    Strategy.RANDOM: ("random_steps", "time_budget", "stage_time_budgets"),
+    Strategy.FULL: ("full_steps", "time_budget", "stage_time_budgets"),
+    Strategy.OPTIMAL: ("optimal_gap", "optimal_time_limit", "time_budget", "stage_time_budgets"),
+}
 
 
 @dataclass(slots=True)
@@ -58,91 +91,288 @@ def _source_cell_rgbs(
     tile_size: tuple[int, int],
     tile_shape: TileShape,
     hex_edge_softness: float,
+    grid: int = 1,
+    color_space: ColorSpace = ColorSpace.RGB,
 ) -> np.ndarray:
-    tile_w, tile_h = tile_size
     resized = source_image.convert("RGB")
     if resized.size != layout.canvas_size:
         resized = resized.resize(layout.canvas_size, Image.Resampling.BICUBIC)
 
-    rgbs: list[tuple[float, float, float]] = []
-    max_x = max(0, layout.canvas_size[0] - tile_w)
-    max_y = max(0, layout.canvas_size[1] - tile_h)
-    mask = hex_mask(tile_size, edge_softness=hex_edge_softness) if tile_shape == TileShape.HEX else None
+    weights = None
+    if tile_shape == TileShape.HEX:
+        weights = np.asarray(hex_mask(tile_size, edge_softness=hex_edge_softness), dtype=np.float32) / 255.0
+    features = cell_features(np.asarray(resized), layout.positions, tile_size, weights=weights, grid=grid)
+    return convert_features(features, color_space)
+
+
+def _band_rows(layout: LayoutPlan, tile_size: tuple[int, int]) -> int:
+    return max(tile_size[1], _BAND_PIXELS // layout.canvas_size[0])
+
+
+def _resized_band(source: Image.Image, canvas_size: tuple[int, int], top: int, bottom: int) -> Image.Image:
+    # Rows [top, bottom) of the source resized to the canvas. Equal to the same rows of a
+    # full resize, up to rounding where a strip edge falls between source rows.
+    width, height = canvas_size
+    box = (0, top * source.height / height, source.width, bottom * source.height / height)
+    return source.resize((width, bottom - top), Image.Resampling.BICUBIC, box=box)
+
+
+def _banded_cell_rgbs(
+    source_image: Image.Image,
+    layout: LayoutPlan,
+    tile_size: tuple[int, int],
+    tile_shape: TileShape,
+    hex_edge_softness: float,
+    grid: int = 1,
+    color_space: ColorSpace = ColorSpace.RGB,
+) -> np.ndarray:
+    # Same features as _source_cell_rgbs without ever holding the canvas-sized source.
+    weights = None
+    if tile_shape == TileShape.HEX:
+        weights = np.asarray(hex_mask(tile_size, edge_softness=hex_edge_softness), dtype=np.float32) / 255.0
+    coords = np.asarray(layout.positions, dtype=np.int64).reshape(-1, 2)
+    rows = np.unique(coords[:, 1])
+    per_band = max(1, _band_rows(layout, tile_size) // tile_size[1])
+    out = np.empty((len(coords), 3 * grid * grid), dtype=np.float32)
+    for start in range(0, len(rows), per_band):
+        top, last = int(rows[start]), int(rows[min(start + per_band, len(rows)) - 1])
+        members = np.flatnonzero((coords[:, 1] >= top) & (coords[:, 1] <= last))
+        band = _resized_band(source_image, layout.canvas_size, top, min(last + tile_size[1], layout.canvas_size[1]))
+        out[members] = cell_features(np.asarray(band), coords[members] - [0, top], tile_size, weights=weights, grid=grid)
+    return convert_features(out, color_space)
+
+
+def _compose_band(
+    canvas: Image.Image,
+    top: int,
+    members: Sequence[int],
+    assignments: list[int],
+    tiles: TileLibrary,
+    layout: LayoutPlan,
+    tile_size: tuple[int, int],
+    fit_mode: FitMode,
+    mask: Image.Image | None,
+    rendered_cache: dict[int, Image.Image],
+    cancel: threading.Event | None = None,
+) -> Image.Image:
+    # Pastes the tiles overlapping rows [top, top + canvas height) in layout order, so a
+    # strip is identical to the same rows of a whole-canvas render.
+    if tiles.pixels is not None and mask is None:
+        # Rect tiles from the atlas are plain array copies, no decoding at all.
+        pixels = np.array(canvas)
+        tile_w, tile_h = tile_size
+        bottom = top + canvas.height
+        for pasted, i in enumerate(members):
+            if pasted % _CANCEL_CHECK_TILES == 0:
+                _check_cancel(cancel)
+            x, y = layout.positions[i]
+            first, last = max(y, top), min(y + tile_h, bottom)
+            pixels[first - top : last - top, x : x + tile_w] = tiles.pixels[assignments[i]][first - y : last - y]
+        return Image.fromarray(pixels)
+
+    for pasted, i in enumerate(members):
+        if pasted % _CANCEL_CHECK_TILES == 0:
+            _check_cancel(cancel)
+        x, y = layout.positions[i]
+        tile_index = assignments[i]
+        tile_image = rendered_cache.get(tile_index)
+        if tile_image is None:
+            if tiles.pixels is not None:
+                tile_image = Image.fromarray(np.asarray(tiles.pixels[tile_index]))
+            else:
+                tile_image = load_fitted(tiles.path(tile_index), tile_size, fit_mode)
+                count("compose.decoded")
+            rendered_cache[tile_index] = tile_image
 
-    for x, y in layout.positions:
-        left = min(x, max_x)
-        top = min(y, max_y)
-        patch = resized.crop((left, top, left + tile_w, top + tile_h))
         if mask is None:
-            rgbs.append(average_rgb(patch))
+            canvas.paste(tile_image, (x, y - top))
         else:
-            rgbs.append(average_rgb_masked(patch, mask))
+            canvas.paste(tile_image, (x, y - top), mask)
+
+    return canvas
+
+
+def _check_cancel(cancel: threading.Event | None) -> None:
+    if cancel is not None and cancel.is_set():
+        raise BuildCancelled("Build cancelled")
+
 
-    return np.array(rgbs, dtype=np.float32)
+def _strip_members(tops: np.ndarray, tile_h: int, top: int, bottom: int) -> list[int]:
+    # Layout order is kept so overlapping hex tiles blend exactly as in a serial render.
+    return np.flatnonzero((tops < bottom) & (tops + tile_h > top)).tolist()
+
+
+def _ordered_results(executor: Executor | None, fn: Callable[[int], Image.Image], items: range, window: int) -> Iterator[Image.Image]:
+    # Results in item order with at most ``window`` strips in flight. Workers run in a
+    # copy of the caller's context so they report to its metrics.
+    if executor is None:
+        yield from map(fn, items)
+        return
+    pending: deque[Future[Image.Image]] = deque()
+    for item in items:
+        pending.append(executor.submit(contextvars.copy_context().run, fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 
 def _compose(
     assignments: list[int],
-    tiles: list[TileDescriptor],
+    tiles: TileLibrary,
     layout: LayoutPlan,
     tile_size: tuple[int, int],
-    fit_mode,
+    fit_mode: FitMode,
     tile_shape: TileShape,
     hex_edge_softness: float,
     base_image: Image.Image | None,
+    workers: int = 1,
+    cancel: threading.Event | None = None,
 ) -> Image.Image:
-    canvas = base_image.copy() if base_image is not None else Image.new("RGB", layout.canvas_size)
-    rendered_cache: dict[Path, Image.Image] = {}
     mask = hex_mask(tile_size, edge_softness=hex_edge_softness) if tile_shape == TileShape.HEX else None
+    if workers <= 1:
+        canvas = base_image.copy() if base_image is not None else Image.new("RGB", layout.canvas_size)
+        return _compose_band(canvas, 0, range(len(assignments)), assignments, tiles, layout, tile_size, fit_mode, mask, {}, cancel)
 
-    for i, tile_index in enumerate(assignments):
-        x, y = layout.positions[i]
-        tile_path = tiles[tile_index].path
-        tile_image = rendered_cache.get(tile_path)
-        if tile_image is None:
-            with Image.open(tile_path) as raw_tile:
-                tile_image = fit_image(raw_tile.convert("RGB"), tile_size, fit_mode=fit_mode)
-            rendered_cache[tile_path] = tile_image
+    # Row strips are rendered independently, each repainting every tile that
+    # overlaps it, and pasted back in order; a few strips per worker keeps the pool busy.
+    width, height = layout.canvas_size
+    tile_h = tile_size[1]
+    rows = max(1, math.ceil(height / (workers * _STRIPS_PER_WORKER * tile_h))) * tile_h
+    tops = np.asarray([y for _, y in layout.positions], dtype=np.int64)
+    rendered_cache: dict[int, Image.Image] = {}
 
-        if mask is None:
-            canvas.paste(tile_image, (x, y))
+    def render(top: int) -> Image.Image:
+        bottom = min(top + rows, height)
+        if base_image is not None:
+            strip = base_image.crop((0, top, width, bottom))
         else:
-            canvas.paste(tile_image, (x, y), mask)
+            strip = Image.new("RGB", (width, bottom - top))
+        members = _strip_members(tops, tile_h, top, bottom)
+        return _compose_band(strip, top, members, assignments, tiles, layout, tile_size, fit_mode, mask, rendered_cache, cancel)
 
+    canvas = Image.new("RGB", layout.canvas_size)
+    starts = range(0, height, rows)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for top, strip in zip(starts, _ordered_results(executor, render, starts, 2 * workers)):
+            canvas.paste(strip, (0, top))
     return canvas
 
 
-def build_mosaic(config: MosaicConfig) -> Path:
-    base_image: Image.Image | None = None
-    with Image.open(config.source_image) as source:
-        layout = _compute_layout(source.size, config)
-        source_for_layout = source.convert("RGB").resize(layout.canvas_size, Image.Resampling.BICUBIC)
-        source_rgbs = _source_cell_rgbs(
-            source_for_layout,
-            layout=layout,
-            tile_size=config.tile_size,
-            tile_shape=config.tile_shape,
-            hex_edge_softness=config.hex_edge_softness,
-        )
-        if config.tile_shape == TileShape.HEX and config.hex_background == HexBackground.SOURCE:
-            base_image = source_for_layout
+def _compose_streaming(
+    output_path: Path,
+    assignments: list[int],
+    tiles: TileLibrary,
+    layout: LayoutPlan,
+    tile_size: tuple[int, int],
+    fit_mode: FitMode,
+    tile_shape: TileShape,
+    hex_edge_softness: float,
+    background: Image.Image | None,
+    workers: int = 1,
+    cancel: threading.Event | None = None,
+) -> None:
+    # Renders and encodes one horizontal strip at a time; ``background`` is the
+    # unresized source, resampled strip by strip for hex backgrounds. With several
+    # workers, up to two strips per worker are in flight while earlier ones encode.
+    width, height = layout.canvas_size
+    mask = hex_mask(tile_size, edge_softness=hex_edge_softness) if tile_shape == TileShape.HEX else None
+    tops = np.asarray([y for _, y in layout.positions], dtype=np.int64)
+    rows = _band_rows(layout, tile_size)
+    rendered_cache: dict[int, Image.Image] = {}
+
+    def render(top: int) -> Image.Image:
+        bottom = min(top + rows, height)
+        if background is not None:
+            strip = _resized_band(background, layout.canvas_size, top, bottom)
+        else:
+            strip = Image.new("RGB", (width, bottom - top))
+        members = _strip_members(tops, tile_size[1], top, bottom)
+        return _compose_band(strip, top, members, assignments, tiles, layout, tile_size, fit_mode, mask, rendered_cache, cancel)
 
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with PngStreamWriter(output_path, layout.canvas_size) as writer:
+            for strip in _ordered_results(executor, render, range(0, height, rows), 2 * workers):
+                writer.write(np.asarray(strip))
+    except BaseException:
+        # A partly written PNG is unreadable; do not leave it behind.
+        output_path.unlink(missing_ok=True)
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+@dataclass(slots=True)
+class LoadedTiles:
+    # The parts of a build that depend only on the tile library, shareable across sources.
+    # ``digest`` identifies the library contents in memoised stage keys; ``scan`` is the
+    # scan_digest of the tile directories taken before loading, when one was asked for.
+    tiles: TileLibrary
+    neighbors: NeighborIndex
+    digest: str = ""
+    scan: str = ""
+
+    @property
+    def nbytes(self) -> int:
+        # Heap buffers only, each counted once: memory-mapped cache files live in the page cache.
+        arrays = [self.tiles.colors, self.tiles.pixels, self.tiles.paths.blob, self.tiles.paths.offsets]
+        arrays.extend(vars(self.neighbors).values())
+        held: dict[int, int] = {}
+        for array in arrays:
+            while isinstance(array, np.ndarray) and array.base is not None:
+                array = array.base
+            if isinstance(array, np.ndarray) and not isinstance(array, np.memmap):
+                held[id(array)] = array.nbytes
+        return sum(held.values())
+
+
+def load_tiles(config: MosaicConfig, atlas: bool | None = None, scan: str = "") -> LoadedTiles:
+    # ``atlas`` defaults to storing fitted pixels only alongside a cache file.
+    if atlas is None:
+        atlas = config.cache_atlas and config.cache_path is not None
     tiles = build_tile_index(
         tile_dirs=config.tile_dirs,
         tile_size=config.tile_size,
         fit_mode=config.fit_mode,
         tile_shape=config.tile_shape,
         hex_edge_softness=config.hex_edge_softness,
+        grid=config.feature_grid,
+        color_space=config.color_space,
         cache_path=config.cache_path,
         refresh_cache=config.refresh_cache,
+        workers=config.index_workers,
+        content_hash=config.cache_content_hash,
+        rescan=config.cache_rescan,
+        atlas=atlas,
     )
     if not tiles:
         raise ValueError("No valid tile images were found in the provided directories")
+    with timer("library.neighbors"):
+        neighbors = build_neighbor_index(tile_color_matrix(tiles), config.neighbor_search)
+    return LoadedTiles(
+        tiles=tiles,
+        neighbors=neighbors,
+        digest=array_digest(tiles.colors, tiles.paths.blob, tiles.paths.offsets),
+        scan=scan,
+    )
+
 
+def _assign(
+    config: MosaicConfig,
+    source_rgbs: np.ndarray,
+    library: LoadedTiles,
+    seed: Callable[[], np.ndarray],
+    deadline: float | None = None,
+    cancel: threading.Event | None = None,
+) -> np.ndarray:
+    # Random and full search until ``deadline`` when there is one, instead of for their step counts.
+    tiles, neighbors = library.tiles, library.neighbors
     selection_context = SelectionContext(
         max_repeats=config.max_repeats,
         max_usage_percent=config.max_usage_percent,
-        total_tiles=len(layout.positions),
+        total_tiles=len(source_rgbs),
     )
     if config.strategy == Strategy.LAZY:
         assignments = lazy_assign(
@@ -151,36 +381,171 @@ def build_mosaic(config: MosaicConfig) -> Path:
             ctx=selection_context,
             top_k=config.lazy_top_k,
             randomness=config.lazy_randomness,
+            neighbors=neighbors,
+            cancel=cancel,
         )
-    else:
-        assignments = greedy_assign(source_rgbs, tiles=tiles, ctx=selection_context)
-
-    if config.strategy == Strategy.RANDOM:
+    elif config.strategy == Strategy.OPTIMAL:
+        assignments = optimal_assign(
+            source_rgbs,
+            tiles=tiles,
+            ctx=selection_context,
+            gap=config.optimal_gap,
+            time_limit=config.optimal_time_limit,
+            neighbors=neighbors,
+            deadline=deadline,
+            cancel=cancel,
+        )
+    elif config.strategy == Strategy.RANDOM:
         assignments = random_improve_assign(
             source_rgbs,
             tiles=tiles,
-            initial_assignments=assignments,
+            initial_assignments=seed().tolist(),
             steps=config.random_steps,
+            deadline=deadline,
+            cancel=cancel,
         )
     elif config.strategy == Strategy.FULL:
         assignments = full_optimize_assign(
             source_rgbs,
             tiles=tiles,
-            initial_assignments=assignments,
+            initial_assignments=seed().tolist(),
             ctx=selection_context,
             steps=config.full_steps,
+            neighbors=neighbors,
+            deadline=deadline,
+            cancel=cancel,
         )
+    else:
+        return seed()
+    return np.asarray(assignments, dtype=np.int64)
 
-    output_image = _compose(
-        assignments=assignments,
-        tiles=tiles,
-        layout=layout,
-        tile_size=config.tile_size,
-        fit_mode=config.fit_mode,
-        tile_shape=config.tile_shape,
-        hex_edge_softness=config.hex_edge_softness,
-        base_image=base_image,
+
+def _greedy_seed(
+    config: MosaicConfig,
+    source_rgbs: np.ndarray,
+    library: LoadedTiles,
+    cancel: threading.Event | None = None,
+) -> np.ndarray:
+    # Greedy result under the usage limits; also the starting point of random and full.
+    selection_context = SelectionContext(
+        max_repeats=config.max_repeats,
+        max_usage_percent=config.max_usage_percent,
+        total_tiles=len(source_rgbs),
     )
-    config.output_path.parent.mkdir(parents=True, exist_ok=True)
-    output_image.save(config.output_path)
+    with timer("assign.seed"):
+        assignments = greedy_assign(source_rgbs, tiles=library.tiles, ctx=selection_context, neighbors=library.neighbors, cancel=cancel)
+    return np.asarray(assignments, dtype=np.int64)
+
+
+def render_mosaic(
+    config: MosaicConfig,
+    library: LoadedTiles,
+    on_stage: Callable[[str], None] | None = None,
+    stages: StageCache | None = None,
+    budget: BuildBudget | None = None,
+) -> Path:
+    # Only reads ``library``, so several renders may share one from different threads.
+    # ``on_stage`` is told when each stage (features, assign, compose) starts. Layout,
+    # source features, the greedy seed and the assignment are memoised in ``stages``
+    # (and config.stage_cache_dir) under keys made of the config fields they read and
+    # the keys of the stages they consume, so a re-run only redoes what changed.
+    # ``budget`` (by default the config's) bounds the assign stage, records how long
+    # each stage took and carries the cancel flag.
+    report = on_stage or (lambda stage: None)
+    stages = StageCache() if stages is None else stages
+    budget = BuildBudget.from_config(config) if budget is None else budget
+    cancel = budget.cancelled
+    directory = config.stage_cache_dir
+    hex_tiles = config.tile_shape == TileShape.HEX
+    with Image.open(config.source_image) as source:
+        rgb = cache(lambda: source.convert("RGB"))
+        resized = cache(lambda: rgb().resize(layout.canvas_size, Image.Resampling.BICUBIC))
+
+        with budget.stage(BuildStage.FEATURES):
+            report("features")
+            layout_fields = _LAYOUT_FIELDS + (("hex_overlap",) if hex_tiles else ())
+            layout_key = stage_key("layout", source.size, config_fields(config, layout_fields))
+            layout = stages.get("layout", layout_key, lambda: _compute_layout(source.size, config))
+
+            def features() -> np.ndarray:
+                # Streaming never materialises the canvas-sized source; strips are resampled on demand.
+                extract = _banded_cell_rgbs if config.stream_output else _source_cell_rgbs
+                return extract(
+                    rgb() if config.stream_output else resized(),
+                    layout=layout,
+                    tile_size=config.tile_size,
+                    tile_shape=config.tile_shape,
+                    hex_edge_softness=config.hex_edge_softness,
+                    grid=config.feature_grid,
+                    color_space=config.color_space,
+                )
+
+            feature_fields = ("stream_output",) + (("hex_edge_softness",) if hex_tiles else ())
+            if config.feature_grid > 1:
+                feature_fields += ("feature_grid",)
+            if config.color_space != ColorSpace.RGB:
+                feature_fields += ("color_space",)
+            source_digest = file_digest(config.source_image)
+            features_key = stage_key("features", layout_key, source_digest, config_fields(config, feature_fields))
+            source_rgbs = stages.get("features", features_key, features, directory)
+
+        with budget.stage(BuildStage.ASSIGN) as deadline:
+            report("assign")
+            seed_key = stage_key("seed", features_key, library.digest, config_fields(config, _LIMIT_FIELDS))
+            strategy_fields = _LIMIT_FIELDS + ("strategy",) + _STRATEGY_FIELDS[config.strategy]
+            assign_key = stage_key("assign", features_key, library.digest, config_fields(config, strategy_fields))
+
+            def seed() -> np.ndarray:
+                return stages.get("seed", seed_key, lambda: _greedy_seed(config, source_rgbs, library, cancel), directory)
+
+            def assign() -> np.ndarray:
+                return _assign(config, source_rgbs, library, seed, deadline, cancel)
+
+            # Under a deadline the result depends on the wall clock, so it is never memoised.
+            assignments = stages.get("assign", assign_key, assign, directory, store=deadline is None).tolist()
+
+        with budget.stage(BuildStage.COMPOSE):
+            report("compose")
+            count("compose.tiles", len(assignments))
+            background = None
+            if hex_tiles and config.hex_background == HexBackground.SOURCE:
+                background = rgb() if config.stream_output else resized()
+            config.output_path.parent.mkdir(parents=True, exist_ok=True)
+            if config.stream_output:
+                _compose_streaming(
+                    config.output_path,
+                    assignments=assignments,
+                    tiles=library.tiles,
+                    layout=layout,
+                    tile_size=config.tile_size,
+                    fit_mode=config.fit_mode,
+                    tile_shape=config.tile_shape,
+                    hex_edge_softness=config.hex_edge_softness,
+                    background=background,
+                    workers=config.compose_workers,
+                    cancel=cancel,
+                )
+                return config.output_path
+
+            output_image = _compose(
+                assignments=assignments,
+                tiles=library.tiles,
+                layout=layout,
+                tile_size=config.tile_size,
+                fit_mode=config.fit_mode,
+                tile_shape=config.tile_shape,
+                hex_edge_softness=config.hex_edge_softness,
+                base_image=background,
+                workers=config.compose_workers,
+                cancel=cancel,
+            )
+            with timer("compose.save"):
+                output_image.save(config.output_path)
     return config.output_path
+
+
+def build_mosaic(config: MosaicConfig, budget: BuildBudget | None = None, metrics: BuildMetrics | None = None) -> Path:
+    # One-shot build; hold a MosaicEngine to keep the tile library warm between builds.
+    from photo_mosaic.core.engine import MosaicEngine
+
+    return MosaicEngine(keep_pixels=False).render(config, budget=budget, metrics=metrics)
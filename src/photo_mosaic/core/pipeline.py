@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, TypeVar
+
+import numpy as np
+
+from photo_mosaic.cache import load_array, write_array
+from photo_mosaic.config import MosaicConfig
+from photo_mosaic.core.metrics import count
+
+T = TypeVar("T")
+
+DEFAULT_STAGE_BYTES = 512 << 20
+# Size charged for stage results that are not arrays (layouts): bytes per element.
+_OBJECT_ITEM_BYTES = 64
+
+
+def stage_key(stage: str, *parts: Any) -> str:
+    # Stable across processes, so keys can name files in an on-disk stage cache.
+    payload = json.dumps([stage, *parts], default=str, sort_keys=True)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def config_fields(config: MosaicConfig, fields: tuple[str, ...]) -> dict[str, Any]:
+    return {name: getattr(config, name) for name in fields}
+
+
+def file_digest(path: Path) -> str:
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "blake2b").hexdigest()[:32]
+
+
+def array_digest(*arrays: np.ndarray | None) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        if array is not None:
+            digest.update(np.ascontiguousarray(array).view(np.uint8).reshape(-1).data)
+    return digest.hexdigest()
+
+
+def _nbytes(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return _OBJECT_ITEM_BYTES * len(getattr(value, "positions", ()))
+
+
+class StageCache:
+    # Memoised results of build stages keyed by stage_key, evicted least recently
+    # used beyond ``max_bytes``. Array results can also be kept in a directory so
+    # they survive across processes. Safe to share between threads; a result raced
+    # by two builds is just computed twice.
+    def __init__(self, max_bytes: int = DEFAULT_STAGE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.hits: dict[str, int] = {}
+        self._entries: OrderedDict[str, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, stage: str, key: str, compute: Callable[[], T], directory: Path | None = None, store: bool = True) -> T:
+        # Without ``store`` a computed result is returned but not kept, for results
+        # the key does not fully determine; stored results are still served.
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits[stage] = self.hits.get(stage, 0) + 1
+                count(f"stage_cache.{stage}.hits")
+                return self._entries[key]
+
+        path = directory / f"{stage}-{key}.npy" if directory is not None else None
+        value = load_array(path, mmap=False) if path is not None else None
+        loaded = value is not None
+        count(f"stage_cache.{stage}.{'disk_hits' if loaded else 'misses'}")
+        if value is None:
+            value = compute()
+            if not store:
+                return value
+            if path is not None and isinstance(value, np.ndarray):
+                write_array(path, value)
+
+        with self._lock:
+            if loaded:
+                self.hits[stage] = self.hits.get(stage, 0) + 1
+            self._entries[key] = value
+            total = sum(_nbytes(entry) for entry in self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                total -= _nbytes(evicted)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from collections.abc import Iterator, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from queue import SimpleQueue
+
+from photo_mosaic.core.metrics import count
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+# Listing is I/O bound (network filesystems especially), so threads overlap the waits.
+SCAN_WORKERS = 8
+# Directory listings in flight per worker; bounds memory when the consumer is slower.
+_LISTINGS_PER_WORKER = 2
+
+ScannedFile = tuple[str, os.stat_result]
+
+
+def _list_directory(directory: str) -> tuple[list[ScannedFile], list[str]]:
+    # The dirent type answers is_dir/is_file without a stat on most filesystems; only
+    # image files are stat'ed, here on the scan thread, for the indexer's fingerprint.
+    files: list[ScannedFile] = []
+    subdirs: list[str] = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # Match Path.rglob: "." lists as bare names, and symlinked directories are not followed.
+                path = entry.name if directory == "." else entry.path
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(path)
+                    elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS and entry.is_file():
+                        files.append((path, entry.stat()))
+                except OSError:
+                    # Removed or unreadable while listing.
+                    continue
+    except OSError:
+        pass
+    return files, subdirs
+
+
+def scan_image_files(tile_dirs: Sequence[Path], workers: int = SCAN_WORKERS) -> Iterator[ScannedFile]:
+    # Yields (path, stat) for every image file under ``tile_dirs`` while directories
+    # are still being listed, each path once and in no particular order. Missing
+    # and unreadable directories are skipped.
+    roots = list(dict.fromkeys(str(tile_dir) for tile_dir in tile_dirs))
+    # Only overlapping roots can list a file twice.
+    seen: set[str] | None = set() if len(roots) > 1 else None
+    pending = roots[::-1]
+    listed: SimpleQueue[Future] = SimpleQueue()
+    running = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tile-scan") as executor:
+        try:
+            while pending or running:
+                while pending and running < max(1, workers) * _LISTINGS_PER_WORKER:
+                    # Depth first keeps the frontier small on wide trees.
+                    executor.submit(_list_directory, pending.pop()).add_done_callback(listed.put)
+                    running += 1
+                files, subdirs = listed.get().result()
+                running -= 1
+                count("scan.directories")
+                pending.extend(reversed(subdirs))
+                for path, stat in files:
+                    if seen is not None:
+                        if path in seen:
+                            continue
+                        seen.add(path)
+                    yield path, stat
+        finally:
+            # A consumer that stops early abandons the listings not yet started.
+            executor.shutdown(cancel_futures=True)
+
+
+def scan_digest(tile_dirs: Sequence[Path], workers: int = SCAN_WORKERS) -> str:
+    # Changes when an image file under ``tile_dirs`` is added, removed or rewritten
+    # (by size and mtime); only lists and stats, never reads a file.
+    digest = hashlib.blake2b(digest_size=16)
+    for path, size, mtime in sorted((path, stat.st_size, stat.st_mtime_ns) for path, stat in scan_image_files(tile_dirs, workers)):
+        digest.update(f"{path}\0{size}\0{mtime}\n".encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
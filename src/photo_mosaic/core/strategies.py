@@ -2,12 +2,43 @@ from __future__ import annotations
 
 import math
 import random
-from collections import defaultdict
+import threading
+import time
+from collections.abc import Iterator, Sequence
 from dataclasses import dataclass
+from typing import Protocol
 
 import numpy as np
 
-from photo_mosaic.core.tile_index import TileDescriptor
+from photo_mosaic.config import NeighborSearch
+from photo_mosaic.core.budget import BuildCancelled
+from photo_mosaic.core.metrics import count as count_metric
+from photo_mosaic.core.tile_index import TileDescriptor, TileLibrary
+
+# Cells answered per batched k-NN query.
+_QUERY_BATCH = 1024
+# Leaves the KD-tree ranks up front per query; deeper searches fall back to argmin scans.
+_LEAF_PROBES = 8
+# Candidates fetched up front when usage limits apply, and growth factor once they run out.
+_INITIAL_K = 8
+_K_GROWTH = 4
+# AUTO picks brute force up to this many tiles, and for descriptors wider than
+# _KDTREE_MAX_DIMS (sub-cell grids), where leaf bounds prune too little to pay off.
+_BRUTE_FORCE_MAX_TILES = 4096
+_KDTREE_MAX_DIMS = 8
+# Bound on the (cells, tiles) distance block brute force materialises at once.
+_BRUTE_BLOCK_ELEMENTS = 1 << 22
+# Cells whose capacity conflicts greedy_assign settles together.
+_ASSIGN_BLOCK = 8192
+# Local-search moves proposed per vectorized round, and nearest tiles "full" picks from.
+_MOVE_BATCH = 4096
+_SHORTLIST = 20
+# Factor the auction's bid increment shrinks by between scaling phases.
+_EPS_SCALING = 6.0
+# Bidders left when the auction switches from vectorized rounds to one bid at a time.
+_SERIAL_BIDDERS = 32
+# Under a deadline, local search also ends after this many proposals per cell in a row change nothing.
+_STALL_DRAWS = 20
 
 
 @dataclass(slots=True)
@@ -17,6 +48,13 @@ class SelectionContext:
     total_tiles: int
 
 
+def _stop(deadline: float | None, cancel: threading.Event | None) -> bool:
+    # True once ``deadline`` (a time.perf_counter() value) has passed; raises if cancelled.
+    if cancel is not None and cancel.is_set():
+        raise BuildCancelled("Build cancelled")
+    return deadline is not None and time.perf_counter() > deadline
+
+
 def build_usage_limit(ctx: SelectionContext) -> int | None:
     limits: list[int] = []
     if ctx.max_repeats is not None:
@@ -28,165 +66,788 @@ def build_usage_limit(ctx: SelectionContext) -> int | None:
     return min(limits)
 
 
-def _score(assign: list[int], source_cell_rgbs: np.ndarray, tile_colors: np.ndarray) -> float:
-    selected = tile_colors[np.array(assign)]
-    return float(np.mean(np.sum((selected - source_cell_rgbs) ** 2, axis=1)))
+def tile_color_matrix(tiles: TileLibrary | Sequence[TileDescriptor]) -> np.ndarray:
+    if not isinstance(tiles, TileLibrary):
+        tiles = TileLibrary.from_descriptors(tiles)
+    # Zero-copy: the library already holds a float32 (N, D) matrix, possibly memmapped.
+    return np.asarray(tiles.colors, dtype=np.float32)
+
+
+class NeighborIndex(Protocol):
+    colors: np.ndarray
+    size: int
+
+    def query(self, points: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        # Returns (distances, indices), each (len(points), min(k, size)), nearest first.
+        ...
+
+
+def _squared_distances(channels: Sequence[np.ndarray], points: np.ndarray) -> np.ndarray:
+    # ``channels`` are per-channel candidate arrays broadcasting against (len(points), 1).
+    # Adds run in the same order (and float32 rounding) as a per-cell
+    # np.sum((tile_colors - rgb) ** 2, axis=1), without a slow narrow reduction.
+    dists = (channels[0] - points[:, 0, None]) ** 2
+    for channel in range(1, len(channels)):
+        dists += (channels[channel] - points[:, channel, None]) ** 2
+    return dists
+
+
+def _rank_keys(dists: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    # Non-negative float32 bit patterns sort like the values, so (distance, tile index)
+    # packs into one uint64 key and ties break on tile index whatever the search structure.
+    return (dists.view(np.uint32).astype(np.uint64) << np.uint64(32)) | indices.astype(np.uint64, copy=False)
+
+
+def _smallest_keys(keys: np.ndarray, k: int) -> np.ndarray:
+    if k < keys.shape[1]:
+        keys = np.partition(keys, k - 1, axis=1)[:, :k]
+    return np.sort(keys, axis=1)
+
+
+def _unpack_keys(keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    dists = (keys >> np.uint64(32)).astype(np.uint32).view(np.float32)
+    return dists, (keys & np.uint64(0xFFFFFFFF)).astype(np.int64)
+
+
+def _nearest_first(dists: np.ndarray, indices: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    return _unpack_keys(_smallest_keys(_rank_keys(dists, indices), k))
+
+
+class BruteForceIndex:
+    def __init__(self, colors: np.ndarray) -> None:
+        self.colors = np.asarray(colors, dtype=np.float32)
+        self.size = len(self.colors)
+        self._channels = np.ascontiguousarray(self.colors.T)
+
+    def query(self, points: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        points = np.asarray(points, dtype=np.float32).reshape(-1, self.colors.shape[1])
+        k = max(1, min(k, self.size))
+        out_d = np.empty((len(points), k), dtype=np.float32)
+        out_i = np.empty((len(points), k), dtype=np.int64)
+        block = max(1, _BRUTE_BLOCK_ELEMENTS // max(1, self.size))
+        for start in range(0, len(points), block):
+            dists = _squared_distances(self._channels, points[start : start + block])
+            indices = np.broadcast_to(np.arange(self.size), dists.shape)
+            out_d[start : start + block], out_i[start : start + block] = _nearest_first(dists, indices, k)
+        return out_d, out_i
+
+
+class KDTreeIndex:
+    # Exact k-NN over a median-split KD partition with bucket leaves. Queries are
+    # answered in batches by visiting leaves in order of their box lower bound
+    # until no unvisited leaf can beat the current k-th distance.
+    def __init__(self, colors: np.ndarray, leaf_size: int | None = None) -> None:
+        self.colors = np.asarray(colors, dtype=np.float32)
+        self.size = len(self.colors)
+        # Wide leaves keep the per-batch (queries, leaves) bound matrix small.
+        leaf_size = leaf_size or int(np.clip(2 * np.sqrt(self.size), 32, 2048))
+
+        leaves: list[np.ndarray] = []
+        stack = [np.arange(self.size)]
+        while stack:
+            members = stack.pop()
+            if len(members) <= leaf_size:
+                leaves.append(members)
+                continue
+            points = self.colors[members]
+            spread = points.max(axis=0) - points.min(axis=0)
+            # Identical points still split (by position) so leaves stay bounded.
+            order = np.argsort(points[:, int(np.argmax(spread))], kind="stable")
+            half = len(members) // 2
+            stack.extend([members[order[half:]], members[order[:half]]])
+
+        self._leaf_indices = np.full((len(leaves), leaf_size), self.size, dtype=np.uint64)
+        for i, members in enumerate(leaves):
+            self._leaf_indices[i, : len(members)] = members
+        # Channel-major (D, leaves, leaf_size); padding slots point at an extra +inf row so they never win.
+        padded = np.vstack([self.colors, np.full((1, self.colors.shape[1]), np.inf, dtype=np.float32)])
+        self._leaf_points = np.ascontiguousarray(np.moveaxis(padded[self._leaf_indices], 2, 0))
+        self._leaf_low = np.ascontiguousarray(np.stack([self.colors[m].min(axis=0) for m in leaves]).T)
+        self._leaf_high = np.ascontiguousarray(np.stack([self.colors[m].max(axis=0) for m in leaves]).T)
+
+    def query(self, points: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        points = np.asarray(points, dtype=np.float32).reshape(-1, self.colors.shape[1])
+        k = max(1, min(k, self.size))
+        out_d = np.empty((len(points), k), dtype=np.float32)
+        out_i = np.empty((len(points), k), dtype=np.int64)
+        for start in range(0, len(points), _QUERY_BATCH):
+            batch = points[start : start + _QUERY_BATCH]
+            out_d[start : start + len(batch)], out_i[start : start + len(batch)] = self._query_batch(batch, k)
+        return out_d, out_i
+
+    def _query_batch(self, points: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        # Squared distance from each query to each leaf's bounding box.
+        bounds = np.zeros((len(points), self._leaf_low.shape[1]), dtype=np.float32)
+        for channel in range(points.shape[1]):
+            value = points[:, channel, None]
+            gap = np.maximum(self._leaf_low[channel] - value, 0) + np.maximum(value - self._leaf_high[channel], 0)
+            bounds += gap * gap
+        # Running k best as packed (distance, index) keys, nearest first.
+        best = np.full((len(points), k), _rank_keys(np.array([np.inf], dtype=np.float32), np.array([self.size]))[0])
+
+        # Rank the few most promising leaves once instead of an argmin over all leaves per step.
+        probes = min(_LEAF_PROBES, bounds.shape[1])
+        ranked = np.argpartition(bounds, probes - 1, axis=1)[:, :probes] if probes < bounds.shape[1] else np.argsort(bounds, axis=1)
+        ranked = np.take_along_axis(ranked, np.argsort(np.take_along_axis(bounds, ranked, axis=1), axis=1), axis=1)
+
+        active = np.arange(len(points))
+        step = 0
+        while active.size:
+            if step < probes:
+                leaf = ranked[active, step]
+            else:
+                if step == probes:
+                    bounds[active[:, None], ranked[active]] = np.inf
+                leaf = np.argmin(bounds[active], axis=1)
+            step += 1
+            # <= keeps visiting leaves that could hold an equal-distance, lower-index tile.
+            keep = bounds[active, leaf] <= _unpack_keys(best[active, -1])[0]
+            active, leaf = active[keep], leaf[keep]
+            if not active.size:
+                break
+            if step > probes:
+                bounds[active, leaf] = np.inf
+            cand_d = _squared_distances([channel[leaf] for channel in self._leaf_points], points[active])
+            merged = np.concatenate([best[active], _rank_keys(cand_d, self._leaf_indices[leaf])], axis=1)
+            best[active] = _smallest_keys(merged, k)
+        return _unpack_keys(best)
+
+
+def build_neighbor_index(tile_colors: np.ndarray, kind: NeighborSearch = NeighborSearch.AUTO) -> NeighborIndex:
+    small = len(tile_colors) <= _BRUTE_FORCE_MAX_TILES or tile_colors.shape[1] > _KDTREE_MAX_DIMS
+    if kind == NeighborSearch.BRUTE or (kind == NeighborSearch.AUTO and small):
+        return BruteForceIndex(tile_colors)
+    return KDTreeIndex(tile_colors)
+
+
+def _neighbor_kind(index: NeighborIndex) -> NeighborSearch:
+    return NeighborSearch.BRUTE if isinstance(index, BruteForceIndex) else NeighborSearch.AUTO
+
+
+def _first_available(
+    index: NeighborIndex,
+    source_rgb: np.ndarray,
+    candidates: np.ndarray,
+    usage: np.ndarray,
+    usage_limit: int | None,
+) -> int | None:
+    # Walk candidates nearest-first; when all are used up, re-query with a larger k
+    # instead of sorting the whole library.
+    checked = 0
+    while True:
+        for idx in candidates[checked:]:
+            if usage_limit is None or usage[idx] < usage_limit:
+                return int(idx)
+        checked = len(candidates)
+        if checked >= index.size or (usage_limit is not None and usage.min() >= usage_limit):
+            return None
+        candidates = _query_wide(index, source_rgb[None, :], checked * _K_GROWTH)[0]
+
+
+def _query_wide(index: NeighborIndex, points: np.ndarray, k: int) -> np.ndarray:
+    # Indices of the k nearest tiles for possibly large k, chunked to bound memory.
+    k = min(k, index.size)
+    # Near-full expansions are cheaper as one brute-force pass than a tree walk.
+    search = index if k * 2 < index.size else BruteForceIndex(index.colors)
+    chunk = max(1, _BRUTE_BLOCK_ELEMENTS // k)
+    parts = [search.query(points[start : start + chunk], k)[1] for start in range(0, len(points), chunk)]
+    return np.concatenate(parts) if parts else np.zeros((0, k), dtype=np.int64)
+
+
+def _assign_block(index: NeighborIndex, cells: np.ndarray, remaining: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Every tile prefers lower cell indices, so deferred acceptance (cells propose
+    # nearest-first, tiles keep their lowest-index proposers up to capacity and
+    # bump the rest) yields exactly the sequential greedy assignment, while all
+    # conflicts of a round are settled with array operations.
+    count = len(cells)
+    k = min(_INITIAL_K, index.size)
+    ranked = _query_wide(index, cells, k)
+    nearest = ranked[:, 0].copy()
+
+    # Ragged candidate lists: flat[start[c] : start[c] + available[c]] holds cell c's
+    # unexplored tiles that still had capacity, nearest first.
+    flat = np.zeros(0, dtype=np.int64)
+    start = np.zeros(count, dtype=np.int64)
+    available = np.zeros(count, dtype=np.int64)
+    queried = np.zeros(count, dtype=np.int64)
+    pointer = np.zeros(count, dtype=np.int64)
+    held = np.full(count, -1, dtype=np.int64)
+    relaxed = np.zeros(count, dtype=bool)
+
+    def refill(which: np.ndarray, ranks: np.ndarray) -> None:
+        nonlocal flat
+        fresh = (np.arange(ranks.shape[1]) >= queried[which][:, None]) & (remaining[ranks] > 0)
+        counts = fresh.sum(axis=1)
+        start[which] = len(flat) + np.concatenate([[0], np.cumsum(counts)[:-1]])
+        available[which] = counts
+        pointer[which] = 0
+        queried[which] = ranks.shape[1]
+        flat = np.concatenate([flat, ranks[fresh]])
+
+    refill(np.arange(count), ranked)
+    pending = np.arange(count)
+    while pending.size:
+        exhausted = pending[pointer[pending] >= available[pending]]
+        if exhausted.size:
+            # Cells that saw the whole library keep their nearest tile (limits relaxed).
+            widen = exhausted[queried[exhausted] < index.size]
+            if widen.size and remaining.any():
+                refill(widen, _query_wide(index, cells[widen], int(queried[widen].max()) * _K_GROWTH))
+            else:
+                widen = widen[:0]
+            done = np.setdiff1d(exhausted, widen)
+            held[done] = nearest[done]
+            relaxed[done] = True
+            pending = np.setdiff1d(pending, done)
+            if widen.size:
+                continue
+        if not pending.size:
+            break
+
+        proposals = flat[start[pending] + pointer[pending]]
+        holders = np.flatnonzero(np.isin(held, proposals) & ~relaxed)
+        contenders = np.concatenate([holders, pending])
+        tiles = np.concatenate([held[holders], proposals])
+        order = np.lexsort((contenders, tiles))
+        contenders, tiles = contenders[order], tiles[order]
+        first = np.searchsorted(tiles, tiles, side="left")
+        accepted = (np.arange(len(tiles)) - first) < remaining[tiles]
+
+        held[contenders[accepted]] = tiles[accepted]
+        rejected = contenders[~accepted]
+        held[rejected] = -1
+        pointer[rejected] += 1
+        pending = rejected
+
+    return held, relaxed
+
+
+def _assign_capacity(
+    index: NeighborIndex,
+    tile_colors: np.ndarray,
+    cells: np.ndarray,
+    remaining: np.ndarray,
+    cancel: threading.Event | None,
+) -> np.ndarray:
+    # Places ``cells`` on tiles with ``remaining`` room (updated in place); cells left
+    # without room take their nearest tile. Blocks are settled in cell order, so
+    # earlier blocks keep their priority.
+    assignments = np.empty(len(cells), dtype=np.int64)
+    live = np.arange(len(tile_colors))
+    search = index
+    for block_start in range(0, len(cells), _ASSIGN_BLOCK):
+        _stop(None, cancel)
+        block_cells = cells[block_start : block_start + _ASSIGN_BLOCK]
+        if live.size and not remaining[live].any():
+            block, relaxed = np.zeros(len(block_cells), dtype=np.int64), np.ones(len(block_cells), dtype=bool)
+        else:
+            if np.count_nonzero(remaining[live]) * 2 <= live.size:
+                # Once most tiles are used up, search only the ones left so cells do
+                # not widen through long runs of exhausted neighbours. The subset keeps
+                # index order, so ties still break towards the lower tile index.
+                live = live[remaining[live] > 0]
+                search = build_neighbor_index(tile_colors[live], _neighbor_kind(index))
+            block, relaxed = _assign_block(search, block_cells, remaining[live])
+            block = live[block]
+        if relaxed.any():
+            block[relaxed] = _query_wide(index, block_cells[relaxed], 1)[:, 0]
+        assignments[block_start : block_start + len(block)] = block
+        np.subtract.at(remaining, block, 1)
+        np.maximum(remaining, 0, out=remaining)
+    return assignments
 
 
 def greedy_assign(
     source_cell_rgbs: np.ndarray,
-    tiles: list[TileDescriptor],
+    tiles: TileLibrary,
     ctx: SelectionContext,
+    neighbors: NeighborIndex | None = None,
+    cancel: threading.Event | None = None,
 ) -> list[int]:
     if not tiles:
         raise ValueError("No tile images found")
 
-    tile_colors = np.array([t.avg_rgb for t in tiles], dtype=np.float32)
-    assignments: list[int] = []
-    usage = defaultdict(int)
+    tile_colors = tile_color_matrix(tiles)
+    index = neighbors or build_neighbor_index(tile_colors)
     usage_limit = build_usage_limit(ctx)
+    cells = np.asarray(source_cell_rgbs, dtype=np.float32).reshape(len(source_cell_rgbs), -1)
+    if usage_limit is None:
+        return _query_wide(index, cells, 1)[:, 0].tolist()
+
+    remaining = np.full(len(tile_colors), usage_limit, dtype=np.int64)
+    return _assign_capacity(index, tile_colors, cells, remaining, cancel).tolist()
+    return assignments.tolist()
+
+
+def _segments(start: np.ndarray, length: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Flat positions covering each ragged segment, and where each segment begins in them.
+    offsets = np.cumsum(length) - length
+    return np.repeat(start - offsets, length) + np.arange(int(length.sum())), offsets
+
+
+def _group_ranks(groups: np.ndarray) -> np.ndarray:
+    # Position of every element within its run of equal (sorted) group ids.
+    return np.arange(len(groups)) - np.searchsorted(groups, groups, side="left")
+
+
+class _TransportAuction:
+    # Forward auction for cells over tiles with ``capacity`` slots each. A full tile
+    # is priced at the lowest bid it holds; cells bid for the tile with the lowest
+    # distance + price, offering its price plus their margin over the runner-up.
+    # Cells see their k nearest tiles, and the k-th distance bounds every tile
+    # outside the list, so a cell whose in-list options cost more than that bound
+    # gets a wider list and the optimality argument covers the whole library.
+    def __init__(
+        self,
+        index: NeighborIndex,
+        cells: np.ndarray,
+        tile_colors: np.ndarray,
+        capacity: int,
+        cancel: threading.Event | None = None,
+    ) -> None:
+        self.index = index
+        self.cancel = cancel
+        self.cells32 = cells
+        self.cells = cells.astype(np.float64)
+        self.tile_colors = tile_colors.astype(np.float64)
+        self.capacity = capacity
+        count, tile_count = len(cells), len(tile_colors)
+        # Ragged nearest-first candidate lists in a growable buffer; ``filled`` entries are
+        # in use, of which only the segments in start/length are current.
+        self.flat_tile = np.zeros(0, dtype=np.int64)
+        self.flat_dist = np.zeros(0, dtype=np.float64)
+        self.filled = 0
+        self.start = np.zeros(count, dtype=np.int64)
+        self.length = np.zeros(count, dtype=np.int64)
+        self.bound = np.zeros(count, dtype=np.float64)
+        self.price = np.zeros(tile_count, dtype=np.float64)
+        self.used = np.zeros(tile_count, dtype=np.int64)
+        self.held = np.full(count, -1, dtype=np.int64)
+        self.offer = np.zeros(count, dtype=np.float64)
+        self.load(np.arange(count), _INITIAL_K)
+
+    def load(self, which: np.ndarray, k: int) -> None:
+        k = min(k, len(self.tile_colors))
+        ranked = _query_wide(self.index, self.cells32[which], k)
+        dists = np.sum((self.tile_colors[ranked] - self.cells[which, None, :]) ** 2, axis=-1)
+        self.length[which] = 0
+        self.reserve(ranked.size)
+        self.start[which] = self.filled + np.arange(len(which)) * k
+        self.length[which] = k
+        self.bound[which] = dists[:, -1] if k < len(self.tile_colors) else np.inf
+        self.flat_tile[self.filled : self.filled + ranked.size] = ranked.ravel()
+        self.flat_dist[self.filled : self.filled + ranked.size] = dists.ravel()
+        self.filled += ranked.size
+
+    def reserve(self, size: int) -> None:
+        if self.filled + size <= len(self.flat_tile):
+            return
+        # Keep only current lists, then grow geometrically so widening stays amortised.
+        keep, offsets = _segments(self.start, self.length)
+        capacity = 2 * (len(keep) + size)
+        flat_tile, flat_dist = np.empty(capacity, dtype=np.int64), np.empty(capacity, dtype=np.float64)
+        flat_tile[: len(keep)], flat_dist[: len(keep)] = self.flat_tile[keep], self.flat_dist[keep]
+        self.flat_tile, self.flat_dist, self.start, self.filled = flat_tile, flat_dist, offsets, len(keep)
+
+    def restart(self) -> None:
+        # A new scaling phase keeps the prices and drops every assignment.
+        self.used[:] = 0
+        self.held[:] = -1
+
+    def run(self, eps: float, deadline: float) -> bool:
+        pending = np.flatnonzero(self.held < 0)
+        while pending.size > _SERIAL_BIDDERS:
+            if _stop(deadline, self.cancel):
+                return False
+            count_metric("auction.rounds")
+            count_metric("auction.bids", pending.size)
+            pending = self.bid(pending, eps)
+        return self.bid_serially(pending.tolist(), eps, deadline)
+
+    def bid_serially(self, queue: list[int], eps: float, deadline: float) -> bool:
+        # The last few bidders usually bump each other along long chains; one bid at a
+        # time is far cheaper there than a vectorized round per link.
+        order = np.argsort(self.held, kind="stable")
+        bounds = np.searchsorted(self.held[order], np.arange(len(self.used) + 1))
+        members: dict[int, list[list]] = {}
+        capacity, price, used = self.capacity, self.price, self.used
+        bids = 0
+        while queue:
+            bids += 1
+            if bids % 256 == 0 and _stop(deadline, self.cancel):
+                count_metric("auction.bids", bids)
+                return False
+            cell = queue.pop()
+            first, count = int(self.start[cell]), int(self.length[cell])
+            tiles = self.flat_tile[first : first + count]
+            costs = self.flat_dist[first : first + count] + price[tiles]
+            choice = int(np.argmin(costs))
+            best = float(costs[choice])
+            bound = float(self.bound[cell])
+            if best > bound:
+                self.load(np.array([cell]), count * _K_GROWTH)
+                queue.append(cell)
+                continue
+            costs[choice] = np.inf
+            runner_up = min(float(costs.min()) if count > 1 else np.inf, bound)
+            tile = int(tiles[choice])
+            offer = float(price[tile]) + runner_up - best + eps
+
+            holders = members.get(tile)
+            if holders is None:
+                cells = order[bounds[tile] : bounds[tile + 1]]
+                holders = members[tile] = [[float(self.offer[i]), int(i)] for i in cells]
+            if used[tile] < capacity:
+                holders.append([offer, cell])
+                used[tile] += 1
+            else:
+                lowest = min(range(len(holders)), key=lambda i: (holders[i][0], -holders[i][1]))
+                bumped = holders[lowest][1]
+                holders[lowest] = [offer, cell]
+                self.held[bumped] = -1
+                queue.append(bumped)
+            self.held[cell], self.offer[cell] = tile, offer
+            if used[tile] == capacity:
+                price[tile] = min(holder[0] for holder in holders)
+        count_metric("auction.bids", bids)
+        return True
+
+    def bid(self, pending: np.ndarray, eps: float) -> np.ndarray:
+        positions, offsets = _segments(self.start[pending], self.length[pending])
+        tiles = self.flat_tile[positions]
+        costs = self.flat_dist[positions] + self.price[tiles]
+        best = np.minimum.reduceat(costs, offsets)
+        segment = np.repeat(np.arange(len(pending)), self.length[pending])
+        hits = np.flatnonzero(costs == best[segment])
+        choice = hits[np.unique(segment[hits], return_index=True)[1]]
+        targets = tiles[choice]
+        costs[choice] = np.inf
+        runner_up = np.minimum(np.minimum.reduceat(costs, offsets), self.bound[pending])
+
+        widen = best > self.bound[pending]
+        if widen.any():
+            self.load(pending[widen], int(self.length[pending[widen]].max()) * _K_GROWTH)
+        keep = ~widen
+        offers = self.price[targets] + runner_up - best + eps
+        bumped = self.settle(pending[keep], targets[keep], offers[keep])
+        return np.concatenate([bumped, pending[widen]])
+
+    def settle(self, bidders: np.ndarray, targets: np.ndarray, offers: np.ndarray) -> np.ndarray:
+        capacity = self.capacity
+        bid_tiles, bid_counts = np.unique(targets, return_counts=True)
+        filling = np.zeros(len(self.used), dtype=bool)
+        filling[bid_tiles[self.used[bid_tiles] + bid_counts >= capacity]] = True
+
+        # Tiles that keep free slots take every bidder at their current price.
+        fits = ~filling[targets]
+        self.held[bidders[fits]], self.offer[bidders[fits]] = targets[fits], offers[fits]
+        np.add.at(self.used, targets[fits], 1)
+
+        # Tiles that fill up keep their highest offers and are priced at the lowest kept one.
+        holders = np.flatnonzero((self.held >= 0) & filling[self.held])
+        cells = np.concatenate([holders, bidders[~fits]])
+        tiles = np.concatenate([self.held[holders], targets[~fits]])
+        bids = np.concatenate([self.offer[holders], offers[~fits]])
+        order = np.lexsort((cells, -bids, tiles))
+        cells, tiles, bids = cells[order], tiles[order], bids[order]
+        rank = _group_ranks(tiles)
+        won = rank < capacity
+        self.held[cells[won]], self.offer[cells[won]] = tiles[won], bids[won]
+        self.held[cells[~won]] = -1
+        self.used[filling] = capacity
+        last = rank == capacity - 1
+        self.price[tiles[last]] = bids[last]
+        return cells[~won]
+
+    def rebalance(self, eps: float, deadline: float) -> bool:
+        # Reverse auction: a tile with free slots priced above the cheapest occupied
+        # tile pulls in the cells that would gain most from it, or lowers its price to
+        # that floor, so the optimality bound also holds for the slots left empty.
+        # Cells outside a tile's reverse list value it at most ``eps`` by the bound.
+        positions, _ = _segments(self.start, self.length)
+        owners = np.repeat(np.arange(len(self.held)), self.length)
+        order = np.argsort(self.flat_tile[positions], kind="stable")
+        rev_cells, rev_dist = owners[order], self.flat_dist[positions][order]
+        rev_start = np.searchsorted(self.flat_tile[positions][order], np.arange(len(self.used)))
+        rev_length = np.diff(np.append(rev_start, len(rev_cells)))
+
+        floor = float(self.price[self.used > 0].min())
+        cost = np.sum((self.tile_colors[self.held] - self.cells) ** 2, axis=-1) + self.price[self.held]
+        while True:
+            free = self.capacity - self.used
+            tiles = np.flatnonzero((free > 0) & (self.price > floor))
+            if not tiles.size:
+                return True
+            if _stop(deadline, self.cancel):
+                return False
+
+            positions, _ = _segments(rev_start[tiles], rev_length[tiles])
+            group = np.repeat(np.arange(len(tiles)), rev_length[tiles])
+            cells, dists = rev_cells[positions], rev_dist[positions]
+            outside = self.held[cells] != tiles[group]
+            group, cells, dists = group[outside], cells[outside], dists[outside]
+            values = cost[cells] - dists
+            order = np.lexsort((cells, -values, group))
+            group, cells, dists, values = group[order], cells[order], dists[order], values[order]
+            rank = _group_ranks(group)
+            slots = free[tiles][group]
+            runner_up = np.full(len(tiles), eps)
+            beyond = rank == slots
+            runner_up[group[beyond]] = np.maximum(values[beyond], eps)
+            price = np.maximum(floor, runner_up - eps)
+
+            pulled = (rank < slots) & (values - eps > floor)
+            group, cells = group[pulled], cells[pulled]
+            new_cost = dists[pulled] + price[group]
+            # A cell pulled by several tiles goes where it ends up cheapest.
+            order = np.lexsort((group, new_cost, cells))
+            first = order[_group_ranks(cells[order]) == 0]
+            group, cells, new_cost = group[first], cells[first], new_cost[first]
+
+            np.subtract.at(self.used, self.held[cells], 1)
+            np.add.at(self.used, tiles[group], 1)
+            self.price[tiles] = price
+            self.held[cells], self.offer[cells], cost[cells] = tiles[group], price[group], new_cost
+            holders = np.isin(self.held, tiles)
+            cost[holders] = np.sum((self.tile_colors[self.held[holders]] - self.cells[holders]) ** 2, axis=-1) + self.price[self.held[holders]]
+
+
+def optimal_assign(
+    source_cell_rgbs: np.ndarray,
+    tiles: TileLibrary,
+    ctx: SelectionContext,
+    gap: float = 1.0,
+    time_limit: float = 60.0,
+    neighbors: NeighborIndex | None = None,
+    deadline: float | None = None,
+    cancel: threading.Event | None = None,
+) -> list[int]:
+    # Capacity-constrained assignment by an epsilon-scaling auction; the mean squared
+    # RGB error ends within ``gap`` of the optimum unless ``time_limit`` (or the earlier
+    # ``deadline``) runs out, in which case cells still bidding take the nearest tiles
+    # with room left.
+    if not tiles:
+        raise ValueError("No tile images found")
 
-    for source_rgb in source_cell_rgbs:
-        dists = np.sum((tile_colors - source_rgb) ** 2, axis=1)
-        for idx in np.argsort(dists):
-            if usage_limit is None or usage[idx] < usage_limit:
-                usage[idx] += 1
-                assignments.append(int(idx))
-                break
-        else:
-            # If all limits are exhausted, relax constraints for completion.
-            idx = int(np.argmin(dists))
-            usage[idx] += 1
-            assignments.append(idx)
-    return assignments
+    tile_colors = tile_color_matrix(tiles)
+    index = neighbors or build_neighbor_index(tile_colors)
+    cells = np.asarray(source_cell_rgbs, dtype=np.float32).reshape(len(source_cell_rgbs), -1)
+    usage_limit = build_usage_limit(ctx)
+    # Limits that cannot cover every cell are raised evenly until they can.
+    capacity = max(usage_limit or len(cells), -(-len(cells) // len(tile_colors)))
+    if capacity >= len(cells):
+        return _query_wide(index, cells, 1)[:, 0].tolist()
+
+    deadline = min(time.perf_counter() + time_limit, deadline if deadline is not None else math.inf)
+    auction = _TransportAuction(index, cells, tile_colors, capacity, cancel)
+    eps = max(gap, float(np.mean(auction.flat_dist[: auction.filled])) / _EPS_SCALING)
+    while True:
+        count_metric("auction.phases")
+        finished = auction.run(eps, deadline) and auction.rebalance(eps, deadline)
+        if not finished or eps <= gap:
+            break
+        eps = max(gap, eps / _EPS_SCALING)
+        auction.restart()
+
+    held = auction.held
+    pending = np.flatnonzero(held < 0)
+    count_metric("auction.unfinished", int(pending.size))
+    if pending.size:
+        # Only the tiles with room left are searched, as in greedy, so the fallback
+        # does not widen through the whole library after the deadline.
+        remaining = np.maximum(capacity - auction.used, 0)
+        held[pending] = _assign_capacity(index, tile_colors, cells[pending], remaining, cancel)
+    return held.tolist()
 
 
 def lazy_assign(
     source_cell_rgbs: np.ndarray,
-    tiles: list[TileDescriptor],
+    tiles: TileLibrary,
     ctx: SelectionContext,
     top_k: int,
     randomness: float,
     seed: int = 7,
+    neighbors: NeighborIndex | None = None,
+    cancel: threading.Event | None = None,
 ) -> list[int]:
     if not tiles:
         raise ValueError("No tile images found")
 
     rng = random.Random(seed)
-    tile_colors = np.array([t.avg_rgb for t in tiles], dtype=np.float32)
+    tile_colors = tile_color_matrix(tiles)
+    index = neighbors or build_neighbor_index(tile_colors)
     assignments: list[int] = []
-    usage = defaultdict(int)
+    usage = np.zeros(len(tile_colors), dtype=np.int64)
     usage_limit = build_usage_limit(ctx)
+    top_k = max(1, min(top_k, len(tile_colors)))
+
+    for start in range(0, len(source_cell_rgbs), _QUERY_BATCH):
+        _stop(None, cancel)
+        block = source_cell_rgbs[start : start + _QUERY_BATCH]
+        _, candidates = index.query(block, max(top_k, _INITIAL_K))
+        for source_rgb, cell_candidates in zip(block, candidates):
+            candidate_indices = cell_candidates[:top_k].tolist()
+            if rng.random() < randomness:
+                rng.shuffle(candidate_indices)
+
+            selected_idx: int | None = None
+            for idx in candidate_indices:
+                if usage_limit is None or usage[idx] < usage_limit:
+                    selected_idx = int(idx)
+                    break
 
-    for source_rgb in source_cell_rgbs:
-        dists = np.sum((tile_colors - source_rgb) ** 2, axis=1)
-        candidate_indices = np.argsort(dists)[: max(1, min(top_k, len(tiles)))].tolist()
+            if selected_idx is None:
+                selected_idx = _first_available(index, source_rgb, cell_candidates, usage, usage_limit)
 
-        if rng.random() < randomness:
-            rng.shuffle(candidate_indices)
+            if selected_idx is None:
+                selected_idx = int(cell_candidates[0])
 
-        selected_idx: int | None = None
-        for idx in candidate_indices:
-            idx_int = int(idx)
-            if usage_limit is None or usage[idx_int] < usage_limit:
-                selected_idx = idx_int
-                break
+            usage[selected_idx] += 1
+            assignments.append(selected_idx)
 
-        if selected_idx is None:
-            for idx in np.argsort(dists):
-                idx_int = int(idx)
-                if usage_limit is None or usage[idx_int] < usage_limit:
-                    selected_idx = idx_int
-                    break
+    return assignments
 
-        if selected_idx is None:
-            selected_idx = int(np.argmin(dists))
 
-        usage[selected_idx] += 1
-        assignments.append(selected_idx)
+def _move_batch(cells: int) -> int:
+    # Moves drawn per vectorized round; small grids get small rounds so few collide.
+    return max(1, min(_MOVE_BATCH, cells // 8))
 
-    return assignments
+
+def _rounds(steps: int, batch: int, deadline: float | None, cancel: threading.Event | None) -> Iterator[int]:
+    # Proposals per local-search round: ``steps`` in all, or with a deadline as many
+    # full rounds as start before it.
+    done = 0
+    while (deadline is not None or done < steps) and not _stop(deadline, cancel):
+        size = batch if deadline is not None else min(batch, steps - done)
+        yield size
+        done += size
+
+
+def _first_occurrences(values: np.ndarray) -> np.ndarray:
+    first = np.zeros(len(values), dtype=bool)
+    first[np.unique(values, return_index=True)[1]] = True
+    return first
+
+
+def _cell_costs(cells: np.ndarray, tile_colors: np.ndarray, positions: np.ndarray, tile_ids: np.ndarray) -> np.ndarray:
+    return np.sum((tile_colors[tile_ids] - cells[positions]) ** 2, axis=-1)
 
 
 def random_improve_assign(
     source_cell_rgbs: np.ndarray,
-    tiles: list[TileDescriptor],
+    tiles: TileLibrary,
     initial_assignments: list[int],
     steps: int,
     seed: int = 7,
+    deadline: float | None = None,
+    cancel: threading.Event | None = None,
 ) -> list[int]:
-    if steps <= 0:
+    # With a ``deadline`` the search ignores ``steps`` and keeps improving until then
+    # (or until it stalls), returning the best assignment found.
+    if steps <= 0 and deadline is None:
         return initial_assignments
 
-    rng = random.Random(seed)
-    tile_colors = np.array([t.avg_rgb for t in tiles], dtype=np.float32)
-    assignments = initial_assignments[:]
-
-    best = assignments[:]
-    best_score = _score(best, source_cell_rgbs, tile_colors)
-
-    for _ in range(steps):
-        i = rng.randrange(len(assignments))
-        j = rng.randrange(len(assignments))
-        if i == j:
-            continue
-        candidate = assignments[:]
-        candidate[i], candidate[j] = candidate[j], candidate[i]
-        cand_score = _score(candidate, source_cell_rgbs, tile_colors)
-        if cand_score < best_score:
-            best_score = cand_score
-            best = candidate
-            assignments = candidate
-    return best
+    rng = np.random.default_rng(seed)
+    tile_colors = tile_color_matrix(tiles).astype(np.float64)
+    cells = np.asarray(source_cell_rgbs, dtype=np.float64).reshape(len(source_cell_rgbs), -1)
+    assignments = np.array(initial_assignments, dtype=np.int64)
+    count = len(assignments)
+    batch = _move_batch(count)
+
+    # Each round proposes a batch of swaps over disjoint cell pairs, so every swap's
+    # cost delta only involves its own two cells and all of them can be applied at once.
+    idle = proposed = accepted = 0
+    for size in _rounds(steps, batch, deadline, cancel):
+        proposed += size
+        pairs = rng.integers(0, count, size=(size, 2))
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        disjoint = _first_occurrences(pairs.ravel()).reshape(-1, 2).all(axis=1)
+        i, j = pairs[disjoint, 0], pairs[disjoint, 1]
+        a_i, a_j = assignments[i], assignments[j]
+        delta = (
+            _cell_costs(cells, tile_colors, i, a_j)
+            + _cell_costs(cells, tile_colors, j, a_i)
+            - _cell_costs(cells, tile_colors, i, a_i)
+            - _cell_costs(cells, tile_colors, j, a_j)
+        )
+        better = delta < 0
+        assignments[i[better]] = a_j[better]
+        assignments[j[better]] = a_i[better]
+        accepted += int(np.count_nonzero(better))
+        idle = 0 if better.any() else idle + size
+        if deadline is not None and idle >= _STALL_DRAWS * count:
+            break
+    count_metric("search.proposals", proposed)
+    count_metric("search.accepted", accepted)
+    return assignments.tolist()
 
 
 def full_optimize_assign(
     source_cell_rgbs: np.ndarray,
-    tiles: list[TileDescriptor],
+    tiles: TileLibrary,
     initial_assignments: list[int],
     ctx: SelectionContext,
     steps: int,
     seed: int = 7,
+    neighbors: NeighborIndex | None = None,
+    deadline: float | None = None,
+    cancel: threading.Event | None = None,
 ) -> list[int]:
-    if steps <= 0:
+    # ``deadline`` replaces ``steps`` as in random_improve_assign.
+    if steps <= 0 and deadline is None:
         return initial_assignments
 
-    rng = random.Random(seed)
-    tile_colors = np.array([t.avg_rgb for t in tiles], dtype=np.float32)
-    assignments = initial_assignments[:]
+    rng = np.random.default_rng(seed)
+    tile_colors32 = tile_color_matrix(tiles)
+    tile_colors = tile_colors32.astype(np.float64)
+    cells = np.asarray(source_cell_rgbs, dtype=np.float64).reshape(len(source_cell_rgbs), -1)
+    assignments = np.array(initial_assignments, dtype=np.int64)
+    count = len(assignments)
+    batch = _move_batch(count)
     usage_limit = build_usage_limit(ctx)
-    usage = defaultdict(int)
-    for idx in assignments:
-        usage[idx] += 1
-
-    current_score = _score(assignments, source_cell_rgbs, tile_colors)
-    best = assignments[:]
-    best_score = current_score
-
-    for _ in range(steps):
-        pos = rng.randrange(len(assignments))
-        old_idx = assignments[pos]
-
-        local_dists = np.sum((tile_colors - source_cell_rgbs[pos]) ** 2, axis=1)
-        shortlist = np.argsort(local_dists)[: min(20, len(tiles))]
-        cand_idx = int(rng.choice(shortlist.tolist()))
-        if cand_idx == old_idx:
-            continue
-
-        if usage_limit is not None and usage[cand_idx] >= usage_limit:
-            continue
-
-        candidate = assignments[:]
-        candidate[pos] = cand_idx
-        cand_score = _score(candidate, source_cell_rgbs, tile_colors)
-
-        if cand_score <= current_score:
-            assignments = candidate
-            current_score = cand_score
-            usage[old_idx] -= 1
-            usage[cand_idx] += 1
-            if cand_score < best_score:
-                best_score = cand_score
-                best = candidate
-
-    return best
+    usage = np.bincount(assignments, minlength=len(tile_colors))
+
+    # Each cell's shortlist of nearest tiles is looked up once, the first time it is drawn.
+    index = neighbors or build_neighbor_index(tile_colors32)
+    shortlist_size = min(_SHORTLIST, len(tile_colors))
+    shortlists = np.zeros((count, shortlist_size), dtype=np.int64)
+    listed = np.zeros(count, dtype=bool)
+
+    idle = proposed = accepted = 0
+    for size in _rounds(steps, batch, deadline, cancel):
+        proposed += size
+        positions = rng.integers(0, count, size=size)
+        picks = rng.integers(0, shortlist_size, size=size)
+        keep = _first_occurrences(positions)
+        positions, picks = positions[keep], picks[keep]
+
+        fresh = positions[~listed[positions]]
+        if fresh.size:
+            shortlists[fresh] = index.query(cells[fresh].astype(np.float32), shortlist_size)[1]
+            listed[fresh] = True
+
+        old = assignments[positions]
+        new = shortlists[positions, picks]
+        delta = _cell_costs(cells, tile_colors, positions, new) - _cell_costs(cells, tile_colors, positions, old)
+        accept = (new != old) & (delta <= 0)
+        if usage_limit is not None:
+            # Moves into the same tile are admitted in draw order up to its spare
+            # capacity; capacity freed within the round is only seen next round.
+            moves = np.flatnonzero(accept)
+            order = moves[np.argsort(new[moves], kind="stable")]
+            targets = new[order]
+            rank = np.arange(len(order)) - np.searchsorted(targets, targets, side="left")
+            accept[order] = rank < usage_limit - usage[targets]
+
+        positions, old, new = positions[accept], old[accept], new[accept]
+        assignments[positions] = new
+        np.subtract.at(usage, old, 1)
+        np.add.at(usage, new, 1)
+        accepted += positions.size
+        idle = 0 if positions.size else idle + size
+        if deadline is not None and idle >= _STALL_DRAWS * count:
+            break
+
+    count_metric("search.proposals", proposed)
+    count_metric("search.accepted", accepted)
+    return assignments.tolist()
@@ -1,15 +1,124 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import dataclasses
+import hashlib
+import io
+import os
+import tempfile
+import time
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import BinaryIO, overload
 
+import numpy as np
 from PIL import Image
 
-from photo_mosaic.cache import load_json, write_json
-from photo_mosaic.config import FitMode, TileShape
-from photo_mosaic.core.image_utils import average_rgb, average_rgb_masked, fit_image, hex_mask
+from photo_mosaic.cache import (
+    StringTable,
+    create_array,
+    load_array,
+    load_json,
+    load_string_table,
+    sidecar_path,
+    write_array,
+    write_json,
+    write_string_table,
+)
+from photo_mosaic.config import ColorSpace, FitMode, TileShape
+from photo_mosaic.core.features import cell_features, convert_features, feature_rgb
+from photo_mosaic.core.image_utils import average_rgb, average_rgb_masked, fit_image, hex_mask, load_reduced
+from photo_mosaic.core.metrics import count, timer
+from photo_mosaic.core.scanner import SCAN_WORKERS, scan_image_files
 
-IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+_MAX_INDEX_CHUNK = 256
+# Bounds between the pipeline stages: file contents read ahead per decoder, batches
+# queued per pool worker and bytes per batch, so the data in flight stays bounded on
+# huge libraries. Finished tiles keep their features in memory until the store is
+# assembled; their fitted pixels are spooled to disk when there is a cache.
+_READ_AHEAD = 32
+_BATCHES_PER_WORKER = 2
+_MAX_BATCH_BYTES = 16 << 20
+# Seconds between checkpoints of newly indexed tiles, so an interrupted index resumes.
+CHECKPOINT_SECONDS = 30.0
+# Stored variants and atlases no index has asked for in this long are dropped, so a
+# one-off tile size stops costing indexing time and cache space.
+MAX_UNUSED_SECONDS = 7 * 86400.0
+# Last-use times are rewritten at most this often, so warm loads rarely write.
+_USE_RESOLUTION = 86400.0
+CACHE_VERSION = 4
+
+
+@dataclass(frozen=True, slots=True)
+class TileVariant:
+    # One feature configuration of a tile library; softness only matters for hex.
+    tile_size: tuple[int, int]
+    fit_mode: FitMode
+    tile_shape: TileShape = TileShape.RECT
+    hex_edge_softness: float = 0.0
+    # Side of the sub-cell colour grid each tile is described by, and the colour space.
+    grid: int = 1
+    color_space: ColorSpace = ColorSpace.RGB
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "tile_size", (int(self.tile_size[0]), int(self.tile_size[1])))
+        object.__setattr__(self, "fit_mode", FitMode(self.fit_mode))
+        object.__setattr__(self, "tile_shape", TileShape(self.tile_shape))
+        softness = round(float(self.hex_edge_softness), 3) if self.tile_shape == TileShape.HEX else 0.0
+        object.__setattr__(self, "hex_edge_softness", softness)
+        object.__setattr__(self, "grid", int(self.grid))
+        object.__setattr__(self, "color_space", ColorSpace(self.color_space))
+
+    @property
+    def key(self) -> str:
+        width, height = self.tile_size
+        key = f"{width}x{height}-{self.fit_mode.value}-{self.tile_shape.value}"
+        if self.tile_shape == TileShape.HEX:
+            key += f"-s{self.hex_edge_softness:.3f}"
+        if self.grid > 1:
+            key += f"-g{self.grid}"
+        if self.color_space != ColorSpace.RGB:
+            key += f"-{self.color_space.value}"
+        return key
+
+    @property
+    def rgb(self) -> TileVariant:
+        # The RGB variant this one's features are converted from.
+        return dataclasses.replace(self, color_space=ColorSpace.RGB)
+
+    @property
+    def dims(self) -> int:
+        return 3 * self.grid * self.grid
+
+    @property
+    def atlas_key(self) -> str:
+        # Fitted pixels depend on size and fit only; hex masks are applied when pasting.
+        width, height = self.tile_size
+        return f"{width}x{height}-{self.fit_mode.value}"
+
+    def settings(self) -> dict:
+        return {
+            "fit_mode": self.fit_mode.value,
+            "tile_size": list(self.tile_size),
+            "tile_shape": self.tile_shape.value,
+            "hex_edge_softness": self.hex_edge_softness,
+            "grid": self.grid,
+            "color_space": self.color_space.value,
+        }
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> TileVariant:
+        return cls(
+            tile_size=tuple(settings["tile_size"]),
+            fit_mode=settings["fit_mode"],
+            tile_shape=settings.get("tile_shape", TileShape.RECT.value),
+            hex_edge_softness=settings.get("hex_edge_softness", 0.0),
+            grid=settings.get("grid", 1),
+            color_space=settings.get("color_space", ColorSpace.RGB.value),
+        )
 
 
 @dataclass(slots=True)
@@ -18,49 +127,724 @@ class TileDescriptor:
     avg_rgb: tuple[float, float, float]
 
 
-def _iter_image_paths(tile_dirs: list[Path]) -> list[Path]:
-    results: list[Path] = []
-    for tile_dir in tile_dirs:
-        if not tile_dir.exists():
-            continue
-        for path in tile_dir.rglob("*"):
-            if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file():
-                results.append(path)
-    return sorted(set(results))
+class TileLibrary(Sequence[TileDescriptor]):
+    # A tile library as columns: ``colors`` is the (tiles, 3) float32 feature matrix
+    # (or (tiles, 3 * grid * grid) sub-cell descriptors, see cell_features) in
+    # ``color_space``, possibly a read-only memmap of the cache file, ``paths`` a string
+    # table and ``pixels`` the optional (tiles, height, width, 3) uint8 atlas of fitted tiles.
+    # An int index yields a TileDescriptor; slices, index arrays and masks yield a
+    # TileLibrary (views for contiguous slices, copies otherwise).
+    __slots__ = ("paths", "colors", "pixels", "color_space")
+
+    def __init__(
+        self,
+        paths: StringTable,
+        colors: np.ndarray,
+        pixels: np.ndarray | None = None,
+        color_space: ColorSpace = ColorSpace.RGB,
+    ) -> None:
+        self.paths = paths
+        self.colors = colors
+        self.pixels = pixels
+        self.color_space = color_space
+
+    @classmethod
+    def from_descriptors(cls, tiles: Sequence[TileDescriptor]) -> TileLibrary:
+        colors = np.array([tile.avg_rgb for tile in tiles], dtype=np.float32).reshape(-1, 3)
+        return cls(StringTable.from_strings([str(tile.path) for tile in tiles]), colors)
+
+    def __len__(self) -> int:
+        return len(self.colors)
+
+    @overload
+    def __getitem__(self, index: int) -> TileDescriptor: ...
+
+    @overload
+    def __getitem__(self, index: slice | np.ndarray) -> TileLibrary: ...
+
+    def __getitem__(self, index: int | slice | np.ndarray) -> TileDescriptor | TileLibrary:
+        if not isinstance(index, (int, np.integer)):
+            return self.take(index)
+        if not -len(self) <= index < len(self):
+            raise IndexError("tile index out of range")
+        index %= len(self)
+        r, g, b = (float(v) for v in feature_rgb(np.asarray(self.colors[index]), self.color_space))
+        return TileDescriptor(path=self.path(index), avg_rgb=(r, g, b))
+
+    def take(self, rows: slice | np.ndarray) -> TileLibrary:
+        if not isinstance(rows, slice):
+            rows = np.arange(len(self))[rows]
+        pixels = self.pixels[rows] if self.pixels is not None else None
+        # The path table may list undecodable files after the tiles; keep it aligned.
+        paths = self.paths.take(rows) if isinstance(rows, np.ndarray) else self.paths.take(slice(*rows.indices(len(self))))
+        return TileLibrary(paths, self.colors[rows], pixels, self.color_space)
+
+    def where(self, mask: np.ndarray) -> TileLibrary:
+        # Tiles whose entry in the boolean ``mask`` is set, e.g. library.where(library.colors[:, 0] > 128).
+        return self.take(np.flatnonzero(mask))
+
+    def path(self, index: int) -> Path:
+        return Path(self.paths[index])
+
+
+# Earlier name of TileLibrary.
+TileIndex = TileLibrary
+
+
+# Per-variant features (mean colours or sub-cell descriptors) and per-atlas fitted pixels of one tile.
+_TileResult = tuple[list[tuple[float, float, float] | np.ndarray], list[np.ndarray]]
+
+
+@dataclass(slots=True)
+class _IndexStore:
+    # Files are ordered with decodable tiles first, so every variant's feature
+    # rows line up with the first ``tiles`` entries of ``paths``.
+    paths: StringTable
+    fingerprints: np.ndarray
+    digests: np.ndarray | None
+    tiles: int
+    variants: dict[str, TileVariant]
+    features: dict[str, np.ndarray]
+    atlases: dict[str, TileVariant]
+    pixels: dict[str, np.ndarray]
+    # When each variant and atlas was last asked for (time.time()), by sidecar name:
+    # "features.<key>" or "atlas.<key>".
+    used: dict[str, float] = field(default_factory=dict)
+    # Rows, by sidecar name, of tiles that failed to decode only for a variant or atlas
+    # the store lacked. Those matrices are served without them and never written.
+    partial: dict[str, np.ndarray] = field(default_factory=dict)
 
+    def index(self, variant: TileVariant) -> TileLibrary:
+        library = TileLibrary(self.paths, self.features[variant.key], self.pixels.get(variant.atlas_key), variant.color_space)
+        holes = [self.partial[name] for name in (f"features.{variant.key}", f"atlas.{variant.atlas_key}") if name in self.partial]
+        return library.where(~np.logical_or.reduce(holes)) if holes else library
 
-def _from_cache(data: dict, fit_mode: FitMode, tile_size: tuple[int, int], tile_shape: TileShape) -> list[TileDescriptor] | None:
-    settings = data.get("settings", {})
-    if settings.get("fit_mode") != fit_mode.value:
+
+def _index_tile(
+    path: Path,
+    variants: tuple[TileVariant, ...],
+    atlases: tuple[TileVariant, ...] = (),
+    data: bytes | None = None,
+) -> _TileResult | None:
+    # Module-level so it can be shipped to pool workers; one decode feeds every
+    # variant and atlas, and each (size, fit) is fitted only once. ``data`` is the
+    # file's contents when a reader thread already fetched them.
+    try:
+        image = load_reduced(path if data is None else io.BytesIO(data), [(variant.tile_size, variant.fit_mode) for variant in variants + atlases])
+        fitted: dict[str, Image.Image] = {}
+
+        def fit(variant: TileVariant) -> Image.Image:
+            if variant.atlas_key not in fitted:
+                fitted[variant.atlas_key] = fit_image(image, variant.tile_size, fit_mode=variant.fit_mode)
+            return fitted[variant.atlas_key]
+
+        averages = []
+        for variant in variants:
+            tile = fit(variant)
+            if variant.grid > 1:
+                weights = None
+                if variant.tile_shape == TileShape.HEX:
+                    weights = np.asarray(hex_mask(variant.tile_size, edge_softness=variant.hex_edge_softness), dtype=np.float32) / 255.0
+                # Computed like the source cells' descriptors, on the fitted tile as a one-cell canvas.
+                averages.append(cell_features(np.asarray(tile), [(0, 0)], variant.tile_size, weights=weights, grid=variant.grid)[0])
+            elif variant.tile_shape == TileShape.HEX:
+                averages.append(average_rgb_masked(tile, hex_mask(variant.tile_size, edge_softness=variant.hex_edge_softness)))
+            else:
+                averages.append(average_rgb(tile))
+            if variant.color_space != ColorSpace.RGB:
+                averages[-1] = convert_features(np.asarray(averages[-1], dtype=np.float32), variant.color_space)
+        return averages, [np.asarray(fit(atlas), dtype=np.uint8) for atlas in atlases]
+    except Exception:
         return None
-    if tuple(settings.get("tile_size", [])) != tile_size:
+
+
+def _index_tiles(batch: list[tuple[Path, tuple[TileVariant, ...], tuple[TileVariant, ...], bytes | None]]) -> list[_TileResult | None]:
+    return [_index_tile(*item) for item in batch]
+
+
+class _PixelSpool:
+    # Fitted atlas pixels of newly decoded tiles, appended to unnamed files beside the
+    # cache as each tile finishes, so they are not held in memory until assembly.
+    __slots__ = ("directory", "shapes", "files", "rows", "views")
+
+    def __init__(self, directory: Path, atlases: dict[str, TileVariant]) -> None:
+        self.directory = directory
+        self.shapes = {key: (a.tile_size[1], a.tile_size[0], 3) for key, a in atlases.items()}
+        self.files: dict[str, BinaryIO] = {}
+        self.rows = dict.fromkeys(atlases, 0)
+        self.views: dict[str, np.ndarray] = {}
+
+    def __enter__(self) -> _PixelSpool:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.views.clear()
+        for file in self.files.values():
+            file.close()
+
+    def append(self, atlases: tuple[TileVariant, ...], fitted: list[np.ndarray]) -> list[int]:
+        # Spool rows of ``fitted``, one per atlas.
+        slots = []
+        for atlas, tile in zip(atlases, fitted):
+            key = atlas.atlas_key
+            if key not in self.files:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self.files[key] = tempfile.TemporaryFile(dir=self.directory)
+            self.files[key].write(np.ascontiguousarray(tile, dtype=np.uint8).tobytes())
+            slots.append(self.rows[key])
+            self.rows[key] += 1
+        return slots
+
+    def read(self, atlases: tuple[TileVariant, ...], slots: list[int]) -> list[np.ndarray]:
+        # Mapped views of the rows ``append`` returned; the maps are redone as the files grow.
+        tiles = []
+        for atlas, slot in zip(atlases, slots):
+            key = atlas.atlas_key
+            if slot >= len(self.views.get(key, ())):
+                self.files[key].flush()
+                self.views[key] = np.memmap(self.files[key], dtype=np.uint8, mode="r", shape=(self.rows[key], *self.shapes[key]))
+            tiles.append(self.views[key][slot])
+        return tiles
+
+
+def _copy_rows(out: np.ndarray, dest: np.ndarray, source: np.ndarray, rows: np.ndarray) -> None:
+    # out[dest] = source[rows] a bounded block at a time, so memmapped atlases never
+    # pass through memory whole.
+    step = max(1, _MAX_BATCH_BYTES // max(1, source.itemsize * int(np.prod(source.shape[1:]))))
+    for start in range(0, len(dest), step):
+        out[dest[start : start + step]] = source[rows[start : start + step]]
+
+
+def _scratch_array(directory: Path | None, shape: tuple[int, ...], dtype: np.dtype | type) -> np.ndarray:
+    # A writable array for an intermediate atlas: an unnamed file in ``directory``, or memory.
+    if directory is None or not np.prod(shape):
+        return np.zeros(shape, dtype=dtype)
+    directory.mkdir(parents=True, exist_ok=True)
+    return np.memmap(tempfile.TemporaryFile(dir=directory), dtype=dtype, mode="w+", shape=shape)
+
+
+def _read_file(path: str) -> bytes | None:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        # The decoder retries from the path and records the failure.
         return None
-    if settings.get("tile_shape", TileShape.RECT.value) != tile_shape.value:
+
+
+def _index_chunksize(count: int, workers: int) -> int:
+    # Several chunks per worker keeps the pool balanced without per-file IPC. While
+    # streaming, ``count`` is the work found so far, so chunks grow as the scan goes.
+    return max(1, min(_MAX_INDEX_CHUNK, count // (workers * 8)))
+
+
+def _fingerprint(path: Path, content_hash: bool, stat: os.stat_result | None = None) -> tuple[int, int, bytes]:
+    stat = path.stat() if stat is None else stat
+    digest = b""
+    if content_hash:
+        with path.open("rb") as f:
+            digest = hashlib.file_digest(f, "sha256").digest()
+    return (stat.st_size, stat.st_mtime_ns, digest)
+
+
+def _same_file(cached: tuple[int, int, bytes], current: tuple[int, int, bytes]) -> bool:
+    # With a content hash the digest decides, so touched-but-identical files are reused.
+    if current[2]:
+        return cached[2] == current[2]
+    return cached[:2] == current[:2]
+
+
+def _from_cache(cache_path: Path) -> _IndexStore | None:
+    manifest = load_json(cache_path)
+    if manifest is None or manifest.get("version") != CACHE_VERSION:
         return None
 
-    descriptors: list[TileDescriptor] = []
-    for entry in data.get("tiles", []):
-        descriptors.append(
-            TileDescriptor(
-                path=Path(entry["path"]),
-                avg_rgb=(float(entry["avg_rgb"][0]), float(entry["avg_rgb"][1]), float(entry["avg_rgb"][2])),
-            )
-        )
-    return descriptors
-
-
-def _to_cache(
-    descriptors: list[TileDescriptor], fit_mode: FitMode, tile_size: tuple[int, int], tile_shape: TileShape, hex_edge_softness: float
-) -> dict:
-    return {
-        "settings": {
-            "fit_mode": fit_mode.value,
-            "tile_size": list(tile_size),
-            "tile_shape": tile_shape.value,
-            "hex_edge_softness": round(hex_edge_softness, 3),
+    paths = load_string_table(cache_path)
+    fingerprints = load_array(sidecar_path(cache_path, "fingerprints"))
+    digests = load_array(sidecar_path(cache_path, "digests")) if manifest.get("content_hash") else None
+    # The manifest is written last; counts that disagree mean an interrupted write.
+    if paths is None or fingerprints is None or len(paths) != manifest.get("files"):
+        return None
+    tiles = int(manifest.get("tiles", -1))
+    # Caches written before use was tracked count as used now.
+    used = manifest.get("used", {})
+    now = time.time()
+
+    variants: dict[str, TileVariant] = {}
+    features: dict[str, np.ndarray] = {}
+    for key, settings in manifest.get("variants", {}).items():
+        matrix = load_array(sidecar_path(cache_path, f"features.{key}"))
+        if matrix is not None and len(matrix) == tiles:
+            variants[key] = TileVariant.from_settings(settings)
+            features[key] = matrix
+    atlases: dict[str, TileVariant] = {}
+    pixels: dict[str, np.ndarray] = {}
+    for key, settings in manifest.get("atlases", {}).items():
+        atlas = TileVariant.from_settings(settings)
+        matrix = load_array(sidecar_path(cache_path, f"atlas.{key}"))
+        if matrix is not None and matrix.shape == (tiles, atlas.tile_size[1], atlas.tile_size[0], 3):
+            atlases[key] = atlas
+            pixels[key] = matrix
+    names = [f"features.{key}" for key in variants] + [f"atlas.{key}" for key in atlases]
+    return _IndexStore(
+        paths=paths,
+        fingerprints=fingerprints,
+        digests=digests,
+        tiles=tiles,
+        variants=variants,
+        features=features,
+        atlases=atlases,
+        pixels=pixels,
+        used={name: float(used.get(name, now)) for name in names},
+    )
+
+
+def _to_cache(cache_path: Path, store: _IndexStore, only: Sequence[str] | None = None) -> None:
+    # With ``only``, just those feature matrices are added to a cache holding the rest of ``store``.
+    variants = {key: v for key, v in store.variants.items() if f"features.{key}" not in store.partial}
+    atlases = {key: a for key, a in store.atlases.items() if f"atlas.{key}" not in store.partial}
+    if only is None:
+        write_string_table(cache_path, store.paths)
+        write_array(sidecar_path(cache_path, "fingerprints"), store.fingerprints)
+        if store.digests is not None:
+            write_array(sidecar_path(cache_path, "digests"), store.digests)
+        for key in atlases:
+            write_array(sidecar_path(cache_path, f"atlas.{key}"), store.pixels[key])
+    for key in variants:
+        if only is None or key in only:
+            write_array(sidecar_path(cache_path, f"features.{key}"), store.features[key])
+    names = [f"features.{key}" for key in variants] + [f"atlas.{key}" for key in atlases]
+    write_json(
+        cache_path,
+        {
+            "version": CACHE_VERSION,
+            "files": len(store.paths),
+            "tiles": store.tiles,
+            "content_hash": store.digests is not None,
+            "variants": {key: variant.settings() for key, variant in variants.items()},
+            "atlases": {key: atlas.settings() for key, atlas in atlases.items()},
+            "used": {name: store.used[name] for name in names if name in store.used},
         },
-        "tiles": [{"path": str(d.path), "avg_rgb": list(d.avg_rgb)} for d in descriptors],
-    }
+    )
+
+
+def _prune_unused(store: _IndexStore, requested: Sequence[str], now: float, max_unused: float | None) -> list[str]:
+    # Drops the variants and atlases not requested for ``max_unused`` seconds; returns their sidecar names.
+    if max_unused is None:
+        return []
+    pruned = [name for name, used in store.used.items() if name not in requested and now - used > max_unused]
+    for name in pruned:
+        kind, key = name.split(".", 1)
+        if kind == "features":
+            del store.variants[key], store.features[key]
+        else:
+            del store.atlases[key], store.pixels[key]
+        del store.used[name]
+    return pruned
+
+
+def _remove_sidecars(cache_path: Path, names: Sequence[str]) -> None:
+    for name in names:
+        try:
+            sidecar_path(cache_path, name).unlink(missing_ok=True)
+        except OSError:
+            # Still mapped by another process on some platforms; it is no longer referenced.
+            pass
+
+
+def _derive_color_spaces(store: _IndexStore, variants: Sequence[TileVariant]) -> list[str]:
+    # Colour-space variants are per-colour conversions of their RGB variant, so a store
+    # holding that gains them in one vectorised pass without decoding a tile.
+    added = []
+    for variant in variants:
+        if variant.key not in store.features and variant.rgb.key in store.features:
+            store.features[variant.key] = convert_features(np.asarray(store.features[variant.rgb.key]), variant.color_space)
+            store.variants[variant.key] = variant
+            store.used[f"features.{variant.key}"] = time.time()
+            added.append(variant.key)
+    return added
+
+
+def _cached_fingerprint(store: _IndexStore, row: int) -> tuple[int, int, bytes]:
+    size, mtime_ns = (int(v) for v in store.fingerprints[row])
+    digest = store.digests[row].tobytes() if store.digests is not None else b""
+    return (size, mtime_ns, digest)
+
+
+def _checkpoint_paths(cache_path: Path) -> list[Path]:
+    # Checkpoints are small stores beside the cache: tile_index.checkpoint-0001.json, ...
+    found = cache_path.parent.glob(f"{cache_path.stem}.checkpoint-*{cache_path.suffix}")
+    return sorted(found, key=lambda path: int(path.stem.rsplit("-", 1)[1]))
+
+
+def _remove_checkpoints(cache_path: Path) -> None:
+    for path in cache_path.parent.glob(f"{cache_path.stem}.checkpoint-*"):
+        path.unlink(missing_ok=True)
+
+
+def _merge_stores(stores: list[_IndexStore], directory: Path | None = None) -> _IndexStore:
+    # Later stores win for the paths they share. Only variants and atlases that every
+    # store holds survive; the others are simply indexed again. Atlases are merged into
+    # unnamed files in ``directory`` when given.
+    variants = {key: v for key, v in stores[-1].variants.items() if all(key in store.features for store in stores)}
+    atlases = {key: a for key, a in stores[-1].atlases.items() if all(key in store.pixels for store in stores)}
+    owners: dict[str, tuple[int, int]] = {}
+    for number, store in enumerate(stores):
+        owners.update((path, (number, row)) for row, path in enumerate(store.paths.tolist()))
+    names = sorted(owners)
+    source = np.array([owners[name][0] for name in names], dtype=np.int64).reshape(-1)
+    rows = np.array([owners[name][1] for name in names], dtype=np.int64).reshape(-1)
+    good = rows < np.array([store.tiles for store in stores], dtype=np.int64)[source]
+    order = np.concatenate([np.flatnonzero(good), np.flatnonzero(~good)])
+    source, rows, tiles = source[order], rows[order], int(good.sum())
+
+    def gather(arrays: list[np.ndarray], count: int, spill: Path | None = None) -> np.ndarray:
+        out = _scratch_array(spill, (count, *arrays[-1].shape[1:]), arrays[-1].dtype)
+        for number, array in enumerate(arrays):
+            mine = np.flatnonzero(source[:count] == number)
+            _copy_rows(out, mine, array, rows[mine])
+        return out
+
+    with_digests = all(store.digests is not None for store in stores)
+    return _IndexStore(
+        paths=StringTable.from_strings([names[i] for i in order]),
+        fingerprints=gather([store.fingerprints for store in stores], len(order)),
+        digests=gather([store.digests for store in stores], len(order)) if with_digests else None,
+        tiles=tiles,
+        variants=variants,
+        features={key: gather([store.features[key] for store in stores], tiles) for key in variants},
+        atlases=atlases,
+        pixels={key: gather([store.pixels[key] for store in stores], tiles, directory) for key in atlases},
+        used={
+            name: max(store.used.get(name, 0.0) for store in stores)
+            for name in [f"features.{key}" for key in variants] + [f"atlas.{key}" for key in atlases]
+        },
+    )
+
+
+def _load_store(cache_path: Path) -> tuple[_IndexStore | None, bool]:
+    # The cache merged with the checkpoints of an interrupted index, and whether there were any.
+    chunks = [chunk for path in _checkpoint_paths(cache_path) if (chunk := _from_cache(path)) is not None]
+    store = _from_cache(cache_path)
+    if not chunks:
+        return store, False
+    return _merge_stores([store, *chunks] if store is not None else chunks, cache_path.parent), True
+
+
+def _assemble(
+    store: _IndexStore | None,
+    paths: list[str],
+    fingerprints: list[tuple[int, int, bytes]],
+    reused_rows: list[int],
+    decoded: list[tuple[int, tuple[TileVariant, ...], tuple[TileVariant, ...], _TileResult | None]],
+    variants: dict[str, TileVariant],
+    atlases: dict[str, TileVariant],
+    content_hash: bool,
+    used: dict[str, float] | None = None,
+    target: Path | None = None,
+) -> _IndexStore:
+    # A store of ``paths``: features are copied from ``store`` rows that are reused and
+    # overlaid with the ``decoded`` results (position, variants, atlases, result). With
+    # ``target``, the cache the store is written to next, atlases are filled in place
+    # in their sidecars' temporary files rather than in memory.
+    cached_tiles = store.tiles if store is not None else 0
+    rows = np.array(reused_rows, dtype=np.int64)
+    ok = (rows >= 0) & (rows < cached_tiles)
+    # Failed decodes of new or changed files stay in the file table (after the tiles)
+    # so they are not retried until the file changes. A stored tile that failed only
+    # for variants it lacked keeps its rows; those variants just go without it.
+    reused = ok.copy()
+    holes: dict[str, list[int]] = {}
+    for i, wanted, wanted_pixels, result in decoded:
+        if result is None:
+            if reused[i]:
+                for name in [f"features.{v.key}" for v in wanted] + [f"atlas.{a.atlas_key}" for a in wanted_pixels]:
+                    holes.setdefault(name, []).append(i)
+            continue
+        ok[i] = True
+    # The scan order varies from run to run; rows are sorted by path so the library does not.
+    by_path = np.array(sorted(range(len(paths)), key=paths.__getitem__), dtype=np.int64)
+    order = np.concatenate([by_path[ok[by_path]], by_path[~ok[by_path]]])
+    good = order[: int(ok.sum())]
+    partial = {name: np.isin(good, members) for name, members in holes.items()}
+
+    # Tiles are written straight to their final rows, so no full-size matrix is compacted.
+    slot = np.full(len(paths), -1, dtype=np.int64)
+    slot[good] = np.arange(len(good))
+    features = {key: np.zeros((len(good), v.dims), dtype=np.float32) for key, v in variants.items()}
+    pixels = {}
+    for key, a in atlases.items():
+        shape = (len(good), a.tile_size[1], a.tile_size[0], 3)
+        # Atlases with holes are never written, so they stay in memory.
+        in_place = target is not None and f"atlas.{key}" not in partial
+        pixels[key] = create_array(sidecar_path(target, f"atlas.{key}"), shape, np.uint8) if in_place else np.zeros(shape, dtype=np.uint8)
+    kept = np.flatnonzero(reused[good])
+    if kept.size:
+        for key, matrix in store.features.items():
+            if key in features:
+                features[key][kept] = matrix[rows[good[kept]]]
+        for key, matrix in store.pixels.items():
+            if key in pixels:
+                _copy_rows(pixels[key], kept, matrix, rows[good[kept]])
+    for i, wanted, wanted_pixels, result in decoded:
+        if result is None:
+            continue
+        averages, fitted = result
+        for variant, avg in zip(wanted, averages):
+            features[variant.key][slot[i]] = avg
+        for a, tile in zip(wanted_pixels, fitted):
+            pixels[a.atlas_key][slot[i]] = tile
+    return _IndexStore(
+        paths=StringTable.from_strings([paths[i] for i in order]),
+        fingerprints=np.array([fingerprints[i][:2] for i in order], dtype=np.int64).reshape(-1, 2),
+        digests=np.frombuffer(b"".join(fingerprints[i][2] for i in order), dtype=np.uint8).reshape(-1, 32) if content_hash else None,
+        tiles=len(good),
+        variants=variants,
+        features=features,
+        atlases=atlases,
+        pixels=pixels,
+        used=dict(used or {}),
+        partial=partial,
+    )
+
+
+def build_tile_indexes(
+    tile_dirs: list[Path],
+    variants: list[TileVariant],
+    cache_path: Path | None = None,
+    refresh_cache: bool = False,
+    workers: int = 1,
+    content_hash: bool = False,
+    rescan: bool = True,
+    atlas: bool = False,
+    scan_workers: int = SCAN_WORKERS,
+    checkpoint_interval: float | None = CHECKPOINT_SECONDS,
+    max_unused: float | None = MAX_UNUSED_SECONDS,
+) -> dict[TileVariant, TileLibrary]:
+    # With ``atlas`` the fitted pixels of every tile are stored too, one uint8
+    # array per (size, fit), so composition never has to decode a tile again.
+    #
+    # Indexing streams through bounded stages: ``scan_workers`` threads list the
+    # tile directories and read new files ahead, ``workers`` processes (or this
+    # thread) decode and fit them, and a writer thread checkpoints finished tiles
+    # beside the cache every ``checkpoint_interval`` seconds. A later run resumes
+    # from the checkpoints; the cache itself is only replaced once indexing ends.
+    #
+    # Stored variants and atlases not in this request are kept current too, until
+    # none has been asked for in ``max_unused`` seconds (None keeps them forever).
+    wanted_atlases = {v.atlas_key: TileVariant(v.tile_size, v.fit_mode) for v in variants} if atlas else {}
+    requested = [f"features.{v.key}" for v in variants] + [f"atlas.{key}" for key in wanted_atlases]
+    now = time.time()
+    resumed = False
+    pruned: list[str] = []
+    with timer("library.cache_read"):
+        if cache_path is not None and refresh_cache:
+            _remove_checkpoints(cache_path)
+        store, resumed = _load_store(cache_path) if cache_path and not refresh_cache else (None, False)
+    if store is not None:
+        derived = _derive_color_spaces(store, variants)
+        pruned = _prune_unused(store, requested, now, max_unused)
+        touched = any(now - store.used[name] >= _USE_RESOLUTION for name in requested if name in store.used)
+        store.used.update((name, now) for name in requested if name in store.used)
+        if (derived or pruned or touched) and not resumed:
+            with timer("library.cache_write"):
+                _to_cache(cache_path, store, only=derived)
+                _remove_sidecars(cache_path, pruned)
+    if (
+        store is not None
+        and not rescan
+        and not resumed
+        and all(v.key in store.features for v in variants)
+        and all(key in store.pixels for key in wanted_atlases)
+    ):
+        # Trusted cache: feature matrices are used straight from the memmaps.
+        count("tile_cache.hits", store.tiles)
+        return {v: store.index(v) for v in variants}
+
+    # Variants and atlases already in the store are kept current alongside the requested ones.
+    all_variants = {v.key: v for v in variants}
+    all_atlases = dict(wanted_atlases)
+    if store is not None:
+        all_variants.update({key: v for key, v in store.variants.items() if key not in all_variants})
+        all_atlases.update({key: a for key, a in store.atlases.items() if key not in all_atlases})
+    missing = tuple(v for key, v in all_variants.items() if store is None or key not in store.features)
+    missing_atlases = tuple(a for key, a in all_atlases.items() if store is None or key not in store.pixels)
+    every = tuple(all_variants.values())
+    every_atlas = tuple(all_atlases.values())
+    used = {**(store.used if store is not None else {}), **{name: now for name in requested}}
+
+    known: dict[str, int] = {}
+    if store is not None:
+        known = {path: row for row, path in enumerate(store.paths.tolist())}
+    cached_tiles = store.tiles if store is not None else 0
+
+    # Files are keyed by path + fingerprint; only new or changed files are decoded,
+    # plus known-good files for variants the store does not have yet.
+    paths: list[str] = []
+    fingerprints: list[tuple[int, int, bytes]] = []
+    reused_rows: list[int] = []
+    work: dict[int, tuple[tuple[TileVariant, ...], tuple[TileVariant, ...]]] = {}
+    # Every finished tile's result stays here until the final assembly (checkpoints
+    # copy rather than release them), so this grows with the tiles decoded; with a
+    # cache, pixels are replaced by their spool rows.
+    results: dict[int, _TileResult | None] = {}
+    spooled: dict[int, list[int]] = {}
+    changed = refresh_cache or resumed or bool(missing) or bool(missing_atlases)
+
+    parallel = workers > 1
+    reads: deque[tuple[int, Future]] = deque()
+    decodes: deque[tuple[list[int], Future]] = deque()
+    batch: list[tuple[int, bytes | None]] = []
+    fresh: list[int] = []
+    checkpoints = len(_checkpoint_paths(cache_path)) if cache_path is not None else 0
+    last_checkpoint = time.perf_counter()
+    checkpoint_cost = 0.0
+
+    def finish(i: int, result: _TileResult | None) -> None:
+        if spool is not None and result is not None:
+            spooled[i] = spool.append(work[i][1], result[1])
+            result = (result[0], [])
+        results[i] = result
+        fresh.append(i)
+
+    def tile_result(i: int) -> _TileResult | None:
+        result = results[i]
+        if i in spooled:
+            return result[0], spool.read(work[i][1], spooled[i])
+        return result
+
+    def collect_decode() -> None:
+        positions, future = decodes.popleft()
+        with timer("library.decode"):
+            done = future.result()
+        for i, result in zip(positions, done):
+            finish(i, result)
+
+    def flush() -> None:
+        items = [(Path(paths[i]), *work[i], data) for i, data in batch]
+        decodes.append(([i for i, _ in batch], executor.submit(_index_tiles, items)))
+        batch.clear()
+        while len(decodes) > workers * _BATCHES_PER_WORKER:
+            collect_decode()
+
+    def decode(i: int, data: bytes | None) -> None:
+        if not parallel:
+            with timer("library.decode"):
+                finish(i, _index_tile(Path(paths[i]), *work[i], data))
+            return
+        batch.append((i, data))
+        size = sum(len(item) for _, item in batch if item is not None)
+        if len(batch) >= _index_chunksize(len(work), workers) or size >= _MAX_BATCH_BYTES:
+            flush()
+
+    def collect_read() -> None:
+        i, future = reads.popleft()
+        with timer("library.read"):
+            data = future.result()
+        decode(i, data)
+
+    def checkpoint() -> None:
+        # Newly finished tiles go to a new checkpoint store; reused ones are already in the cache.
+        nonlocal checkpoints, last_checkpoint, checkpoint_cost
+        if cache_path is None or not fresh:
+            return
+        started = time.perf_counter()
+        checkpoints += 1
+        chunk_path = cache_path.with_name(f"{cache_path.stem}.checkpoint-{checkpoints:04d}{cache_path.suffix}")
+        chunk = _assemble(
+            store,
+            [paths[i] for i in fresh],
+            [fingerprints[i] for i in fresh],
+            [reused_rows[i] for i in fresh],
+            [(k, *work[i], tile_result(i)) for k, i in enumerate(fresh)],
+            all_variants,
+            all_atlases,
+            content_hash,
+            used,
+            chunk_path,
+        )
+        fresh.clear()
+        writer.submit(_to_cache, chunk_path, chunk)
+        count("library.checkpoints")
+        last_checkpoint = time.perf_counter()
+        checkpoint_cost = last_checkpoint - started
+
+    def pump() -> None:
+        # Moves finished reads and decodes along without waiting on any.
+        while reads and reads[0][1].done():
+            collect_read()
+        while decodes and decodes[0][1].done():
+            collect_decode()
+        if checkpoint_interval is not None:
+            # Assembling a checkpoint never takes more than a tenth of the time.
+            interval = max(checkpoint_interval, 10 * checkpoint_cost)
+            if time.perf_counter() - last_checkpoint >= interval:
+                checkpoint()
+
+    with (
+        ThreadPoolExecutor(max_workers=max(1, scan_workers), thread_name_prefix="tile-read") as readers,
+        ProcessPoolExecutor(max_workers=workers) if parallel else nullcontext() as executor,
+        ThreadPoolExecutor(max_workers=1, thread_name_prefix="tile-checkpoint") as writer,
+        _PixelSpool(cache_path.parent, all_atlases) if cache_path is not None and all_atlases else nullcontext() as spool,
+    ):
+        try:
+            # "library.scan" is the whole streamed pipeline; read and decode time within it
+            # is what this thread spent waiting on (or, serially, doing) those stages.
+            with timer("library.scan"):
+                for key, stat in scan_image_files(tile_dirs, scan_workers):
+                    try:
+                        fingerprint = _fingerprint(Path(key), content_hash, stat)
+                    except OSError:
+                        # Removed or unreadable since it was listed.
+                        continue
+                    row = known.get(key, -1)
+                    cached = _cached_fingerprint(store, row) if row >= 0 else None
+                    i = len(paths)
+                    if cached is not None and _same_file(cached, fingerprint):
+                        changed = changed or cached != fingerprint
+                        if (missing or missing_atlases) and row < cached_tiles:
+                            work[i] = (missing, missing_atlases)
+                    else:
+                        row = -1
+                        work[i] = (every, every_atlas)
+                    paths.append(key)
+                    fingerprints.append(fingerprint)
+                    reused_rows.append(row)
+                    if i in work:
+                        reads.append((i, readers.submit(_read_file, key)))
+                        while len(reads) > _READ_AHEAD * workers:
+                            collect_read()
+                    pump()
+                while reads:
+                    collect_read()
+                if batch:
+                    flush()
+                while decodes:
+                    collect_decode()
+        except BaseException:
+            # Keep what finished before the failure or interrupt for the next run.
+            checkpoint()
+            raise
+        count("tiles.scanned", len(paths))
+        count("tile_cache.hits", len(paths) - len(work))
+        count("tile_cache.misses", len(work))
+        failed = sum(result is None for result in results.values())
+        count("tiles.decoded", len(results) - failed)
+        count("tiles.failed", failed)
+
+        changed = changed or bool(work) or len(paths) != len(known)
+        if store is not None and not changed:
+            # Every file is reused as stored, so the store already is the result.
+            return {v: store.index(v) for v in variants}
+        decoded = [(i, *work[i], tile_result(i)) for i in work]
+        target = cache_path if cache_path is not None and changed else None
+        result = _assemble(store, paths, fingerprints, reused_rows, decoded, all_variants, all_atlases, content_hash, used, target)
+    if target is not None:
+        with timer("library.cache_write"):
+            _to_cache(cache_path, result)
+            _remove_checkpoints(cache_path)
+            _remove_sidecars(cache_path, pruned)
+    return {v: result.index(v) for v in variants}
 
 
 def build_tile_index(
@@ -69,38 +853,26 @@ def build_tile_index(
     fit_mode: FitMode,
     tile_shape: TileShape = TileShape.RECT,
     hex_edge_softness: float = 0.2,
+    grid: int = 1,
+    color_space: ColorSpace = ColorSpace.RGB,
     cache_path: Path | None = None,
     refresh_cache: bool = False,
-) -> list[TileDescriptor]:
-    if cache_path and not refresh_cache:
-        cached = load_json(cache_path)
-        if cached is not None:
-            parsed = _from_cache(cached, fit_mode=fit_mode, tile_size=tile_size, tile_shape=tile_shape)
-            cached_softness = float(cached.get("settings", {}).get("hex_edge_softness", 0.2))
-            if parsed and (tile_shape != TileShape.HEX or round(cached_softness, 3) == round(hex_edge_softness, 3)):
-                return parsed
-
-    descriptors: list[TileDescriptor] = []
-    masked_avg = tile_shape == TileShape.HEX
-    mask = hex_mask(tile_size, edge_softness=hex_edge_softness) if masked_avg else None
-    for path in _iter_image_paths(tile_dirs):
-        try:
-            with Image.open(path) as img:
-                tile = fit_image(img.convert("RGB"), tile_size, fit_mode=fit_mode)
-                avg = average_rgb_masked(tile, mask) if mask is not None else average_rgb(tile)
-                descriptors.append(TileDescriptor(path=path, avg_rgb=avg))
-        except Exception:
-            continue
-
-    if cache_path is not None:
-        write_json(
-            cache_path,
-            _to_cache(
-                descriptors,
-                fit_mode=fit_mode,
-                tile_size=tile_size,
-                tile_shape=tile_shape,
-                hex_edge_softness=hex_edge_softness,
-            ),
-        )
-    return descriptors
+    workers: int = 1,
+    content_hash: bool = False,
+    rescan: bool = True,
+    atlas: bool = False,
+    checkpoint_interval: float | None = CHECKPOINT_SECONDS,
+) -> TileLibrary:
+    variant = TileVariant(tile_size=tile_size, fit_mode=fit_mode, tile_shape=tile_shape, hex_edge_softness=hex_edge_softness, grid=grid, color_space=color_space)
+    indexes = build_tile_indexes(
+        tile_dirs,
+        [variant],
+        cache_path=cache_path,
+        refresh_cache=refresh_cache,
+        workers=workers,
+        content_hash=content_hash,
+        rescan=rescan,
+        atlas=atlas,
+        checkpoint_interval=checkpoint_interval,
+    )
+    return indexes[variant]
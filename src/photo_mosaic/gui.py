@@ -7,8 +7,10 @@ from tkinter import filedialog, messagebox, ttk
 
 from PIL import Image, ImageTk
 
-from photo_mosaic.config import FitMode, HexBackground, MosaicConfig, Strategy, TileShape
-from photo_mosaic.core.mosaic import build_mosaic
+from photo_mosaic.config import ColorSpace, FitMode, HexBackground, MosaicConfig, NeighborSearch, Strategy, TileShape
+from photo_mosaic.core.budget import BuildBudget, BuildCancelled
+from photo_mosaic.core.engine import MosaicEngine
+from photo_mosaic.core.metrics import BuildMetrics
 
 
 class PhotoMosaicApp:
@@ -40,17 +42,38 @@ class PhotoMosaicApp:
         self.lazy_top_k_var = tk.StringVar(value="5")
         self.random_steps_var = tk.StringVar(value="1000")
         self.full_steps_var = tk.StringVar(value="2000")
+        self.optimal_gap_var = tk.StringVar(value="1.0")
+        self.optimal_time_limit_var = tk.StringVar(value="60")
+        self.time_budget_var = tk.StringVar(value="")
+        self.feature_grid_var = tk.StringVar(value="1")
+        self.color_space_var = tk.StringVar(value=ColorSpace.RGB.value)
+        self.neighbor_search_var = tk.StringVar(value=NeighborSearch.AUTO.value)
 
         self.refresh_cache_var = tk.BooleanVar(value=False)
+        self.cache_hash_var = tk.BooleanVar(value=False)
+        self.cache_rescan_var = tk.BooleanVar(value=True)
+        self.cache_atlas_var = tk.BooleanVar(value=True)
+        self.index_workers_var = tk.StringVar(value="1")
+        self.stream_output_var = tk.BooleanVar(value=False)
+        self.compose_workers_var = tk.StringVar(value="1")
 
         self.status_var = tk.StringVar(value="Ready")
+        self.metrics_var = tk.StringVar(value="")
         self.preview_photo: ImageTk.PhotoImage | None = None
 
         self.tile_dirs: list[Path] = []
+        # Keeps the tile library warm between builds and reloads it (through the incremental
+        # cache) when files in the tile folders change; "Refresh cache" reindexes everything.
+        self.engine = MosaicEngine(revalidate=True)
+        # Budget of the running build, whose cancel flag the Cancel button sets.
+        self.budget: BuildBudget | None = None
 
         self._build_ui()
 
     def _build_ui(self) -> None:
+        # Status bar with the stage timers and counters of the last build.
+        ttk.Label(self.root, textvariable=self.metrics_var, relief=tk.SUNKEN, anchor="w", padding=(8, 2)).pack(side=tk.BOTTOM, fill=tk.X)
+
         frame = ttk.Frame(self.root, padding=12)
         frame.pack(fill=tk.BOTH, expand=True)
 
@@ -170,6 +193,42 @@ class PhotoMosaicApp:
         ttk.Entry(parent, textvariable=self.full_steps_var, width=12).grid(row=row, column=1, sticky="w", pady=(6, 0))
         row += 1
 
+        ttk.Label(parent, text="Optimal Gap").grid(row=row, column=0, sticky="w", pady=(6, 0))
+        ttk.Entry(parent, textvariable=self.optimal_gap_var, width=12).grid(row=row, column=1, sticky="w", pady=(6, 0))
+        row += 1
+
+        ttk.Label(parent, text="Optimal Time Limit (s)").grid(row=row, column=0, sticky="w", pady=(6, 0))
+        ttk.Entry(parent, textvariable=self.optimal_time_limit_var, width=12).grid(row=row, column=1, sticky="w", pady=(6, 0))
+        row += 1
+
+        ttk.Label(parent, text="Time Budget (s, opt)").grid(row=row, column=0, sticky="w", pady=(6, 0))
+        ttk.Entry(parent, textvariable=self.time_budget_var, width=12).grid(row=row, column=1, sticky="w", pady=(6, 0))
+        row += 1
+
+        ttk.Label(parent, text="Feature Grid (NxN)").grid(row=row, column=0, sticky="w", pady=(6, 0))
+        ttk.Entry(parent, textvariable=self.feature_grid_var, width=12).grid(row=row, column=1, sticky="w", pady=(6, 0))
+        row += 1
+
+        ttk.Label(parent, text="Color Space").grid(row=row, column=0, sticky="w", pady=(6, 0))
+        ttk.Combobox(
+            parent,
+            textvariable=self.color_space_var,
+            values=[s.value for s in ColorSpace],
+            state="readonly",
+            width=12,
+        ).grid(row=row, column=1, sticky="w", pady=(6, 0))
+        row += 1
+
+        ttk.Label(parent, text="Neighbor Search").grid(row=row, column=0, sticky="w", pady=(6, 0))
+        ttk.Combobox(
+            parent,
+            textvariable=self.neighbor_search_var,
+            values=[s.value for s in NeighborSearch],
+            state="readonly",
+            width=12,
+        ).grid(row=row, column=1, sticky="w", pady=(6, 0))
+        row += 1
+
         ttk.Label(parent, text="Cache Path (opt)").grid(row=row, column=0, sticky="w", pady=(8, 0))
         ttk.Entry(parent, textvariable=self.cache_var, width=44).grid(row=row, column=1, sticky="ew", pady=(8, 0))
         ttk.Button(parent, text="Browse", command=self._pick_cache).grid(row=row, column=2, padx=(6, 0), pady=(8, 0))
@@ -178,7 +237,30 @@ class PhotoMosaicApp:
         ttk.Checkbutton(parent, text="Refresh cache", variable=self.refresh_cache_var).grid(row=row, column=1, sticky="w", pady=(8, 0))
         row += 1
 
-        ttk.Button(parent, text="Build Mosaic", command=self._start_build).grid(row=row, column=1, sticky="w", pady=(14, 0))
+        ttk.Checkbutton(parent, text="Hash tile contents", variable=self.cache_hash_var).grid(row=row, column=1, sticky="w")
+        row += 1
+
+        ttk.Checkbutton(parent, text="Rescan tile directories", variable=self.cache_rescan_var).grid(row=row, column=1, sticky="w")
+        row += 1
+
+        ttk.Checkbutton(parent, text="Store fitted tile pixels", variable=self.cache_atlas_var).grid(row=row, column=1, sticky="w")
+        row += 1
+
+        ttk.Label(parent, text="Index Workers").grid(row=row, column=0, sticky="w", pady=(6, 0))
+        ttk.Entry(parent, textvariable=self.index_workers_var, width=12).grid(row=row, column=1, sticky="w", pady=(6, 0))
+        row += 1
+
+        ttk.Label(parent, text="Compose Workers").grid(row=row, column=0, sticky="w", pady=(6, 0))
+        ttk.Entry(parent, textvariable=self.compose_workers_var, width=12).grid(row=row, column=1, sticky="w", pady=(6, 0))
+        row += 1
+
+        ttk.Checkbutton(parent, text="Stream output in strips (PNG only)", variable=self.stream_output_var).grid(row=row, column=1, sticky="w", pady=(6, 0))
+        row += 1
+
+        buttons = ttk.Frame(parent)
+        buttons.grid(row=row, column=1, sticky="w", pady=(14, 0))
+        ttk.Button(buttons, text="Build Mosaic", command=self._start_build).pack(side=tk.LEFT)
+        ttk.Button(buttons, text="Cancel", command=self._cancel_build).pack(side=tk.LEFT, padx=(6, 0))
         row += 1
 
         ttk.Label(parent, textvariable=self.status_var, foreground="#1f2937").grid(row=row, column=0, columnspan=3, sticky="w", pady=(10, 0))
@@ -236,22 +318,65 @@ class PhotoMosaicApp:
             messagebox.showerror("Invalid Configuration", str(exc))
             return
 
+        if self.budget is not None:
+            self.budget.cancel()
+        self.budget = BuildBudget.from_config(config)
         self.status_var.set("Building mosaic...")
-        thread = threading.Thread(target=self._run_build, args=(config,), daemon=True)
+        self.metrics_var.set("")
+        thread = threading.Thread(target=self._run_build, args=(config, self.budget), daemon=True)
         thread.start()
 
-    def _run_build(self, config: MosaicConfig) -> None:
+    def _cancel_build(self) -> None:
+        if self.budget is not None:
+            self.budget.cancel()
+            self.status_var.set("Cancelling...")
+
+    def _run_build(self, config: MosaicConfig, budget: BuildBudget) -> None:
+        metrics = BuildMetrics()
+
+        def on_stage(stage: str) -> None:
+            self.root.after(0, lambda: self._on_stage(stage, budget))
+
         try:
-            output = build_mosaic(config)
-            self.root.after(0, lambda: self._on_build_success(output))
+            output = self.engine.render(config, on_stage=on_stage, budget=budget, metrics=metrics)
+            self.root.after(0, lambda: self._on_build_success(output, budget, metrics))
+        except BuildCancelled:
+            self.root.after(0, lambda: self._on_build_cancelled(budget))
         except Exception as exc:  # noqa: BLE001
-            self.root.after(0, lambda: self._on_build_failure(exc))
+            self.root.after(0, lambda: self._on_build_failure(exc, budget))
+
+    def _on_stage(self, stage: str, budget: BuildBudget) -> None:
+        if budget is self.budget:
+            self.status_var.set(f"Building mosaic: {stage}...")
 
-    def _on_build_success(self, output: Path) -> None:
+    def _on_build_success(self, output: Path, budget: BuildBudget, metrics: BuildMetrics) -> None:
+        if budget is not self.budget:
+            return
+        self.budget = None
         self.status_var.set(f"Done: {output}")
+        self.metrics_var.set(self._metrics_summary(budget, metrics))
         self._render_preview(output)
 
-    def _on_build_failure(self, exc: Exception) -> None:
+    @staticmethod
+    def _metrics_summary(budget: BuildBudget, metrics: BuildMetrics) -> str:
+        parts = [f"{usage.stage} {usage.seconds:.2f}s" for usage in budget.usage]
+        counters = metrics.counters
+        parts.append(f"{counters.get('tiles.decoded', 0)} tiles decoded, {counters.get('tile_cache.hits', 0)} cached")
+        if "search.proposals" in counters:
+            parts.append(f"{counters.get('search.accepted', 0)}/{counters['search.proposals']} moves accepted")
+        if metrics.peak_rss is not None:
+            parts.append(f"peak RSS {metrics.peak_rss / (1 << 20):.0f} MB")
+        return " | ".join(parts)
+
+    def _on_build_cancelled(self, budget: BuildBudget) -> None:
+        if budget is self.budget:
+            self.budget = None
+            self.status_var.set("Build cancelled")
+
+    def _on_build_failure(self, exc: Exception, budget: BuildBudget) -> None:
+        if budget is not self.budget:
+            return
+        self.budget = None
         self.status_var.set("Build failed")
         messagebox.showerror("Build Failed", str(exc))
 
@@ -275,6 +400,7 @@ class PhotoMosaicApp:
         out_h = self._parse_optional_int(self.out_h_var.get())
         max_repeats = self._parse_optional_int(self.max_repeats_var.get())
         max_usage = self._parse_optional_float(self.max_usage_pct_var.get())
+        time_budget = self._parse_optional_float(self.time_budget_var.get())
 
         cache_value = self.cache_var.get().strip()
         cache_path = Path(cache_value) if cache_value else None
@@ -299,8 +425,20 @@ class PhotoMosaicApp:
             lazy_top_k=int(self.lazy_top_k_var.get().strip()),
             random_steps=int(self.random_steps_var.get().strip()),
             full_steps=int(self.full_steps_var.get().strip()),
+            optimal_gap=float(self.optimal_gap_var.get().strip()),
+            optimal_time_limit=float(self.optimal_time_limit_var.get().strip()),
+            time_budget=time_budget,
+            feature_grid=int(self.feature_grid_var.get().strip()),
+            color_space=ColorSpace(self.color_space_var.get()),
+            neighbor_search=NeighborSearch(self.neighbor_search_var.get()),
             cache_path=cache_path,
             refresh_cache=self.refresh_cache_var.get(),
+            cache_content_hash=self.cache_hash_var.get(),
+            cache_rescan=self.cache_rescan_var.get(),
+            cache_atlas=self.cache_atlas_var.get(),
+            index_workers=int(self.index_workers_var.get().strip()),
+            stream_output=self.stream_output_var.get(),
+            compose_workers=int(self.compose_workers_var.get().strip()),
         )
 
     @staticmethod
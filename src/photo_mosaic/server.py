@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qsl, urlsplit
+
+from pydantic import ValidationError
+
+from photo_mosaic.config import MosaicConfig
+from photo_mosaic.core.engine import MosaicEngine
+
+# Uploads larger than this are refused with 413.
+MAX_UPLOAD_BYTES = 64 << 20
+# Finished jobs remembered for status and result requests.
+MAX_FINISHED_JOBS = 1000
+# The only fields a client may override: how one render looks and is searched for.
+# Paths, caching and worker counts stay as the server was started; new config fields
+# are not overridable until added here.
+_RENDER_FIELDS = {
+    "tile_width",
+    "tile_height",
+    "output_width",
+    "output_height",
+    "tile_shape",
+    "hex_overlap",
+    "hex_edge_softness",
+    "hex_background",
+    "fit_mode",
+    "strategy",
+    "max_repeats",
+    "max_usage_percent",
+    "lazy_randomness",
+    "lazy_top_k",
+    "random_steps",
+    "full_steps",
+    "optimal_gap",
+    "optimal_time_limit",
+    "feature_grid",
+    "color_space",
+    "neighbor_search",
+    "format",
+}
+_RESULT_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp", ".bmp": "image/bmp"}
+_FINISHED = {"done", "failed"}
+
+
+@dataclass(slots=True)
+class RenderJob:
+    id: str
+    config: MosaicConfig
+    upload: Path
+    status: str = "queued"
+    stage: str | None = None
+    error: str | None = None
+    submitted: float = field(default_factory=time.perf_counter)
+    seconds: float | None = None
+    events: list[dict[str, Any]] = field(default_factory=list)
+    _updated: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in _FINISHED
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "output": str(self.config.output_path) if self.status == "done" else None,
+            "error": self.error,
+            "seconds": self.seconds,
+        }
+
+    def update(self, **changes: Any) -> None:
+        # Runs on the event loop; wakes every progress stream of this job.
+        for name, value in changes.items():
+            setattr(self, name, value)
+        if self.finished:
+            self.seconds = round(time.perf_counter() - self.submitted, 3)
+        self.events.append(self.snapshot())
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def wait_update(self, seen: int) -> None:
+        updated = self._updated
+        if len(self.events) <= seen:
+            await updated.wait()
+
+
+class RenderService:
+    # Render jobs wait in a bounded queue (submissions beyond it are refused) and
+    # run on ``workers`` threads against one warm MosaicEngine.
+    def __init__(
+        self,
+        base: MosaicConfig,
+        output_dir: Path,
+        workers: int = 1,
+        queue_size: int = 16,
+        engine: MosaicEngine | None = None,
+    ) -> None:
+        self.base = base
+        self.output_dir = output_dir
+        self.workers = workers
+        self.engine = MosaicEngine(base) if engine is None else engine
+        self.jobs: OrderedDict[str, RenderJob] = OrderedDict()
+        self._queue: asyncio.Queue[RenderJob] = asyncio.Queue(maxsize=queue_size)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self, warm: bool = True) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        (self.output_dir / "uploads").mkdir(exist_ok=True)
+        if warm:
+            await asyncio.get_running_loop().run_in_executor(self._pool, self.engine.library, self.base)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, upload: bytes, overrides: dict[str, str]) -> RenderJob:
+        # Raises ValueError for a bad request and asyncio.QueueFull when saturated.
+        blocked = overrides.keys() - _RENDER_FIELDS
+        if blocked:
+            raise ValueError(f"Cannot override {', '.join(sorted(blocked))}")
+        if self._queue.full():
+            raise asyncio.QueueFull
+        job_id = uuid.uuid4().hex
+        suffix = overrides.pop("format", "png").lower().lstrip(".")
+        if f".{suffix}" not in _RESULT_TYPES:
+            raise ValueError(f"Unsupported output format {suffix!r}")
+        source = self.output_dir / "uploads" / f"{job_id}.upload"
+        values = {**overrides, "source_image": source, "output_path": self.output_dir / f"{job_id}.{suffix}"}
+        try:
+            config = self.engine.resolve(overrides=values)
+        except ValidationError as exc:
+            raise ValueError(str(exc)) from exc
+        source.write_bytes(upload)
+        job = RenderJob(id=job_id, config=config, upload=source)
+        job.update()
+        self._queue.put_nowait(job)
+        self.jobs[job_id] = job
+        self._forget_old_jobs()
+        return job
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            job.update(status="running")
+
+            def on_stage(stage: str, job: RenderJob = job) -> None:
+                loop.call_soon_threadsafe(partial(job.update, stage=stage))
+
+            try:
+                await loop.run_in_executor(self._pool, partial(self.engine.render, job.config, on_stage=on_stage))
+                job.update(status="done", stage=None)
+            except Exception as exc:  # noqa: BLE001
+                job.update(status="failed", error=str(exc))
+            finally:
+                job.upload.unlink(missing_ok=True)
+                self._queue.task_done()
+
+    def _forget_old_jobs(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+
+async def _send(
+    writer: asyncio.StreamWriter,
+    status: HTTPStatus,
+    body: bytes = b"",
+    content_type: str = "application/json",
+    headers: dict[str, str] | None = None,
+) -> None:
+    head = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {content_type}", f"Content-Length: {len(body)}", "Connection: close"]
+    head.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+async def _send_json(writer: asyncio.StreamWriter, status: HTTPStatus, value: dict[str, Any], headers: dict[str, str] | None = None) -> None:
+    await _send(writer, status, json.dumps(value).encode("utf-8"), headers=headers)
+
+
+async def _stream_events(writer: asyncio.StreamWriter, job: RenderJob) -> None:
+    # Server-sent events, one per job update, until the job finishes.
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n")
+    seen = 0
+    while True:
+        while seen < len(job.events):
+            writer.write(f"data: {json.dumps(job.events[seen])}\n\n".encode("utf-8"))
+            seen += 1
+        await writer.drain()
+        if job.finished:
+            return
+        await job.wait_update(seen)
+
+
+async def _route(service: RenderService, writer: asyncio.StreamWriter, method: str, target: str, body: bytes) -> None:
+    url = urlsplit(target)
+    parts = [part for part in url.path.split("/") if part]
+    if method == "GET" and parts == ["health"]:
+        running = sum(job.status == "running" for job in service.jobs.values())
+        await _send_json(writer, HTTPStatus.OK, {"status": "ok", "queued": service.queued, "running": running})
+        return
+    if method == "POST" and parts == ["jobs"]:
+        if not body:
+            await _send_json(writer, HTTPStatus.BAD_REQUEST, {"error": "Request body must be the source image"})
+            return
+        try:
+            job = service.submit(body, dict(parse_qsl(url.query)))
+        except asyncio.QueueFull:
+            await _send_json(writer, HTTPStatus.SERVICE_UNAVAILABLE, {"error": "Render queue is full"}, headers={"Retry-After": "1"})
+            return
+        except ValueError as exc:
+            await _send_json(writer, HTTPStatus.BAD_REQUEST, {"error": str(exc)})
+            return
+        await _send_json(writer, HTTPStatus.ACCEPTED, job.snapshot(), headers={"Location": f"/jobs/{job.id}"})
+        return
+
+    job = service.jobs.get(parts[1]) if len(parts) in (2, 3) and parts[0] == "jobs" else None
+    if method != "GET" or job is None:
+        await _send_json(writer, HTTPStatus.NOT_FOUND, {"error": "Not found"})
+    elif len(parts) == 2:
+        await _send_json(writer, HTTPStatus.OK, job.snapshot())
+    elif parts[2] == "events":
+        await _stream_events(writer, job)
+    elif parts[2] == "result":
+        if job.status == "failed":
+            await _send_json(writer, HTTPStatus.INTERNAL_SERVER_ERROR, job.snapshot())
+        elif job.status != "done":
+            await _send_json(writer, HTTPStatus.CONFLICT, job.snapshot())
+        elif dict(parse_qsl(url.query)).get("path"):
+            await _send_json(writer, HTTPStatus.OK, {"path": str(job.config.output_path)})
+        else:
+            output = job.config.output_path
+            content_type = _RESULT_TYPES.get(output.suffix.lower(), "application/octet-stream")
+            await _send(writer, HTTPStatus.OK, await asyncio.to_thread(output.read_bytes), content_type=content_type)
+    else:
+        await _send_json(writer, HTTPStatus.NOT_FOUND, {"error": "Not found"})
+
+
+async def _handle(service: RenderService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    # One request per connection.
+    try:
+        method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+        headers: dict[str, str] = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, value = line.decode("latin-1").split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_UPLOAD_BYTES:
+            await _send_json(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Upload too large"})
+            return
+        body = await reader.readexactly(length) if length else b""
+        await _route(service, writer, method.upper(), target, body)
+    except (ValueError, asyncio.IncompleteReadError):
+        await _send_json(writer, HTTPStatus.BAD_REQUEST, {"error": "Malformed request"})
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(service: RenderService, host: str = "127.0.0.1", port: int = 8765) -> asyncio.Server:
+    await service.start()
+    return await asyncio.start_server(partial(_handle, service), host, port)
+
+
+def run_server(
+    service: RenderService,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    on_ready: Callable[[int], None] | None = None,
+) -> None:
+    async def main() -> None:
+        server = await start_server(service, host, port)
+        if on_ready is not None:
+            on_ready(server.sockets[0].getsockname()[1])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await service.stop()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
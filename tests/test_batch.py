@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from typer.testing import CliRunner
+
+from photo_mosaic.cli import app
+from photo_mosaic.config import MosaicConfig
+from photo_mosaic.core import mosaic
+from photo_mosaic.core.batch import batch_outputs, build_batch, collect_sources
+
+
+def _noise_image(path: Path, size: tuple[int, int], seed: int) -> None:
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(pixels, "RGB").save(path)
+
+
+def _make_inputs(tmp_path: Path) -> tuple[Path, Path]:
+    tiles = tmp_path / "tiles"
+    sources = tmp_path / "sources"
+    tiles.mkdir()
+    sources.mkdir()
+    for i in range(6):
+        _noise_image(tiles / f"t{i}.png", (30, 30), seed=i)
+    for i in range(4):
+        _noise_image(sources / f"s{i}.png", (64, 48), seed=10 + i)
+    return tiles, sources
+
+
+def test_batch_loads_library_once_and_matches_single_builds(tmp_path: Path, monkeypatch) -> None:
+    tiles, sources = _make_inputs(tmp_path)
+    loads = []
+    original = mosaic.build_tile_index
+
+    def _spy(*args, **kwargs):
+        loads.append(kwargs)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(mosaic, "build_tile_index", _spy)
+    paths = collect_sources([str(sources / "*.png")])
+    outputs = batch_outputs(paths, tmp_path / "out")
+    configs = [MosaicConfig(source_image=p, tile_dirs=[tiles], output_path=o, tile_width=8, tile_height=8) for p, o in zip(paths, outputs)]
+    results = build_batch(configs, workers=3)
+
+    assert len(loads) == 1 and loads[0]["atlas"]
+    assert [r.source for r in results] == paths and all(r.ok for r in results)
+    for config in configs:
+        single = mosaic.build_mosaic(config.model_copy(update={"output_path": tmp_path / "single.png"}))
+        np.testing.assert_array_equal(np.asarray(Image.open(config.output_path)), np.asarray(Image.open(single)))
+
+
+def test_batch_cli_reports_failures(tmp_path: Path) -> None:
+    tiles, sources = _make_inputs(tmp_path)
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("sources/s0.png\n# skipped\nsources/missing.png\n", encoding="utf-8")
+
+    result = CliRunner().invoke(
+        app,
+        ["batch", "--manifest", str(manifest), "--sources", str(sources / "s1.png"), "--tile-dir", str(tiles), "--output-dir", str(tmp_path / "out")],
+    )
+
+    assert result.exit_code == 1
+    assert "Rendered 2/3 mosaics" in result.output
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["s0.png", "s1.png"]
@@ -2,10 +2,13 @@ from __future__ import annotations
 
 from pathlib import Path
 
+import pytest
 from PIL import Image
 from typer.testing import CliRunner
 
+from photo_mosaic import cli, server
 from photo_mosaic.cli import app
+from photo_mosaic.config import BuildStage, ColorSpace, MosaicConfig
 
 
 def _make_image(path: Path, color: tuple[int, int, int], size: tuple[int, int] = (64, 64)) -> None:
@@ -97,3 +100,52 @@ def test_build_cli_hex_smoke(tmp_path: Path) -> None:
 
     assert result.exit_code == 0, result.output
     assert out.exists()
+
+
+def test_index_cli_builds_variants(tmp_path: Path) -> None:
+    tiles = tmp_path / "tiles"
+    tiles.mkdir()
+    _make_image(tiles / "r.png", (255, 0, 0))
+    _make_image(tiles / "g.png", (0, 255, 0))
+
+    runner = CliRunner()
+    result = runner.invoke(
+        app,
+        [
+            "index",
+            "--tile-dir",
+            str(tiles),
+            "--cache-path",
+            str(tmp_path / "tile_index.json"),
+            "--variant",
+            "16x16",
+            "--variant",
+            "24x24:pad:hex:0.3",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "16x16-crop-rect" in result.output
+    assert "24x24-pad-hex-s0.300" in result.output
+
+
+def test_commands_share_config_options(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    tiles = tmp_path / "tiles"
+    tiles.mkdir()
+    _make_image(tiles / "r.png", (255, 0, 0))
+    _make_image(tmp_path / "s.png", (200, 0, 10))
+    configs: list[MosaicConfig] = []
+    monkeypatch.setattr(cli, "build_batch", lambda batch, **kwargs: configs.extend(batch) or [])
+    monkeypatch.setattr(server, "run_server", lambda service, *args, **kwargs: configs.append(service.base))
+    shared = ["--tile-dir", str(tiles), "--tile-width", "12", "--color-space", "lab", "--feature-grid", "2"]
+
+    runner = CliRunner()
+    batch = runner.invoke(app, ["batch", "--sources", str(tmp_path / "s.png"), "--output-dir", str(tmp_path / "out"), *shared, "--time-budget", "assign=2"])
+    serve = runner.invoke(app, ["serve", "--output-dir", str(tmp_path / "served"), *shared])
+    assert batch.exit_code == 0 and serve.exit_code == 0, batch.output + serve.output
+    for config in configs:
+        assert config.tile_dirs == [tiles] and config.tile_width == 12
+        assert config.color_space == ColorSpace.LAB and config.feature_grid == 2
+    assert configs[0].stage_time_budgets == {BuildStage.ASSIGN: 2.0}
+    # The server only takes the library options.
+    assert runner.invoke(app, ["serve", "--output-dir", str(tmp_path / "served"), *shared, "--strategy", "full"]).exit_code != 0
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from photo_mosaic.config import BuildStage, MosaicConfig, Strategy
+from photo_mosaic.core import mosaic
+from photo_mosaic.core.budget import BuildBudget, BuildCancelled
+from photo_mosaic.core.metrics import BuildMetrics
+from photo_mosaic.core.engine import MosaicEngine
+
+
+def _noise_image(path: Path, size: tuple[int, int], seed: int) -> None:
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(pixels, "RGB").save(path)
+
+
+@pytest.fixture
+def base_config(tmp_path: Path) -> MosaicConfig:
+    tiles = tmp_path / "tiles"
+    tiles.mkdir()
+    for i in range(6):
+        _noise_image(tiles / f"t{i}.png", (30, 30), seed=i)
+    _noise_image(tmp_path / "s.png", (64, 48), seed=9)
+    return MosaicConfig(source_image=tmp_path / "s.png", tile_dirs=[tiles], output_path=tmp_path / "o.png", tile_width=8, tile_height=8)
+
+
+def _count_loads(monkeypatch: pytest.MonkeyPatch) -> list[dict]:
+    loads: list[dict] = []
+    original = mosaic.build_tile_index
+
+    def _spy(*args, **kwargs):
+        loads.append(kwargs)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(mosaic, "build_tile_index", _spy)
+    return loads
+
+
+def test_engine_reuses_library_across_overrides(tmp_path: Path, base_config: MosaicConfig, monkeypatch: pytest.MonkeyPatch) -> None:
+    loads = _count_loads(monkeypatch)
+    engine = MosaicEngine(base_config)
+
+    first = engine.build()
+    second = engine.build(overrides={"strategy": Strategy.FULL, "output_path": tmp_path / "full.png"})
+    assert len(loads) == 1 and len(engine) == 1
+
+    np.testing.assert_array_equal(np.asarray(Image.open(first)), np.asarray(Image.open(mosaic.build_mosaic(base_config))))
+    expected = mosaic.build_mosaic(base_config.model_copy(update={"strategy": Strategy.FULL, "output_path": tmp_path / "ref.png"}))
+    np.testing.assert_array_equal(np.asarray(Image.open(second)), np.asarray(Image.open(expected)))
+
+    with pytest.raises(ValueError):
+        engine.build(overrides={"tile_width": 1})
+
+
+def test_engine_evicts_least_recently_used(tmp_path: Path, base_config: MosaicConfig, monkeypatch: pytest.MonkeyPatch) -> None:
+    loads = _count_loads(monkeypatch)
+    engine = MosaicEngine(base_config, max_bytes=1)
+
+    engine.build()
+    engine.build(overrides={"tile_width": 12})
+    # Over budget, only the library in use survives.
+    assert len(engine) == 1
+    engine.build()
+    assert len(loads) == 3
+
+    roomy = MosaicEngine(base_config)
+    roomy.build()
+    roomy.build(overrides={"tile_width": 12})
+    assert len(roomy) == 2 and roomy.nbytes > 0
+
+
+def test_cold_library_load_does_not_block_warm_builds(tmp_path: Path, base_config: MosaicConfig, monkeypatch: pytest.MonkeyPatch) -> None:
+    engine = MosaicEngine(base_config)
+    engine.build()
+    started, release = threading.Event(), threading.Event()
+    loads: list[tuple[int, int]] = []
+    original = mosaic.build_tile_index
+
+    def _slow(*args, **kwargs):
+        loads.append(kwargs["tile_size"])
+        started.set()
+        assert release.wait(10)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(mosaic, "build_tile_index", _slow)
+    cold = [threading.Thread(target=engine.build, kwargs={"overrides": {"tile_width": 12, "output_path": tmp_path / f"c{i}.png"}}) for i in range(2)]
+    for thread in cold:
+        thread.start()
+    assert started.wait(10)
+    # The warm library builds while the cold one is loading.
+    assert engine.build(overrides={"output_path": tmp_path / "warm.png"}).exists()
+    release.set()
+    for thread in cold:
+        thread.join(10)
+    # Both cold builds shared one load.
+    assert loads == [(12, 8)] and len(engine) == 2
+    assert (tmp_path / "c0.png").exists() and (tmp_path / "c1.png").exists()
+
+
+def test_revalidating_engine_reloads_changed_tile_dirs(tmp_path: Path, base_config: MosaicConfig, monkeypatch: pytest.MonkeyPatch) -> None:
+    loads = _count_loads(monkeypatch)
+    engine = MosaicEngine(base_config, revalidate=True)
+    engine.build()
+    engine.build()
+    assert len(loads) == 1
+
+    _noise_image(base_config.tile_dirs[0] / "added.png", (30, 30), seed=42)
+    engine.build()
+    assert len(loads) == 2 and len(engine.library(base_config).tiles) == 7
+    (base_config.tile_dirs[0] / "t0.png").unlink()
+    assert len(engine.library(base_config).tiles) == 6 and len(loads) == 3
+
+
+def test_stages_rerun_only_downstream_of_changes(tmp_path: Path, base_config: MosaicConfig, monkeypatch: pytest.MonkeyPatch) -> None:
+    calls: list[str] = []
+    for name in ("_source_cell_rgbs", "greedy_assign", "full_optimize_assign"):
+        original = getattr(mosaic, name)
+        monkeypatch.setattr(mosaic, name, lambda *a, _name=name, _original=original, **k: calls.append(_name) or _original(*a, **k))
+    engine = MosaicEngine(base_config)
+
+    engine.build(overrides={"strategy": Strategy.FULL, "full_steps": 10})
+    assert calls == ["_source_cell_rgbs", "greedy_assign", "full_optimize_assign"]
+    # Only the local search depends on the step count; greedy reuses the seed.
+    calls.clear()
+    engine.build(overrides={"strategy": Strategy.FULL, "full_steps": 20})
+    engine.build(overrides={"strategy": Strategy.GREEDY})
+    assert calls == ["full_optimize_assign"]
+    calls.clear()
+    engine.build(overrides={"max_repeats": 2})
+    assert calls == ["greedy_assign"]
+
+
+def test_stage_cache_dir_persists_across_engines(tmp_path: Path, base_config: MosaicConfig, monkeypatch: pytest.MonkeyPatch) -> None:
+    config = base_config.model_copy(update={"stage_cache_dir": tmp_path / "stages"})
+    first = np.asarray(Image.open(mosaic.build_mosaic(config)))
+
+    monkeypatch.setattr(mosaic, "_source_cell_rgbs", lambda *a, **k: pytest.fail("features recomputed"))
+    monkeypatch.setattr(mosaic, "greedy_assign", lambda *a, **k: pytest.fail("assignment recomputed"))
+    again = mosaic.build_mosaic(config.model_copy(update={"output_path": tmp_path / "again.png"}))
+    np.testing.assert_array_equal(np.asarray(Image.open(again)), first)
+
+
+def test_budget_reports_stages_and_cancels(tmp_path: Path, base_config: MosaicConfig, monkeypatch: pytest.MonkeyPatch) -> None:
+    engine = MosaicEngine(base_config)
+    config = engine.resolve(overrides={"strategy": Strategy.FULL, "time_budget": 30, "stage_time_budgets": {"compose": 5}})
+    budget = BuildBudget.from_config(config)
+    engine.render(config, budget=budget)
+    assert [usage.stage for usage in budget.usage] == list(BuildStage)
+    usage = {usage.stage: usage for usage in budget.usage}
+    # Compose's own budget is held back from what the total leaves the assign stage.
+    assert usage[BuildStage.COMPOSE].budget == 5
+    assert usage[BuildStage.ASSIGN].budget <= 25
+
+    # Cancelling from another thread stops the build at its next check and writes nothing.
+    budget = BuildBudget()
+    original = mosaic._greedy_seed
+    monkeypatch.setattr(mosaic, "_greedy_seed", lambda *a, **k: budget.cancel() or original(*a, **k))
+    output = tmp_path / "cancelled.png"
+    with pytest.raises(BuildCancelled):
+        engine.render(config.model_copy(update={"output_path": output, "max_repeats": 3}), budget=budget)
+    assert not output.exists()
+    assert budget.usage[-1].stage == BuildStage.ASSIGN
+
+
+def test_deadline_bounded_assignment_is_not_memoised(tmp_path: Path, base_config: MosaicConfig) -> None:
+    tiles = tmp_path / "many"
+    tiles.mkdir()
+    for i in range(40):
+        _noise_image(tiles / f"t{i}.png", (12, 12), seed=100 + i)
+    _noise_image(tmp_path / "big.png", (128, 96), seed=7)
+    config = base_config.model_copy(
+        update={"source_image": tmp_path / "big.png", "tile_dirs": [tiles], "strategy": Strategy.RANDOM, "random_steps": 20000, "max_repeats": 6}
+    )
+    engine = MosaicEngine()
+    staged = config.model_copy(update={"stage_cache_dir": tmp_path / "stages"})
+    truncated = np.asarray(Image.open(engine.render(staged, budget=BuildBudget(stages={BuildStage.ASSIGN: 0.0}))))
+
+    # Later unbudgeted builds search for the full step count, like a fresh one.
+    expected = np.asarray(Image.open(mosaic.build_mosaic(config.model_copy(update={"output_path": tmp_path / "ref.png"}))))
+    assert not np.array_equal(expected, truncated)
+    for render in (engine.render, mosaic.build_mosaic):
+        full = render(staged.model_copy(update={"output_path": tmp_path / "full.png"}))
+        np.testing.assert_array_equal(np.asarray(Image.open(full)), expected)
+
+
+def test_metrics_record_stages_counters_and_workers(tmp_path: Path, base_config: MosaicConfig) -> None:
+    # No pixels kept, so composition decodes tiles, here on worker threads.
+    engine = MosaicEngine(base_config, keep_pixels=False)
+    metrics = BuildMetrics()
+    engine.render(base_config.model_copy(update={"strategy": Strategy.FULL, "compose_workers": 2}), metrics=metrics)
+    engine.render(base_config.model_copy(update={"strategy": Strategy.FULL, "output_path": tmp_path / "again.png"}), metrics=metrics)
+
+    counters = metrics.counters
+    assert counters["builds"] == 2
+    assert counters["tiles.scanned"] == counters["tiles.decoded"] == 6
+    assert counters["engine.library_loads"] == 1 and counters["engine.library_hits"] == 1
+    assert counters["stage_cache.assign.misses"] == 1 and counters["stage_cache.assign.hits"] == 1
+    assert counters["compose.tiles"] == 2 * 48 and 0 < counters["compose.decoded"] <= 12
+    assert {"library", "library.decode", "features", "assign", "compose"} <= metrics.timers.keys()
+    assert metrics.peak_rss is None or metrics.peak_rss > 0
+
+    metrics.write_json(tmp_path / "metrics.json")
+    assert json.loads((tmp_path / "metrics.json").read_text())["counters"] == counters
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from photo_mosaic.config import ColorSpace, FitMode, MosaicConfig, TileShape
+from photo_mosaic.core.features import cell_features, convert_features, feature_rgb, rgb_to_space
+from photo_mosaic.core.image_utils import average_rgb, average_rgb_masked, fit_image, hex_mask, load_fitted
+from photo_mosaic.core.mosaic import _compute_layout, _source_cell_rgbs, build_mosaic
+
+
+def _noise_image(size: tuple[int, int], seed: int = 3) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8), "RGB")
+
+
+def _reference_cell_rgbs(image: Image.Image, positions, tile_size, mask) -> np.ndarray:
+    tile_w, tile_h = tile_size
+    max_x = max(0, image.size[0] - tile_w)
+    max_y = max(0, image.size[1] - tile_h)
+    rgbs = []
+    for x, y in positions:
+        left, top = min(x, max_x), min(y, max_y)
+        patch = image.crop((left, top, left + tile_w, top + tile_h))
+        rgbs.append(average_rgb(patch) if mask is None else average_rgb_masked(patch, mask))
+    return np.array(rgbs, dtype=np.float32)
+
+
+def _config(tmp_path: Path, **overrides) -> MosaicConfig:
+    return MosaicConfig(source_image=tmp_path / "s.png", tile_dirs=[tmp_path], output_path=tmp_path / "o.png", **overrides)
+
+
+def test_rect_cell_means_match_crop_average(tmp_path: Path) -> None:
+    config = _config(tmp_path, tile_width=8, tile_height=6)
+    layout = _compute_layout((70, 50), config)
+    image = _noise_image(layout.canvas_size)
+
+    actual = _source_cell_rgbs(image, layout, config.tile_size, TileShape.RECT, 0.2)
+    expected = _reference_cell_rgbs(image, layout.positions, config.tile_size, None)
+
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_hex_cell_means_match_masked_average(tmp_path: Path) -> None:
+    config = _config(tmp_path, tile_width=12, tile_height=12, tile_shape=TileShape.HEX, hex_overlap=0.35)
+    layout = _compute_layout((90, 80), config)
+    image = _noise_image(layout.canvas_size)
+    mask = hex_mask(config.tile_size, edge_softness=0.3)
+
+    actual = _source_cell_rgbs(image, layout, config.tile_size, TileShape.HEX, 0.3)
+    expected = _reference_cell_rgbs(image, layout.positions, config.tile_size, mask)
+
+    np.testing.assert_allclose(actual, expected, atol=1e-3)
+
+
+@pytest.mark.parametrize("tile_size", [(8, 6), (9, 7)])
+def test_grid_features_average_sub_cells(tile_size: tuple[int, int]) -> None:
+    # (8, 6) takes the regular-grid fast path, (9, 7) the generic one with uneven sub-cells.
+    tile_w, tile_h = tile_size
+    canvas = np.asarray(_noise_image((tile_w * 5, tile_h * 4)))
+    positions = [(x, y) for y in range(0, tile_h * 4, tile_h) for x in range(0, tile_w * 5, tile_w)]
+
+    features = cell_features(canvas, positions, tile_size, grid=2)
+    xs, ys = [0, (tile_w + 1) // 2, tile_w], [0, (tile_h + 1) // 2, tile_h]
+    for cell, (x, y) in zip(features.reshape(len(positions), 4, 3), positions):
+        patch = canvas[y : y + tile_h, x : x + tile_w].astype(np.float64)
+        expected = [patch[ys[r] : ys[r + 1], xs[c] : xs[c + 1]].mean(axis=(0, 1)) / 2 for r in range(2) for c in range(2)]
+        np.testing.assert_allclose(cell, expected, rtol=1e-5)
+    if tile_w % 2 == 0 and tile_h % 2 == 0:
+        np.testing.assert_allclose(feature_rgb(features), cell_features(canvas, positions, tile_size), rtol=1e-5)
+
+
+def test_perceptual_spaces_match_reference_values() -> None:
+    rgb = np.array([[255, 255, 255], [255, 0, 0], [0, 0, 255], [0, 0, 0]], dtype=np.float64)
+    lab = rgb_to_space(rgb, ColorSpace.LAB)
+    np.testing.assert_allclose(lab[0], [100.0, 0.0, 0.0], atol=1e-2)
+    np.testing.assert_allclose(lab[1], [53.24, 80.09, 67.20], atol=2e-2)
+    np.testing.assert_allclose(lab[3], [0.0, 0.0, 0.0], atol=1e-6)
+    oklab = rgb_to_space(rgb, ColorSpace.OKLAB)
+    np.testing.assert_allclose(oklab[0], [100.0, 0.0, 0.0], atol=1e-2)
+    np.testing.assert_allclose(oklab[2], [45.20, -3.25, -31.15], atol=2e-2)
+
+
+@pytest.mark.parametrize("space", [ColorSpace.LAB, ColorSpace.OKLAB])
+def test_converted_features_round_trip_to_rgb(space: ColorSpace) -> None:
+    canvas = np.asarray(_noise_image((32, 24)))
+    positions = [(x, y) for y in range(0, 24, 8) for x in range(0, 32, 8)]
+    for grid in (1, 2):
+        features = cell_features(canvas, positions, (8, 8), grid=grid)
+        converted = convert_features(features, space)
+        assert converted.shape == features.shape and converted.dtype == np.float32
+        np.testing.assert_allclose(feature_rgb(converted, space), feature_rgb(features), atol=1e-2)
+
+
+def test_reduced_decode_matches_full_decode(tmp_path: Path) -> None:
+    yy, xx = np.mgrid[0:1200, 0:1600]
+    pixels = np.stack([xx * 255 // 1600, yy * 255 // 1200, (xx + yy) % 256], axis=-1).astype(np.uint8)
+    path = tmp_path / "photo.jpg"
+    Image.fromarray(pixels, "RGB").save(path, quality=92)
+
+    for fit_mode in FitMode:
+        with Image.open(path) as img:
+            full = np.asarray(fit_image(img.convert("RGB"), (16, 16), fit_mode=fit_mode), dtype=np.float32)
+        reduced = np.asarray(load_fitted(path, (16, 16), fit_mode), dtype=np.float32)
+        assert reduced.shape == full.shape
+        assert np.abs(reduced - full).mean() < 1.5, fit_mode
+        assert np.abs(reduced.mean(axis=(0, 1)) - full.mean(axis=(0, 1))).max() < 1.0, fit_mode
+
+
+@pytest.mark.parametrize("tile_shape", [TileShape.RECT, TileShape.HEX])
+def test_atlas_composition_matches_decoding(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, tile_shape: TileShape) -> None:
+    tiles = tmp_path / "tiles"
+    tiles.mkdir()
+    for i in range(6):
+        _noise_image((40 + i, 30), seed=i).save(tiles / f"t{i}.png")
+    _noise_image((96, 80), seed=9).save(tmp_path / "s.png")
+    config = MosaicConfig(
+        source_image=tmp_path / "s.png",
+        tile_dirs=[tiles],
+        output_path=tmp_path / "o.png",
+        tile_width=12,
+        tile_height=10,
+        tile_shape=tile_shape,
+    )
+
+    decoded = Image.open(build_mosaic(config))
+    cached = config.model_copy(update={"output_path": tmp_path / "cached.png", "cache_path": tmp_path / "cache" / "index.json"})
+    build_mosaic(cached)
+
+    # Warm runs compose straight from the atlas without touching the tile files.
+    def _no_decode(*args):
+        raise AssertionError("tile decoded")
+
+    monkeypatch.setattr("photo_mosaic.core.mosaic.load_fitted", _no_decode)
+    warm = Image.open(build_mosaic(cached))
+    np.testing.assert_array_equal(np.asarray(warm), np.asarray(decoded))
+
+
+@pytest.mark.parametrize("tile_shape", [TileShape.RECT, TileShape.HEX])
+def test_streaming_matches_in_memory_render(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, tile_shape: TileShape) -> None:
+    # Tiny strips so tiles and hex overlaps straddle many strip edges.
+    monkeypatch.setattr("photo_mosaic.core.mosaic._BAND_PIXELS", 96 * 7)
+    tiles = tmp_path / "tiles"
+    tiles.mkdir()
+    for i in range(6):
+        _noise_image((40 + i, 30), seed=i).save(tiles / f"t{i}.png")
+    # A source at canvas size keeps strip resampling exact.
+    _noise_image((96, 77), seed=9).save(tmp_path / "s.png")
+    config = MosaicConfig(
+        source_image=tmp_path / "s.png",
+        tile_dirs=[tiles],
+        output_path=tmp_path / "o.png",
+        tile_width=12,
+        tile_height=11,
+        output_width=96,
+        output_height=77,
+        tile_shape=tile_shape,
+        hex_overlap=0.3,
+    )
+    in_memory = Image.open(build_mosaic(config))
+    streamed = Image.open(build_mosaic(config.model_copy(update={"output_path": tmp_path / "s_out.png", "stream_output": True})))
+
+    assert streamed.size == in_memory.size
+    np.testing.assert_array_equal(np.asarray(streamed), np.asarray(in_memory))
+
+
+@pytest.mark.parametrize("tile_shape", [TileShape.RECT, TileShape.HEX])
+@pytest.mark.parametrize("atlas", [False, True])
+def test_parallel_composition_is_byte_identical(tmp_path: Path, tile_shape: TileShape, atlas: bool) -> None:
+    tiles = tmp_path / "tiles"
+    tiles.mkdir()
+    for i in range(8):
+        _noise_image((40 + i, 30), seed=i).save(tiles / f"t{i}.png")
+    _noise_image((120, 100), seed=9).save(tmp_path / "s.png")
+    config = MosaicConfig(
+        source_image=tmp_path / "s.png",
+        tile_dirs=[tiles],
+        output_path=tmp_path / "o.png",
+        tile_width=10,
+        tile_height=9,
+        tile_shape=tile_shape,
+        hex_overlap=0.4,
+        cache_path=tmp_path / "cache" / "index.json" if atlas else None,
+    )
+    for stream_output in (False, True):
+        renders = []
+        for workers in (1, 3):
+            update = {"output_path": tmp_path / f"out_{stream_output}_{workers}.png", "compose_workers": workers, "stream_output": stream_output}
+            renders.append(np.asarray(Image.open(build_mosaic(config.model_copy(update=update)))))
+        np.testing.assert_array_equal(renders[1], renders[0])
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from photo_mosaic.config import MosaicConfig
+from photo_mosaic.server import RenderService, start_server
+
+
+def _noise_png(path: Path, size: tuple[int, int], seed: int) -> None:
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(pixels, "RGB").save(path)
+
+
+async def _request(port: int, method: str, path: str, body: bytes = b"") -> tuple[int, bytes]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), payload
+
+
+async def _wait_for(port: int, job_id: str, status: str) -> dict:
+    while True:
+        _, payload = await _request(port, "GET", f"/jobs/{job_id}")
+        job = json.loads(payload)
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.02)
+
+
+def test_service_renders_streams_and_applies_backpressure(tmp_path: Path) -> None:
+    tiles = tmp_path / "tiles"
+    tiles.mkdir()
+    for i in range(5):
+        _noise_png(tiles / f"t{i}.png", (30, 30), seed=i)
+    _noise_png(tmp_path / "source.png", (64, 48), seed=7)
+    upload = (tmp_path / "source.png").read_bytes()
+    base = MosaicConfig(source_image=tmp_path / "unused.png", tile_dirs=[tiles], output_path=tmp_path / "unused.png", tile_width=8, tile_height=8)
+    service = RenderService(base, tmp_path / "out", workers=1, queue_size=1)
+
+    # Hold the first render so the queue can be observed full.
+    release = threading.Event()
+    render = service.engine.render
+    service.engine.render = lambda config, on_stage=None: release.wait(10) and render(config, on_stage=on_stage)
+
+    async def scenario() -> None:
+        server = await start_server(service, port=0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            status, payload = await _request(port, "POST", "/jobs?strategy=full&full_steps=50", upload)
+            assert status == 202
+            first = json.loads(payload)["id"]
+            await _wait_for(port, first, "running")
+
+            status, payload = await _request(port, "POST", "/jobs", upload)
+            assert status == 202
+            second = json.loads(payload)["id"]
+            assert (await _request(port, "POST", "/jobs", upload))[0] == 503
+            assert (await _request(port, "POST", "/jobs?tile_dirs=/etc", upload))[0] == 400
+            for refused in (f"stage_cache_dir={tmp_path / 'planted'}", "refresh_cache=true", "index_workers=256", "cache_rescan=false"):
+                assert (await _request(port, "POST", f"/jobs?{refused}", upload))[0] == 400
+            assert (await _request(port, "GET", f"/jobs/{second}/result"))[0] == 409
+
+            events = asyncio.create_task(_request(port, "GET", f"/jobs/{first}/events"))
+            await asyncio.sleep(0.05)
+            release.set()
+            _, stream = await events
+            updates = [json.loads(line[6:]) for line in stream.decode().splitlines() if line.startswith("data: ")]
+            assert [u["stage"] for u in updates if u["status"] == "running"][-3:] == ["features", "assign", "compose"]
+            assert updates[-1]["status"] == "done"
+
+            await _wait_for(port, second, "done")
+            status, image = await _request(port, "GET", f"/jobs/{first}/result")
+            assert status == 200 and image.startswith(b"\x89PNG")
+            _, payload = await _request(port, "GET", f"/jobs/{second}/result?path=1")
+            assert Path(json.loads(payload)["path"]).exists()
+        finally:
+            server.close()
+            await server.wait_closed()
+            await service.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import itertools
+import random
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from photo_mosaic.cache import StringTable
+from photo_mosaic.config import NeighborSearch
+from photo_mosaic.core.budget import BuildCancelled
+from photo_mosaic.core.strategies import (
+    BruteForceIndex,
+    KDTreeIndex,
+    SelectionContext,
+    build_neighbor_index,
+    build_usage_limit,
+    full_optimize_assign,
+    greedy_assign,
+    lazy_assign,
+    optimal_assign,
+    random_improve_assign,
+)
+from photo_mosaic.core.tile_index import TileDescriptor, TileLibrary
+
+
+def _colors(count: int, seed: int, dims: int = 3) -> np.ndarray:
+    return np.random.default_rng(seed).uniform(0, 255, size=(count, dims)).astype(np.float32)
+
+
+def _reference_greedy(cells: np.ndarray, tile_colors: np.ndarray, ctx: SelectionContext) -> list[int]:
+    # Full-sort greedy the NN-backed version must reproduce.
+    usage = defaultdict(int)
+    limit = build_usage_limit(ctx)
+    out = []
+    for rgb in cells:
+        dists = np.sum((tile_colors - rgb) ** 2, axis=1)
+        idx = next((int(i) for i in np.argsort(dists, kind="stable") if limit is None or usage[i] < limit), int(np.argmin(dists)))
+        usage[idx] += 1
+        out.append(idx)
+    return out
+
+
+def _reference_lazy(cells, tile_colors, ctx, top_k, randomness, seed=7) -> list[int]:
+    rng = random.Random(seed)
+    usage = defaultdict(int)
+    limit = build_usage_limit(ctx)
+    out = []
+    for rgb in cells:
+        order = np.argsort(np.sum((tile_colors - rgb) ** 2, axis=1))
+        candidates = order[:top_k].tolist()
+        if rng.random() < randomness:
+            rng.shuffle(candidates)
+        pool = candidates + order.tolist()
+        idx = next((int(i) for i in pool if limit is None or usage[i] < limit), int(order[0]))
+        usage[idx] += 1
+        out.append(idx)
+    return out
+
+
+@pytest.mark.parametrize("dims", [3, 12])
+def test_kdtree_matches_brute_force(dims: int) -> None:
+    # 12 dims are the descriptors of a 2x2 feature grid.
+    tiles = _colors(3000, seed=1, dims=dims)
+    queries = _colors(500, seed=2, dims=dims)
+    brute_d, brute_i = BruteForceIndex(tiles).query(queries, 12)
+    tree_d, tree_i = KDTreeIndex(tiles, leaf_size=40).query(queries, 12)
+
+    np.testing.assert_array_equal(tree_i, brute_i)
+    np.testing.assert_array_equal(tree_d, brute_d)
+
+
+@pytest.mark.parametrize("kind", [NeighborSearch.BRUTE, NeighborSearch.KDTREE])
+@pytest.mark.parametrize("max_repeats", [None, 1, 3])
+def test_nn_strategies_match_full_sort(kind: NeighborSearch, max_repeats: int | None) -> None:
+    tiles = _colors(400, seed=3)
+    cells = _colors(600, seed=4)
+    ctx = SelectionContext(max_repeats=max_repeats, max_usage_percent=None, total_tiles=len(cells))
+    index = build_neighbor_index(tiles, kind)
+    tile_list = TileLibrary.from_descriptors([TileDescriptor(path=Path(f"{i}.png"), avg_rgb=tuple(rgb)) for i, rgb in enumerate(tiles)])
+
+    assert greedy_assign(cells, tile_list, ctx, neighbors=index) == _reference_greedy(cells, tiles, ctx)
+    lazy = lazy_assign(cells, tile_list, ctx, top_k=5, randomness=0.5, neighbors=index)
+    assert lazy == _reference_lazy(cells, tiles, ctx, top_k=5, randomness=0.5)
+
+
+def test_auto_search_picks_kdtree_only_for_large_low_dimensional_libraries() -> None:
+    assert isinstance(build_neighbor_index(_colors(100, seed=1)), BruteForceIndex)
+    assert isinstance(build_neighbor_index(_colors(5000, seed=1)), KDTreeIndex)
+    # Sub-cell descriptors are too wide for the KD-tree to prune.
+    assert isinstance(build_neighbor_index(_colors(5000, seed=1, dims=12)), BruteForceIndex)
+    assert isinstance(build_neighbor_index(_colors(5000, seed=1, dims=12), NeighborSearch.KDTREE), KDTreeIndex)
+
+
+def test_strategies_match_on_grid_descriptors() -> None:
+    tiles = _colors(300, seed=8, dims=12)
+    cells = _colors(500, seed=9, dims=12)
+    ctx = SelectionContext(max_repeats=2, max_usage_percent=None, total_tiles=len(cells))
+    library = TileLibrary(StringTable.from_strings([f"{i}.png" for i in range(len(tiles))]), tiles)
+    index = build_neighbor_index(tiles, NeighborSearch.KDTREE)
+
+    greedy = greedy_assign(cells, library, ctx, neighbors=index)
+    assert greedy == _reference_greedy(cells, tiles, ctx)
+    optimal = optimal_assign(cells, library, ctx, neighbors=index)
+    assert np.bincount(optimal).max() <= 2
+    assert _mean_cost(cells, tiles, optimal) <= _mean_cost(cells, tiles, greedy)
+
+
+@pytest.mark.parametrize("max_repeats", [1, 2])
+def test_blocked_greedy_matches_full_sort_with_ties(monkeypatch: pytest.MonkeyPatch, max_repeats: int) -> None:
+    # Coarse colours force ties and small blocks force the exhausted-library path.
+    monkeypatch.setattr("photo_mosaic.core.strategies._ASSIGN_BLOCK", 37)
+    tiles = np.round(_colors(300, seed=5) / 64) * 64
+    cells = np.round(_colors(700, seed=6) / 32) * 32
+    ctx = SelectionContext(max_repeats=max_repeats, max_usage_percent=None, total_tiles=len(cells))
+    tile_list = TileLibrary.from_descriptors([TileDescriptor(path=Path(f"{i}.png"), avg_rgb=tuple(rgb)) for i, rgb in enumerate(tiles)])
+
+    assert greedy_assign(cells, tile_list, ctx) == _reference_greedy(cells, tiles, ctx)
+
+
+def _mean_cost(cells: np.ndarray, tiles: np.ndarray, assignments: list[int]) -> float:
+    return float(np.mean(np.sum((tiles[assignments] - cells) ** 2, axis=1)))
+
+
+def test_local_search_improves_within_limits() -> None:
+    tiles = _colors(200, seed=7)
+    cells = _colors(3000, seed=8)
+    tile_list = TileLibrary.from_descriptors([TileDescriptor(path=Path(f"{i}.png"), avg_rgb=tuple(rgb)) for i, rgb in enumerate(tiles)])
+    start = np.random.default_rng(9).permutation(np.arange(len(cells)) % len(tiles)).tolist()
+    start_cost = _mean_cost(cells, tiles, start)
+
+    # Swaps keep every tile's usage count and only ever lower the cost.
+    swapped = random_improve_assign(cells, tile_list, start, steps=50_000)
+    assert sorted(swapped) == sorted(start)
+    assert _mean_cost(cells, tiles, swapped) < start_cost
+
+    ctx = SelectionContext(max_repeats=20, max_usage_percent=None, total_tiles=len(cells))
+    moved = full_optimize_assign(cells, tile_list, start, ctx, steps=50_000)
+    assert np.bincount(moved).max() <= 20
+    assert _mean_cost(cells, tiles, moved) < start_cost
+
+
+def test_local_search_runs_until_deadline() -> None:
+    tiles = _colors(200, seed=7)
+    cells = _colors(3000, seed=8)
+    tile_list = TileLibrary.from_descriptors([TileDescriptor(path=Path(f"{i}.png"), avg_rgb=tuple(rgb)) for i, rgb in enumerate(tiles)])
+    start = np.random.default_rng(9).permutation(np.arange(len(cells)) % len(tiles)).tolist()
+    ctx = SelectionContext(max_repeats=20, max_usage_percent=None, total_tiles=len(cells))
+
+    # Under a deadline the step count no longer applies: the search keeps improving.
+    stepped = full_optimize_assign(cells, tile_list, start, ctx, steps=1)
+    started = time.perf_counter()
+    timed = full_optimize_assign(cells, tile_list, start, ctx, steps=1, deadline=started + 0.5)
+    assert time.perf_counter() - started < 2
+    assert np.bincount(timed).max() <= 20
+    assert _mean_cost(cells, tiles, timed) < _mean_cost(cells, tiles, stepped)
+
+    swapped = random_improve_assign(cells, tile_list, start, steps=0, deadline=time.perf_counter() + 0.2)
+    assert sorted(swapped) == sorted(start)
+    assert _mean_cost(cells, tiles, swapped) < _mean_cost(cells, tiles, start)
+
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(BuildCancelled):
+        random_improve_assign(cells, tile_list, start, steps=50_000, cancel=cancel)
+    with pytest.raises(BuildCancelled):
+        optimal_assign(cells, tile_list, ctx, cancel=cancel)
+
+
+def test_optimal_time_limit_bounds_the_fallback() -> None:
+    tiles = _colors(8000, seed=12)
+    cells = _colors(40000, seed=13)
+    tile_list = TileLibrary.from_descriptors([TileDescriptor(path=Path(f"{i}.png"), avg_rgb=tuple(rgb)) for i, rgb in enumerate(tiles)])
+    ctx = SelectionContext(max_repeats=5, max_usage_percent=None, total_tiles=len(cells))
+
+    # Cells still bidding at the limit search only the tiles with room left, instead
+    # of widening through the whole library (about 11s here before).
+    started = time.perf_counter()
+    assigned = optimal_assign(cells, tile_list, ctx, time_limit=0.3)
+    assert time.perf_counter() - started < 6
+    assert len(assigned) == len(cells)
+    assert np.bincount(assigned).max() <= 5
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_optimal_matches_exhaustive_search(seed: int) -> None:
+    tiles = _colors(4, seed=seed)
+    cells = _colors(8, seed=seed + 100)
+    tile_list = TileLibrary.from_descriptors([TileDescriptor(path=Path(f"{i}.png"), avg_rgb=tuple(rgb)) for i, rgb in enumerate(tiles)])
+    ctx = SelectionContext(max_repeats=2, max_usage_percent=None, total_tiles=len(cells))
+    # Every way of filling the eight slots (two per tile) with the eight cells.
+    slots = np.repeat(np.arange(len(tiles)), 2)
+    best = min(_mean_cost(cells, tiles, slots[list(order)].tolist()) for order in itertools.permutations(range(len(cells))))
+
+    assigned = optimal_assign(cells, tile_list, ctx, gap=0.001)
+    assert np.bincount(assigned).max() <= 2
+    assert _mean_cost(cells, tiles, assigned) <= best + 0.001
+
+
+def test_optimal_beats_greedy_within_limits() -> None:
+    tiles = _colors(300, seed=10)
+    cells = _colors(1200, seed=11)
+    tile_list = TileLibrary.from_descriptors([TileDescriptor(path=Path(f"{i}.png"), avg_rgb=tuple(rgb)) for i, rgb in enumerate(tiles)])
+    ctx = SelectionContext(max_repeats=4, max_usage_percent=None, total_tiles=len(cells))
+
+    assigned = optimal_assign(cells, tile_list, ctx)
+    assert np.bincount(assigned).max() <= 4
+    assert _mean_cost(cells, tiles, assigned) < _mean_cost(cells, tiles, greedy_assign(cells, tile_list, ctx))
@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import json
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from photo_mosaic.cache import sidecar_path
+from photo_mosaic.config import ColorSpace, FitMode, TileShape
+from photo_mosaic.core import tile_index
+from photo_mosaic.core.image_utils import load_fitted
+from photo_mosaic.core.scanner import IMAGE_EXTENSIONS, scan_image_files
+from photo_mosaic.core.tile_index import TileLibrary, TileVariant, build_tile_index, build_tile_indexes
+
+
+def _make_library(root: Path, count: int) -> Path:
+    root.mkdir()
+    for i in range(count):
+        Image.new("RGB", (24 + i, 20), ((i * 37) % 256, (i * 91) % 256, (i * 13) % 256)).save(root / f"t{i:03d}.png")
+    (root / "broken.jpg").write_bytes(b"not an image")
+    return root
+
+
+def _spy_decodes(monkeypatch) -> list[Path]:
+    decoded: list[Path] = []
+    original = tile_index._index_tile
+
+    def _spy(path: Path, *args):
+        decoded.append(path)
+        return original(path, *args)
+
+    monkeypatch.setattr(tile_index, "_index_tile", _spy)
+    return decoded
+
+
+def test_parallel_index_matches_serial(tmp_path: Path) -> None:
+    tiles = _make_library(tmp_path / "tiles", 12)
+
+    serial = build_tile_index([tiles], (8, 8), FitMode.CROP)
+    parallel = build_tile_index([tiles], (8, 8), FitMode.CROP, workers=3)
+
+    assert len(serial) == 12
+    assert [(t.path, t.avg_rgb) for t in parallel] == [(t.path, t.avg_rgb) for t in serial]
+
+
+def test_incremental_cache_only_indexes_changed_files(tmp_path: Path, monkeypatch) -> None:
+    tiles = _make_library(tmp_path / "tiles", 4)
+    cache_path = tmp_path / "cache.json"
+    build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path)
+
+    indexed = _spy_decodes(monkeypatch)
+
+    # Warm run: nothing decoded, including the broken file recorded as failed.
+    assert len(build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path)) == 4
+    assert indexed == []
+
+    (tiles / "t000.png").unlink()
+    Image.new("RGB", (30, 30), (1, 2, 3)).save(tiles / "new.png")
+    Image.new("RGB", (40, 40), (9, 9, 9)).save(tiles / "t001.png")
+    result = build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path)
+
+    assert sorted(p.name for p in indexed) == ["new.png", "t001.png"]
+    assert sorted(t.path.name for t in result) == ["new.png", "t001.png", "t002.png", "t003.png"]
+    assert next(t for t in result if t.path.name == "t001.png").avg_rgb == (9.0, 9.0, 9.0)
+
+
+def test_file_removed_during_scan_is_skipped(tmp_path: Path, monkeypatch) -> None:
+    tiles = _make_library(tmp_path / "tiles", 4)
+    original = tile_index.scan_image_files
+
+    def _listed_then_removed(*args):
+        for path, stat in original(*args):
+            if path.endswith("t002.png"):
+                Path(path).unlink()
+            yield path, stat
+
+    monkeypatch.setattr(tile_index, "scan_image_files", _listed_then_removed)
+    result = build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=tmp_path / "cache.json", content_hash=True)
+    assert sorted(t.path.name for t in result) == ["t000.png", "t001.png", "t003.png"]
+
+
+def test_binary_cache_loads_memmapped_without_rescan(tmp_path: Path) -> None:
+    tiles = _make_library(tmp_path / "tiles", 5)
+    cache_path = tmp_path / "cache" / "tile_index.json"
+    built = build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path, content_hash=True)
+
+    (tiles / "t000.png").unlink()
+    loaded = build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path, content_hash=True, rescan=False)
+
+    assert isinstance(loaded.colors, np.memmap)
+    assert [(t.path, t.avg_rgb) for t in loaded] == [(t.path, t.avg_rgb) for t in built]
+    rescanned = build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path, content_hash=True)
+    assert len(rescanned) == 4
+
+
+def test_variants_share_one_store(tmp_path: Path, monkeypatch) -> None:
+    tiles = _make_library(tmp_path / "tiles", 3)
+    cache_path = tmp_path / "tile_index.json"
+    rect = TileVariant((8, 8), FitMode.CROP)
+    hex_variant = TileVariant((12, 12), FitMode.PAD, TileShape.HEX, 0.3)
+    built = build_tile_indexes([tiles], [rect, hex_variant], cache_path=cache_path)
+
+    decodes = _spy_decodes(monkeypatch)
+
+    # Switching between cached variants never re-indexes.
+    for variant, args in ((rect, ((8, 8), FitMode.CROP)), (hex_variant, ((12, 12), FitMode.PAD, TileShape.HEX, 0.3))):
+        index = build_tile_index([tiles], *args, cache_path=cache_path)
+        np.testing.assert_array_equal(index.colors, built[variant].colors)
+    assert decodes == []
+
+    # A new file is decoded once and added to every stored variant.
+    Image.new("RGB", (30, 30), (1, 2, 3)).save(tiles / "new.png")
+    build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path)
+    assert [p.name for p in decodes] == ["new.png"]
+    warm = build_tile_indexes([tiles], [hex_variant], cache_path=cache_path, rescan=False)
+    assert len(warm[hex_variant]) == 4
+
+
+def test_atlas_is_stored_and_reused(tmp_path: Path, monkeypatch) -> None:
+    tiles = _make_library(tmp_path / "tiles", 3)
+    cache_path = tmp_path / "tile_index.json"
+    hex_variant = TileVariant((8, 6), FitMode.CROP, TileShape.HEX)
+    build_tile_indexes([tiles], [TileVariant((8, 6), FitMode.CROP), hex_variant], cache_path=cache_path)
+
+    # Adding the atlas to an existing store decodes the good tiles once more.
+    decodes = _spy_decodes(monkeypatch)
+    built = build_tile_index([tiles], (8, 6), FitMode.CROP, cache_path=cache_path, atlas=True)
+    assert len(decodes) == 3
+    assert built.pixels.shape == (3, 6, 8, 3)
+    for i in range(3):
+        np.testing.assert_array_equal(built.pixels[i], np.asarray(load_fitted(built.path(i), (8, 6), FitMode.CROP)))
+
+    # The hex variant of the same size and fit shares the atlas.
+    hex_index = build_tile_indexes([tiles], [hex_variant], cache_path=cache_path, atlas=True, rescan=False)[hex_variant]
+    assert isinstance(hex_index.pixels, np.memmap)
+    np.testing.assert_array_equal(hex_index.pixels, built.pixels)
+    assert len(decodes) == 3
+
+
+def test_atlas_is_assembled_on_disk(tmp_path: Path) -> None:
+    tiles = _make_library(tmp_path / "tiles", 60)
+    cache_path = tmp_path / "cache" / "tile_index.json"
+    build_tile_index([tiles], (64, 64), FitMode.CROP, cache_path=cache_path)
+
+    # Fitted pixels are spooled and written into the sidecar as tiles finish, so no
+    # copy of the atlas is held in memory, whether it is added to a store or built cold.
+    for refresh in (False, True):
+        tracemalloc.start()
+        try:
+            built = build_tile_index([tiles], (64, 64), FitMode.CROP, cache_path=cache_path, atlas=True, refresh_cache=refresh)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert isinstance(built.pixels, np.memmap)
+        assert peak < built.pixels.nbytes / 2
+    np.testing.assert_array_equal(built.pixels[5], np.asarray(load_fitted(built.path(5), (64, 64), FitMode.CROP)))
+    assert sorted(path.suffix for path in cache_path.parent.iterdir()) == [".json"] + [".npy"] * 5
+
+
+def test_unused_variants_and_atlases_are_pruned(tmp_path: Path, monkeypatch) -> None:
+    tiles = _make_library(tmp_path / "tiles", 3)
+    cache_path = tmp_path / "tile_index.json"
+    build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path, atlas=True)
+    build_tile_index([tiles], (12, 12), FitMode.PAD, cache_path=cache_path, atlas=True)
+    assert sidecar_path(cache_path, "atlas.12x12-pad").exists()
+
+    # Once nothing has asked for 12x12 in a while, it is dropped instead of kept current.
+    real = time.time
+    monkeypatch.setattr(time, "time", lambda: real() + tile_index.MAX_UNUSED_SECONDS + 60)
+    index = build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path, atlas=True, rescan=False)
+    assert len(index) == 3
+    manifest = json.loads(cache_path.read_text(encoding="utf-8"))
+    assert list(manifest["variants"]) == ["8x8-crop-rect"] and list(manifest["atlases"]) == ["8x8-crop"]
+    assert manifest["used"]["features.8x8-crop-rect"] > real() + 60
+    assert not sidecar_path(cache_path, "atlas.12x12-pad").exists()
+    assert not sidecar_path(cache_path, "features.12x12-pad-rect").exists()
+
+    decodes = _spy_decodes(monkeypatch)
+    Image.new("RGB", (30, 30), (1, 2, 3)).save(tiles / "new.png")
+    build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path, atlas=True)
+    assert [p.name for p in decodes] == ["new.png"]
+    assert list(json.loads(cache_path.read_text(encoding="utf-8"))["variants"]) == ["8x8-crop-rect"]
+
+
+def test_failed_decode_for_a_new_variant_keeps_stored_tiles(tmp_path: Path, monkeypatch) -> None:
+    tiles = _make_library(tmp_path / "tiles", 4)
+    cache_path = tmp_path / "tile_index.json"
+    build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path)
+    original = tile_index._index_tile
+    monkeypatch.setattr(tile_index, "_index_tile", lambda path, *args: None if path.name == "t001.png" else original(path, *args))
+
+    wide = build_tile_index([tiles], (12, 12), FitMode.CROP, cache_path=cache_path)
+    assert [t.path.name for t in wide] == ["t000.png", "t002.png", "t003.png"]
+    assert len(build_tile_index([tiles], (8, 8), FitMode.CROP, cache_path=cache_path, rescan=False)) == 4
+
+    # The new variant was not stored without the tile, so the next run completes it.
+    monkeypatch.setattr(tile_index, "_index_tile", original)
+    assert len(build_tile_index([tiles], (12, 12), FitMode.CROP, cache_path=cache_path)) == 4
+    assert len(build_tile_index([tiles], (12, 12), FitMode.CROP, cache_path=cache_path, rescan=False)) == 4
+
+
+def test_library_slices_and_filters_columns(tmp_path: Path) -> None:
+    tiles = _make_library(tmp_path / "tiles", 6)
+    library = build_tile_index([tiles], (8, 6), FitMode.CROP, cache_path=tmp_path / "tile_index.json", atlas=True)
+    paths = [library.path(i) for i in range(len(library))]
+
+    head = library[1:4]
+    assert isinstance(head, TileLibrary) and len(head) == 3
+    assert np.shares_memory(head.colors, library.colors)
+    assert [head.path(i) for i in range(3)] == paths[1:4]
+
+    picked = library[np.array([5, 0, -2])]
+    np.testing.assert_array_equal(picked.colors, library.colors[[5, 0, 4]])
+    np.testing.assert_array_equal(picked.pixels, library.pixels[[5, 0, 4]])
+    assert [tile.path for tile in picked] == [paths[5], paths[0], paths[4]]
+
+    red = library.where(library.colors[:, 0] > 100)
+    assert [tile.path for tile in red] == [tile.path for tile in library if tile.avg_rgb[0] > 100]
+    assert TileLibrary.from_descriptors(list(red))[0] == red[0]
+
+
+def test_scanner_streams_the_same_files_as_rglob(tmp_path: Path) -> None:
+    root = tmp_path / "tiles"
+    for i in range(30):
+        folder = root / f"d{i % 4}" / f"e{i % 3}"
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f"t{i}.{'PNG' if i % 5 == 0 else 'jpg'}").write_bytes(b"x")
+    (root / "notes.txt").write_bytes(b"x")
+    (root / "dir.png").mkdir()
+    (tmp_path / "outside").mkdir()
+    (tmp_path / "outside" / "linked.png").write_bytes(b"x")
+    (root / "link").symlink_to(tmp_path / "outside", target_is_directory=True)
+    (root / "file-link.png").symlink_to(tmp_path / "outside" / "linked.png")
+
+    expected = sorted(str(p) for p in root.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS and p.is_file())
+    # Overlapping and missing roots list each file once.
+    scanned = [path for path, _ in scan_image_files([root, root / "d1", tmp_path / "missing"], workers=3)]
+    assert sorted(scanned) == expected and len(scanned) == len(expected) == 31
+
+    stream = scan_image_files([root], workers=2)
+    path, stat = next(stream)
+    assert stat.st_size == 1 and path in expected
+    stream.close()
+
+
+def test_interrupted_index_resumes_from_checkpoints(tmp_path: Path, monkeypatch) -> None:
+    tiles = _make_library(tmp_path / "tiles", 8)
+    cache_path = tmp_path / "tile_index.json"
+    expected = build_tile_index([tiles], (8, 6), FitMode.CROP, atlas=True)
+
+    original = tile_index._index_tile
+    decoded: list[Path] = []
+
+    def _crash_after_five(path: Path, *args):
+        if len(decoded) == 5:
+            raise KeyboardInterrupt
+        decoded.append(path)
+        return original(path, *args)
+
+    monkeypatch.setattr(tile_index, "_index_tile", _crash_after_five)
+    with pytest.raises(KeyboardInterrupt):
+        build_tile_index([tiles], (8, 6), FitMode.CROP, cache_path=cache_path, atlas=True, checkpoint_interval=0.0)
+    assert not cache_path.exists()
+    assert tile_index._checkpoint_paths(cache_path)
+
+    # The rerun only decodes the rest (including the broken file), then folds the checkpoints into the cache.
+    monkeypatch.setattr(tile_index, "_index_tile", original)
+    resumed_decodes = _spy_decodes(monkeypatch)
+    resumed = build_tile_index([tiles], (8, 6), FitMode.CROP, cache_path=cache_path, atlas=True)
+    assert sorted(resumed_decodes) == sorted(set(tiles.iterdir()) - set(decoded))
+    assert [(t.path, t.avg_rgb) for t in resumed] == [(t.path, t.avg_rgb) for t in expected]
+    np.testing.assert_array_equal(resumed.pixels, expected.pixels)
+    assert tile_index._checkpoint_paths(cache_path) == []
+    trusted = build_tile_index([tiles], (8, 6), FitMode.CROP, cache_path=cache_path, atlas=True, rescan=False)
+    assert [(t.path, t.avg_rgb) for t in trusted] == [(t.path, t.avg_rgb) for t in expected]
+
+
+def test_grid_variant_stores_sub_cell_descriptors(tmp_path: Path) -> None:
+    tiles = _make_library(tmp_path / "tiles", 4)
+    cache_path = tmp_path / "tile_index.json"
+    plain = build_tile_index([tiles], (8, 6), FitMode.CROP, cache_path=cache_path)
+    grid = build_tile_index([tiles], (8, 6), FitMode.CROP, grid=2, cache_path=cache_path)
+
+    assert grid.colors.shape == (4, 12)
+    assert [t.path for t in grid] == [t.path for t in plain]
+    for coarse, fine in zip(plain, grid):
+        np.testing.assert_allclose(fine.avg_rgb, coarse.avg_rgb, atol=1e-3)
+    # Both variants live in the one store.
+    trusted = build_tile_index([tiles], (8, 6), FitMode.CROP, grid=2, cache_path=cache_path, rescan=False)
+    np.testing.assert_array_equal(trusted.colors, grid.colors)
+
+
+def test_color_space_variant_is_derived_without_decoding(tmp_path: Path, monkeypatch) -> None:
+    tiles = _make_library(tmp_path / "tiles", 4)
+    cache_path = tmp_path / "tile_index.json"
+    rgb = build_tile_index([tiles], (8, 6), FitMode.CROP, grid=2, cache_path=cache_path)
+    fresh = build_tile_index([tiles], (8, 6), FitMode.CROP, grid=2, color_space=ColorSpace.LAB)
+
+    decodes = _spy_decodes(monkeypatch)
+    lab = build_tile_index([tiles], (8, 6), FitMode.CROP, grid=2, color_space=ColorSpace.LAB, cache_path=cache_path, rescan=False)
+    assert decodes == []
+    assert lab.color_space == ColorSpace.LAB
+    np.testing.assert_allclose(lab.colors, fresh.colors, atol=1e-3)
+    # Descriptors still report the tile's RGB mean.
+    for plain, converted in zip(rgb, lab):
+        np.testing.assert_allclose(converted.avg_rgb, plain.avg_rgb, atol=1e-2)
+
+    # The derived features were written to the cache and are memmapped from then on.
+    trusted = build_tile_index([tiles], (8, 6), FitMode.CROP, grid=2, color_space=ColorSpace.LAB, cache_path=cache_path, rescan=False)
+    assert isinstance(trusted.colors, np.memmap)
+    np.testing.assert_array_equal(trusted.colors, lab.colors)
+    assert decodes == []